@@ -20,13 +20,17 @@ import base64
 import time
 
 from biz.gitlab.webhook_handler import slugify_url
+from biz.queue.admission import get_admission_controller
+from biz.queue.job_tracker import get_job_tracker
+from biz.queue.scheduler import job_lane
 from biz.queue.worker import handle_merge_request_event, handle_push_event, handle_github_pull_request_event, \
     handle_github_push_event
 from biz.service.review_service import ReviewService
 from biz.utils.im import notifier
 from biz.utils.im.team_webhook import TeamWebhookNotifier
-from biz.utils.log import logger
-from biz.utils.queue import handle_queue
+from biz.utils.log import logger, sampled
+from biz.utils import protected_branches
+from biz.utils.queue import handle_queue, get_queue_stats, start_queue_consumer
 from biz.utils.reporter import Reporter
 from    biz.utils.api_helpers    import    ApiResponse,    Validator,    handle_api_errors,    log_api_call,    ValidationError
 
@@ -52,6 +56,15 @@ USER_CREDENTIALS = {
 
 push_review_enabled = os.environ.get('PUSH_REVIEW_ENABLED', '0') == '1'
 
+# webhook 组 gunicorn worker 只接收 webhook（见 conf/gunicorn.conf.py），dashboard 的接口与页面由 dashboard 组处理
+WEBHOOK_GROUP_PATHS = ('/review/webhook', '/api/health')
+
+
+@api_app.before_request
+def restrict_webhook_group():
+    if os.getenv('GUNICORN_GROUP') == 'webhook' and request.path not in WEBHOOK_GROUP_PATHS:
+        return jsonify({"error": "Not Found"}), 404
+
 
 # Health check endpoint
 @api_app.route('/api/health', methods=['GET'])
@@ -65,6 +78,61 @@ def health_check():
     }), 200
 
 
+@api_app.route('/api/queue/stats', methods=['GET'])
+@jwt_required()
+def queue_stats():
+    """队列与工作进程池运行状态"""
+    try:
+        return jsonify({'success': True, 'data': get_queue_stats()}), 200
+    except Exception as e:
+        logger.error(f"Get queue stats error: {e}")
+        return jsonify({'success': False, 'message': 'Failed to get queue stats'}), 500
+
+
+@api_app.route('/api/jobs', methods=['GET'])
+@jwt_required()
+def list_jobs():
+    """审查任务列表，支持按状态、项目、类型过滤"""
+    try:
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = min(max(request.args.get('page_size', 20, type=int), 1), 200)
+        result = get_job_tracker().list_jobs(status=request.args.get('status'), project=request.args.get('project'),
+                                             kind=request.args.get('kind'), limit=page_size,
+                                             offset=(page - 1) * page_size)
+        return jsonify({'success': True, 'data': result['items'], 'total': result['total'], 'page': page,
+                        'page_size': page_size}), 200
+    except Exception as e:
+        logger.error(f"List jobs error: {e}")
+        return jsonify({'success': False, 'message': 'Failed to list jobs'}), 500
+
+
+@api_app.route('/api/jobs/stats', methods=['GET'])
+@jwt_required()
+def job_stats():
+    """各阶段及各项目的耗时 p50/p95/p99，默认统计最近 24 小时"""
+    try:
+        hours = request.args.get('hours', 24, type=float)
+        data = get_job_tracker().aggregates(since=time.time() - hours * 3600, project=request.args.get('project'))
+        return jsonify({'success': True, 'data': data}), 200
+    except Exception as e:
+        logger.error(f"Get job stats error: {e}")
+        return jsonify({'success': False, 'message': 'Failed to get job stats'}), 500
+
+
+@api_app.route('/api/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id: str):
+    """单个任务的状态与各阶段耗时"""
+    try:
+        job = get_job_tracker().get_job(job_id)
+        if job is None:
+            return jsonify({'success': False, 'message': 'Job not found'}), 404
+        return jsonify({'success': True, 'data': job}), 200
+    except Exception as e:
+        logger.error(f"Get job error: {e}")
+        return jsonify({'success': False, 'message': 'Failed to get job'}), 500
+
+
 @api_app.route('/')
 def home():
     """Serve the frontend index.html"""
@@ -1057,6 +1125,13 @@ def setup_scheduler():
         logger.error(traceback.format_exc())
 
 
+def start_background_services():
+    """启动定时任务调度器与队列消费者；多 worker 部署时由 gunicorn 钩子保证只在一个进程中执行"""
+    setup_scheduler()
+    # 启动队列消费者（sqlite 驱动），同时回收上次进程退出时未完成的任务
+    start_queue_consumer()
+
+
 # 处理 GitLab Merge Request Webhook
 @api_app.route('/review/webhook', methods=['POST'])
 def handle_webhook():
@@ -1077,6 +1152,21 @@ def handle_webhook():
         return jsonify({'message': 'Invalid data format'}), 400
 
 
+def enqueue_webhook_event(function, data, token, url, url_slug, source, event):
+    """
+    经过准入控制后将事件入队；队列过载时返回 503 响应（携带 Retry-After），否则返回 None
+    原始请求体随任务一起提交，启用暂存时队列中只传递暂存记录 ID
+    """
+    decision = get_admission_controller().admit(job_lane(data), url_slug)
+    if not decision.accepted:
+        response = jsonify({'message': f'Review queue is overloaded({decision.reason}), please retry later.'})
+        response.headers['Retry-After'] = str(decision.retry_after)
+        return response, 503
+    handle_queue(function, data, token, url, url_slug, lane=decision.lane, raw_body=request.get_data(),
+                 source=source, event=event)
+    return None
+
+
 def handle_github_webhook(event_type, data):
     # 获取GitHub配置
     github_token = os.getenv('GITHUB_ACCESS_TOKEN') or request.headers.get('X-GitHub-Token')
@@ -1086,22 +1176,35 @@ def handle_github_webhook(event_type, data):
     github_url = os.getenv('GITHUB_URL') or 'https://github.com'
     github_url_slug = slugify_url(github_url)
 
-    # 打印整个payload数据
-    logger.info(f'Received GitHub event: {event_type}')
-    logger.info(f'Payload: {json.dumps(data)}')
+    # 只记录事件类型与请求体大小（按 LOG_SAMPLE_RATE 采样），完整的请求体可通过 webhook 暂存区查看
+    if sampled():
+        logger.info('Received GitHub event: %s, body size: %s bytes', event_type, request.content_length)
 
     if event_type == "pull_request":
         # 使用handle_queue进行异步处理
-        handle_queue(handle_github_pull_request_event, data, github_token, github_url, github_url_slug)
+        overloaded = enqueue_webhook_event(handle_github_pull_request_event, data, github_token, github_url,
+                                           github_url_slug, 'github', event_type)
+        if overloaded:
+            return overloaded
         # 立马返回响应
         return jsonify(
             {'message': f'GitHub request received(event_type={event_type}), will process asynchronously.'}), 200
     elif event_type == "push":
         # 使用handle_queue进行异步处理
-        handle_queue(handle_github_push_event, data, github_token, github_url, github_url_slug)
+        overloaded = enqueue_webhook_event(handle_github_push_event, data, github_token, github_url, github_url_slug,
+                                           'github', event_type)
+        if overloaded:
+            return overloaded
         # 立马返回响应
         return jsonify(
             {'message': f'GitHub request received(event_type={event_type}), will process asynchronously.'}), 200
+    elif event_type in protected_branches.GITHUB_INVALIDATE_EVENTS:
+        # 分支保护规则或仓库变化，删除该仓库的受保护分支缓存
+        repo_full_name = data.get('repository', {}).get('full_name')
+        if repo_full_name:
+            protected_branches.invalidate(protected_branches.cache_key(github_url_slug, repo_full_name))
+        return jsonify(
+            {'message': f'GitHub request received(event_type={event_type}), protected branch cache invalidated.'}), 200
     else:
         error_message = f'Only pull_request and push events are supported for GitHub webhook, but received: {event_type}.'
         logger.error(error_message)
@@ -1134,24 +1237,37 @@ def handle_gitlab_webhook(data):
 
     gitlab_url_slug = slugify_url(gitlab_url)
 
-    # 打印整个payload数据，或根据需求进行处理
-    logger.info(f'Received event: {object_kind}')
-    logger.info(f'Payload: {json.dumps(data)}')
+    # 只记录事件类型与请求体大小（按 LOG_SAMPLE_RATE 采样），完整的请求体可通过 webhook 暂存区查看
+    if sampled():
+        logger.info('Received event: %s, body size: %s bytes', object_kind, request.content_length)
 
     # 处理Merge Request Hook
     if object_kind == "merge_request":
         # 创建一个新进程进行异步处理
-        handle_queue(handle_merge_request_event, data, gitlab_token, gitlab_url, gitlab_url_slug)
+        overloaded = enqueue_webhook_event(handle_merge_request_event, data, gitlab_token, gitlab_url, gitlab_url_slug,
+                                           'gitlab', object_kind)
+        if overloaded:
+            return overloaded
         # 立马返回响应
         return jsonify(
             {'message': f'Request received(object_kind={object_kind}), will process asynchronously.'}), 200
     elif object_kind == "push":
         # 创建一个新进程进行异步处理
         # TODO check if PUSH_REVIEW_ENABLED is needed here
-        handle_queue(handle_push_event, data, gitlab_token, gitlab_url, gitlab_url_slug)
+        overloaded = enqueue_webhook_event(handle_push_event, data, gitlab_token, gitlab_url, gitlab_url_slug, 'gitlab',
+                                           object_kind)
+        if overloaded:
+            return overloaded
         # 立马返回响应
         return jsonify(
             {'message': f'Request received(object_kind={object_kind}), will process asynchronously.'}), 200
+    elif not object_kind and data.get('event_name') in protected_branches.GITLAB_INVALIDATE_EVENTS:
+        # 系统钩子：项目变化时删除该项目的受保护分支缓存
+        event_name = data.get('event_name')
+        if data.get('project_id') is not None:
+            protected_branches.invalidate(protected_branches.cache_key(gitlab_url_slug, str(data['project_id'])))
+        return jsonify(
+            {'message': f'System hook received(event_name={event_name}), protected branch cache invalidated.'}), 200
     else:
         error_message = f'Only merge_request and push events are supported (both Webhook and System Hook), but received: {object_kind}.'
         logger.error(error_message)
@@ -1214,8 +1330,8 @@ if __name__ == '__main__':
         logger.info("端口清理完成，等待 1 秒...")
         time.sleep(1)
 
-    # 启动定时任务调度器
-    setup_scheduler()
+    # 启动定时任务调度器与队列消费者
+    start_background_services()
 
-    # 启动Flask API服务
+    # 启动Flask 开发服务器；生产环境请使用 python serve.py（gunicorn 多 worker）
     api_app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,49 @@
+from unittest import TestCase, main, mock
+
+from biz.github.webhook_handler import PullRequestHandler, filter_changes, iter_pages, with_query
+
+FILES_URL = 'https://api.github.com/repos/a/b/pulls/1/files'
+
+
+def page_response(page: int, last_page: int):
+    response = mock.Mock(status_code=200, text='')
+    response.json.return_value = [{'filename': f'src/{page}_{i}.py', 'patch': '+x', 'status': 'modified'}
+                                  for i in range(2)]
+    response.links = {'last': {'url': with_query(FILES_URL, per_page=100, page=last_page)}} if last_page > 1 else {}
+    return response
+
+
+class TestPullRequestPagination(TestCase):
+    def test_all_pages_fetched(self):
+        """根据 Link 头获取全部分页，并按页序产出"""
+        def fake_get(url, headers=None):
+            page = int(url.rsplit('page=', 1)[1]) if '&page=' in url else 1
+            return page_response(page, 3)
+
+        handler = PullRequestHandler({'pull_request': {'number': 1}, 'repository': {'full_name': 'a/b'}}, 't', '')
+        with mock.patch('biz.utils.http_client.get', side_effect=fake_get) as get:
+            raw_changes = handler.get_pull_request_changes()
+            # 返回前已获取全部分页，获取阶段的耗时与截止时间覆盖所有分页
+            self.assertEqual(get.call_count, 3)
+            changes = filter_changes(raw_changes)
+        self.assertEqual([change['new_path'] for change in changes][::2], ['src/1_0.py', 'src/2_0.py', 'src/3_0.py'])
+        self.assertIn('per_page=100', get.call_args_list[0].args[0])
+
+    def test_executor_released_on_close(self):
+        """调用方提前停止时关闭线程池；未开始迭代时不创建线程池"""
+        with mock.patch('biz.github.webhook_handler.ThreadPoolExecutor') as executor_class, \
+                mock.patch('biz.utils.http_client.get'):
+            pages = iter_pages(page_response(1, 3), ['first'], {})
+            pages.close()
+            executor_class.assert_not_called()
+            pages = iter_pages(page_response(1, 3), ['first'], {})
+            self.assertEqual(next(pages), ['first'])
+            pages.close()
+        executor_class.return_value.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+    def test_with_query(self):
+        self.assertEqual(with_query('https://x/y?page=3&per_page=100', page=2), 'https://x/y?page=2&per_page=100')
+
+
+if __name__ == '__main__':
+    main()
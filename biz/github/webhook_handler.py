@@ -1,10 +1,13 @@
 import os
-import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 
-import requests
-import fnmatch
-from biz.utils.log import logger
+from biz.gitlab.webhook_handler import slugify_url
+from biz.queue.retry import RetryLater, diff_poll_delays
+from biz.utils import diff_scanner, http_client, protected_branches
+from biz.utils.log import logger, summarize_changes, truncated
 
 
 
@@ -13,48 +16,119 @@ def filter_changes(changes: list):
     过滤数据，只保留支持的文件类型以及必要的字段信息
     专门处理GitHub格式的变更
     '''
-    # 从环境变量中获取支持的文件扩展名
-    supported_extensions = os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
-    
-    # 筛选出未被删除的文件
-    not_deleted_changes = []
+    # 从环境变量中获取支持的文件扩展名（按取值缓存为后缀元组）
+    extensions = diff_scanner.supported_extensions()
+    logger.info(f"SUPPORTED_EXTENSIONS: {extensions}")
+
+    deleted = 0
+    filtered_changes = []
     for change in changes:
         # 优先检查status字段是否为"removed"
         if change.get('status') == 'removed':
-            logger.info(f"Detected file deletion via status field: {change.get('new_path')}")
+            logger.debug("Detected file deletion via status field: %s", change.get('new_path'))
+            deleted += 1
             continue
-            
-        # 如果没有status字段或status不为"removed"，继续检查diff模式
+
+        # 如果没有status字段或status不为"removed"，继续检查diff模式：hunk头为 +0,0 且只有删除行
         diff = change.get('diff', '')
-        if diff:
-            diff_header_match = re.match(r'@@ -\d+,\d+ \+0,0 @@', diff)
-            if diff_header_match:
-                # 检查除了diff头部外的所有行是否都以减号开头
-                diff_lines = diff.split('\n')[1:]  # 跳过diff头部
-                if all(line.startswith('-') or not line for line in diff_lines):
-                    logger.info(f"Detected file deletion via diff pattern: {change.get('new_path')}")
-                    continue
-                    
-        not_deleted_changes.append(change)
-    
-    logger.info(f"SUPPORTED_EXTENSIONS: {supported_extensions}")
-    logger.info(f"After filtering deleted files: {not_deleted_changes}")
-    
-    # 过滤 `new_path` 以支持的扩展名结尾的元素, 仅保留diff和new_path字段
-    filtered_changes = [
-        {
-            'diff': item.get('diff', ''),
-            'new_path': item['new_path'],
-            'additions': item.get('additions', 0),
-            'deletions': item.get('deletions', 0),
-        }
-        for item in not_deleted_changes
-        if any(item.get('new_path', '').endswith(ext) for ext in supported_extensions)
-    ]
-    logger.info(f"After filtering by extension: {filtered_changes}")
+        if diff_scanner.is_deletion_diff(diff):
+            logger.debug("Detected file deletion via diff pattern: %s", change.get('new_path'))
+            deleted += 1
+            continue
+
+        # 过滤 `new_path` 以支持的扩展名结尾的元素, 保留diff、路径与文件状态（added、renamed 等）
+        if diff_scanner.is_supported(change.get('new_path'), extensions):
+            filtered_changes.append({
+                'diff': diff,
+                'new_path': change['new_path'],
+                'old_path': change.get('old_path'),
+                'status': change.get('status', ''),
+                'additions': change.get('additions', 0),
+                'deletions': change.get('deletions', 0),
+            })
+
+    logger.info("Filtered changes: %s files, %s deleted, kept %s", len(changes), deleted,
+                summarize_changes(filtered_changes))
     return filtered_changes
 
 
+def github_page_size() -> int:
+    return min(int(os.getenv('GITHUB_PAGE_SIZE', 100)), 100)
+
+
+def with_query(url: str, **params) -> str:
+    '''在 URL 上设置查询参数（覆盖同名参数）'''
+    parts = urlsplit(url)
+    query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    query.update({key: str(value) for key, value in params.items()})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _get_page(url: str, headers: dict) -> list:
+    response = http_client.get(url, headers=headers)
+    if response.status_code != 200:
+        logger.warn("Failed to get page from GitHub (URL: %s): %s, %s",
+                    url, response.status_code, truncated(response.text))
+        raise RuntimeError(f"Failed to get page from GitHub: {response.status_code}, URL: {url}")
+    return response.json()
+
+
+def iter_pages(first_response, first_page: list, headers: dict) -> Iterator[list]:
+    '''
+    根据首页响应的 Link 头获取其余分页，逐页产出（包括首页）
+
+    Link 头给出最后一页时开始迭代即并发请求其余所有页（GITHUB_PAGE_CONCURRENCY），按页序产出；
+    只有 next 链接时逐页顺序请求。线程池在迭代器耗尽、出错或被关闭时释放，未开始迭代时不会创建。
+    '''
+    last_url = first_response.links.get('last', {}).get('url')
+    if not last_url:
+        return _iter_next_pages(first_response, first_page, headers)
+
+    last_page = int(parse_qs(urlsplit(last_url).query).get('page', ['1'])[0])
+    urls = [with_query(last_url, page=page) for page in range(2, last_page + 1)]
+    if not urls:
+        return iter([first_page])
+    return _iter_page_futures(first_page, urls, headers)
+
+
+def _iter_page_futures(first_page: list, urls: list, headers: dict) -> Iterator[list]:
+    executor = ThreadPoolExecutor(max_workers=min(len(urls), int(os.getenv('GITHUB_PAGE_CONCURRENCY', 4))),
+                                  thread_name_prefix='github-pages')
+    try:
+        futures = [executor.submit(_get_page, url, headers) for url in urls]
+        logger.info(f"Fetching {len(urls)} more pages from GitHub concurrently, URL: {urls[-1]}")
+        yield first_page
+        for future in futures:
+            yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_next_pages(response, first_page: list, headers: dict) -> Iterator[list]:
+    yield first_page
+    next_url = response.links.get('next', {}).get('url')
+    while next_url:
+        response = http_client.get(next_url, headers=headers)
+        if response.status_code != 200:
+            logger.warn("Failed to get page from GitHub (URL: %s): %s, %s",
+                        next_url, response.status_code, truncated(response.text))
+            raise RuntimeError(f"Failed to get page from GitHub: {response.status_code}, URL: {next_url}")
+        yield response.json()
+        next_url = response.links.get('next', {}).get('url')
+
+
+def file_to_change(file: dict) -> dict:
+    '''GitHub 的文件变更转换成GitLab格式的change'''
+    return {
+        'old_path': file.get('previous_filename') or file.get('filename'),
+        'new_path': file.get('filename'),
+        'diff': file.get('patch', ''),
+        'status': file.get('status', ''),
+        'additions': file.get('additions', 0),
+        'deletions': file.get('deletions', 0),
+    }
+
+
 class PullRequestHandler:
     def __init__(self, webhook_data: dict, github_token: str, github_url: str):
         self.pull_request_number = None
@@ -77,52 +151,52 @@ class PullRequestHandler:
         self.repo_full_name = self.webhook_data.get('repository', {}).get('full_name')
         self.action = self.webhook_data.get('action')
 
-    def get_pull_request_changes(self) -> list:
+    def get_pull_request_changes(self) -> List[dict]:
+        '''
+        获取 Pull Request 的全部文件变更（每页 100 个文件）；首页在当前线程获取，其余分页并发下载，
+        返回前全部分页均已获取，获取耗时与截止时间（SCM_FETCH_TIMEOUT）覆盖所有分页
+        '''
         # 检查是否为 Pull Request Hook 事件
         if self.event_type != 'pull_request':
             logger.warn(f"Invalid event type: {self.event_type}. Only 'pull_request' event is supported now.")
             return []
 
-        # GitHub pull request changes API可能存在延迟，多次尝试
-        max_retries = 3  # 最大重试次数
-        retry_delay = 10  # 重试间隔时间（秒）
-        for attempt in range(max_retries):
+        # webhook 中声明没有文件变更时无需请求
+        if self.webhook_data.get('pull_request', {}).get('changed_files') == 0:
+            logger.info("Pull request has no changed files.")
+            return []
+
+        # GitHub pull request changes API可能存在延迟：先按带抖动的指数退避短暂轮询，仍为空时延迟重新入队
+        url = with_query(f"https://api.github.com/repos/{self.repo_full_name}/pulls/{self.pull_request_number}/files",
+                         per_page=github_page_size())
+        headers = {
+            'Authorization': f'token {self.github_token}',
+            'Accept': 'application/vnd.github.v3+json'
+        }
+        delays = diff_poll_delays()
+        for attempt in range(len(delays) + 1):
             # 调用 GitHub API 获取 Pull Request 的 files（变更）
-            url = f"https://api.github.com/repos/{self.repo_full_name}/pulls/{self.pull_request_number}/files"
-            headers = {
-                'Authorization': f'token {self.github_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            response = requests.get(url, headers=headers)
+            response = http_client.get(url, headers=headers)
             logger.debug(
-                f"Get changes response from GitHub (attempt {attempt + 1}): {response.status_code}, {response.text}, URL: {url}")
+                "Get changes response from GitHub (attempt %s): %s, %s, URL: %s",
+                attempt + 1, response.status_code, truncated(response.text), url)
 
             # 检查请求是否成功
-            if response.status_code == 200:
-                files = response.json()
-                if files:
-                    # 转换成GitLab格式的changes
-                    changes = []
-                    for file in files:
-                        change = {
-                            'old_path': file.get('filename'),
-                            'new_path': file.get('filename'),
-                            'diff': file.get('patch', ''),
-                            'additions': file.get('additions', 0),
-                            'deletions': file.get('deletions', 0)
-                        }
-                        changes.append(change)
-                    return changes
-                else:
-                    logger.info(
-                        f"Changes is empty, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries}), URL: {url}")
-                    time.sleep(retry_delay)
-            else:
-                logger.warn(f"Failed to get changes from GitHub (URL: {url}): {response.status_code}, {response.text}")
+            if response.status_code != 200:
+                logger.warn("Failed to get changes from GitHub (URL: %s): %s, %s",
+                            url, response.status_code, truncated(response.text))
                 return []
 
-        logger.warning(f"Max retries ({max_retries}) reached. Changes is still empty.")
-        return []  # 达到最大重试次数后返回空列表
+            files = response.json()
+            if files:
+                # 转换成GitLab格式的changes
+                return [file_to_change(file) for page in iter_pages(response, files, headers) for file in page]
+            if attempt < len(delays):
+                logger.info(f"Changes is empty, retrying in {delays[attempt]:.1f} seconds... "
+                            f"(attempt {attempt + 1}), URL: {url}")
+                time.sleep(delays[attempt])
+
+        raise RetryLater(f"Pull request {self.repo_full_name}#{self.pull_request_number} files are not ready")
 
     def get_pull_request_commits(self) -> list:
         # 检查是否为 Pull Request Hook 事件
@@ -135,8 +209,8 @@ class PullRequestHandler:
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
-        logger.debug(f"Get commits response from GitHub: {response.status_code}, {response.text}")
+        response = http_client.get(url, headers=headers)
+        logger.debug("Get commits response from GitHub: %s, %s", response.status_code, truncated(response.text))
         
         # 检查请求是否成功
         if response.status_code == 200:
@@ -156,7 +230,7 @@ class PullRequestHandler:
                 gitlab_format_commits.append(gitlab_commit)
             return gitlab_format_commits
         else:
-            logger.warn(f"Failed to get commits: {response.status_code}, {response.text}")
+            logger.warn("Failed to get commits: %s, %s", response.status_code, truncated(response.text))
             return []
 
     def add_pull_request_notes(self, review_result):
@@ -168,29 +242,34 @@ class PullRequestHandler:
         data = {
             'body': review_result
         }
-        response = requests.post(url, headers=headers, json=data)
-        logger.debug(f"Add comment to GitHub PR {url}: {response.status_code}, {response.text}")
+        response = http_client.post(url, headers=headers, json=data)
+        logger.debug("Add comment to GitHub PR %s: %s, %s", url, response.status_code, truncated(response.text))
         if response.status_code == 201:
             logger.info("Comment successfully added to pull request.")
         else:
             logger.error(f"Failed to add comment: {response.status_code}")
-            logger.error(response.text)
+            logger.error('%s', truncated(response.text))
 
     def target_branch_protected(self) -> bool:
+        # 受保护分支规则按仓库缓存，命中时无需请求 GitHub
+        target_branch = self.webhook_data['pull_request']['base']['ref']
+        key = protected_branches.cache_key(slugify_url(self.github_url), self.repo_full_name)
+        return protected_branches.branch_protected(key, target_branch, self.get_protected_branch_names)
+
+    def get_protected_branch_names(self):
+        '''获取仓库的受保护分支名，请求失败时返回 None'''
         url = f"https://api.github.com/repos/{self.repo_full_name}/branches?protected=true"
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
 
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         if response.status_code == 200:
-            data = response.json()
-            target_branch = self.webhook_data['pull_request']['base']['ref']
-            return any(fnmatch.fnmatch(target_branch, item['name']) for item in data)
+            return [item['name'] for item in response.json()]
         else:
-            logger.warn(f"Failed to get protected branches: {response.status_code}, {response.text}")
-            return False
+            logger.warn("Failed to get protected branches: %s, %s", response.status_code, truncated(response.text))
+            return None
 
 
 class PushHandler:
@@ -255,13 +334,13 @@ class PushHandler:
         data = {
             'body': message
         }
-        response = requests.post(url, headers=headers, json=data)
-        logger.debug(f"Add comment to commit {last_commit_id}: {response.status_code}, {response.text}")
+        response = http_client.post(url, headers=headers, json=data)
+        logger.debug("Add comment to commit %s: %s, %s", last_commit_id, response.status_code, truncated(response.text))
         if response.status_code == 201:
             logger.info("Comment successfully added to push commit.")
         else:
             logger.error(f"Failed to add comment: {response.status_code}")
-            logger.error(response.text)
+            logger.error('%s', truncated(response.text))
 
     def __repository_commits(self, sha: str = "", per_page: int = 100, page: int = 1):
         # 获取仓库提交信息
@@ -270,15 +349,16 @@ class PushHandler:
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         logger.debug(
-            f"Get commits response from GitHub for repository_commits: {response.status_code}, {response.text}, URL: {url}")
+            "Get commits response from GitHub for repository_commits: %s, %s, URL: %s",
+            response.status_code, truncated(response.text), url)
 
         if response.status_code == 200:
             return response.json()
         else:
             logger.warn(
-                f"Failed to get commits for sha {sha}: {response.status_code}, {response.text}")
+                "Failed to get commits for sha %s: %s, %s", sha, response.status_code, truncated(response.text))
             return []
 
     def get_parent_commit_id(self, commit_id: str) -> str:
@@ -287,43 +367,37 @@ class PushHandler:
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         logger.debug(
-            f"Get commit response from GitHub: {response.status_code}, {response.text}, URL: {url}")
+            "Get commit response from GitHub: %s, %s, URL: %s", response.status_code, truncated(response.text), url)
 
         if response.status_code == 200 and response.json().get('parents'):
             return response.json().get('parents')[0].get('sha', '')
         return ""
 
     def repository_compare(self, base: str, head: str):
-        # 比较两个提交之间的差异
-        url = f"https://api.github.com/repos/{self.repo_full_name}/compare/{base}...{head}"
+        # 比较两个提交之间的差异；compare API 的分页只作用于 commits，变更文件（最多 300 个）全部在首页返回，
+        # 因此只请求首页，并通过 per_page 减少首页附带的 commits 数据
+        url = with_query(f"https://api.github.com/repos/{self.repo_full_name}/compare/{base}...{head}",
+                         per_page=github_page_size())
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         logger.debug(
-            f"Get changes response from GitHub for repository_compare: {response.status_code}, {response.text}, URL: {url}")
+            "Get changes response from GitHub for repository_compare: %s, %s, URL: %s",
+            response.status_code, truncated(response.text), url)
 
         if response.status_code == 200:
             # 转换为GitLab格式的diffs
             files = response.json().get('files', [])
-            diffs = []
-            for file in files:
-                diff = {
-                    'old_path': file.get('filename'),
-                    'new_path': file.get('filename'),
-                    'diff': file.get('patch', ''),
-                    'status': file.get('status', ''),
-                    'additions': file.get('additions', 0),
-                    'deletions': file.get('deletions', 0),
-                }
-                diffs.append(diff)
-            return diffs
+            if len(files) >= 300:
+                logger.warn(f"Compare {base}...{head} returned {len(files)} files, GitHub may have truncated the list.")
+            return [file_to_change(file) for file in files]
         else:
             logger.warn(
-                f"Failed to get changes for repository_compare: {response.status_code}, {response.text}")
+                "Failed to get changes for repository_compare: %s, %s", response.status_code, truncated(response.text))
             return []
 
     def get_push_changes(self) -> list:
@@ -3,11 +3,16 @@ GitLab API 服务
 提供 GitLab 项目和组织成员同步功能
 """
 import os
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional
 from urllib.parse import urljoin
 import requests
 
-from biz.utils.log import logger
+from biz.utils import http_client
+from biz.utils.log import logger, truncated
+
+# 分页大小，GitLab API 允许的最大值
+GITLAB_PAGE_SIZE = 100
 
 
 class GitLabService:
@@ -43,69 +48,106 @@ class GitLabService:
             'Content-Type': 'application/json'
         }
     
-    def _make_request(self, endpoint: str, params: Dict = None, max_results: int = None) -> Optional[List]:
+    def _get_page(self, url: str, params: Dict, page: int) -> requests.Response:
+        """请求指定分页，失败时抛出异常"""
+        logger.debug(f"Requesting GitLab API: {url}, page: {page}")
+        # dashboard 接口中调用，不在队列任务中执行：额度耗尽时不抛出 RetryLater
+        response = http_client.get(url, headers=self._get_headers(), params={**params, 'page': page}, verify=False,
+                                   defer=False)
+        if response.status_code != 200:
+            logger.error("GitLab API request failed: %s, %s", response.status_code, truncated(response.text))
+            raise RuntimeError(f"GitLab API request failed: {response.status_code}, URL: {url}, page: {page}")
+        return response
+
+    def _paginate(self, endpoint: str, params: Dict = None, limit: int = None) -> Iterator[Dict]:
         """
-        执行 API 请求并处理分页
+        逐条产出分页接口的结果，调用方可以随时停止迭代
+
+        首页响应带有 X-Total-Pages 时，按 limit 计算还需要的页数并立即并发请求（GITLAB_PAGE_CONCURRENCY），
+        按页序产出；结果过多时 GitLab 不返回总页数，此时按 X-Next-Page 逐页请求。
+        停止迭代时取消尚未开始的请求。
 
         Args:
             endpoint: API 端点
             params: 请求参数
-            max_results: 最大返回结果数量，None 表示获取所有
+            limit: 最多产出的条数，None 或 0 表示不限制
 
-        Returns:
-            API 响应数据列表
+        Raises:
+            RuntimeError / requests.exceptions.RequestException: 请求失败
         """
-        if not self.gitlab_token:
-            logger.error("GitLab access token is required for API requests")
-            return None
-
         url = urljoin(f"{self.gitlab_url}/", endpoint)
-        headers = self._get_headers()
-        all_results = []
-        page = 1
-        per_page = 100
+        params = {**(params or {}), 'per_page': GITLAB_PAGE_SIZE}
+        response = self._get_page(url, params, 1)
+        data = response.json()
+        count = 0
+        for item in data:
+            if limit and count >= limit:
+                return
+            count += 1
+            yield item
+        if len(data) < GITLAB_PAGE_SIZE:
+            return
 
-        if params is None:
-            params = {}
-
-        params['per_page'] = per_page
+        total_pages = int(response.headers.get('X-Total-Pages') or 0)
+        if not total_pages:
+            yield from self._iter_next_pages(url, params, response, limit - count if limit else None)
+            return
 
+        if limit:
+            total_pages = min(total_pages, -(-limit // GITLAB_PAGE_SIZE))
+        pages = range(2, total_pages + 1)
+        if not pages:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(len(pages), int(os.getenv('GITLAB_PAGE_CONCURRENCY', 4))),
+                                      thread_name_prefix='gitlab-pages')
         try:
-            while True:
-                params['page'] = page
-                logger.debug(f"Requesting GitLab API: {url}, page: {page}")
-                response = requests.get(url, headers=headers, params=params, verify=False, timeout=30)
-
-                if response.status_code != 200:
-                    logger.error(f"GitLab API request failed: {response.status_code}, {response.text}")
-                    return None
+            futures = [executor.submit(self._get_page, url, params, page) for page in pages]
+            logger.debug(f"Fetching {len(futures)} more pages from GitLab concurrently, URL: {url}")
+            for future in futures:
+                for item in future.result().json():
+                    if limit and count >= limit:
+                        return
+                    count += 1
+                    yield item
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-                data = response.json()
-                if not data:
-                    break
+    def _iter_next_pages(self, url: str, params: Dict, response: requests.Response, limit: int = None) -> Iterator[Dict]:
+        count = 0
+        next_page = response.headers.get('X-Next-Page')
+        while next_page:
+            response = self._get_page(url, params, int(next_page))
+            for item in response.json():
+                if limit and count >= limit:
+                    return
+                count += 1
+                yield item
+            next_page = response.headers.get('X-Next-Page')
 
-                all_results.extend(data)
-
-                # 如果设置了最大结果数且已达到，则停止
-                if max_results and len(all_results) >= max_results:
-                    all_results = all_results[:max_results]
-                    logger.info(f"Reached max_results limit of {max_results}")
-                    break
+    def _make_request(self, endpoint: str, params: Dict = None, max_results: int = None) -> Optional[List]:
+        """
+        执行 API 请求并处理分页
 
-                # 检查是否还有更多页
-                if len(data) < per_page:
-                    break
+        Args:
+            endpoint: API 端点
+            params: 请求参数
+            max_results: 最大返回结果数量，None 表示不超过 GITLAB_API_MAX_RESULTS（默认 1000，0 表示不限制）
 
-                page += 1
+        Returns:
+            API 响应数据列表
+        """
+        if not self.gitlab_token:
+            logger.error("GitLab access token is required for API requests")
+            return None
 
-                # 安全限制：最多获取 1000 个成员
-                if len(all_results) >= 1000:
-                    logger.warning("Reached maximum limit of 1000 members")
-                    break
-            
+        limit = max_results or int(os.getenv('GITLAB_API_MAX_RESULTS', 1000))
+        try:
+            all_results = list(self._paginate(endpoint, params, limit))
+            if limit and len(all_results) >= limit:
+                logger.info(f"Reached max results limit of {limit}")
             logger.info(f"Successfully fetched {len(all_results)} items from GitLab")
             return all_results
-            
+
         except requests.exceptions.RequestException as e:
             logger.error(f"Request to GitLab API failed: {str(e)}")
             return None
@@ -196,7 +238,7 @@ class GitLabService:
         headers = self._get_headers()
         
         try:
-            response = requests.get(url, headers=headers, verify=False, timeout=10)
+            response = http_client.get(url, headers=headers, verify=False, timeout=10, defer=False)
             return response.status_code == 200
         except Exception as e:
             logger.error(f"Failed to verify project access: {str(e)}")
@@ -217,7 +259,7 @@ class GitLabService:
         headers = self._get_headers()
         
         try:
-            response = requests.get(url, headers=headers, verify=False, timeout=10)
+            response = http_client.get(url, headers=headers, verify=False, timeout=10, defer=False)
             return response.status_code == 200
         except Exception as e:
             logger.error(f"Failed to verify group access: {str(e)}")
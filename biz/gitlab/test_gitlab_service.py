@@ -0,0 +1,72 @@
+import os
+from unittest import TestCase, main, mock
+
+from biz.gitlab.gitlab_service import GITLAB_PAGE_SIZE, GitLabService
+
+
+def fake_get(total_items: int, total_pages_header: bool = True):
+    """按 page 参数返回对应分页的假响应"""
+    total_pages = -(-total_items // GITLAB_PAGE_SIZE)
+
+    def get(url, headers=None, params=None, verify=None, defer=True):
+        # dashboard 调用不在队列中执行，额度耗尽时不能抛出 RetryLater
+        assert defer is False
+        page = params['page']
+        start = (page - 1) * GITLAB_PAGE_SIZE
+        response = mock.Mock(status_code=200, text='')
+        response.json.return_value = [{'id': i} for i in range(start, min(start + GITLAB_PAGE_SIZE, total_items))]
+        response.headers = {'X-Next-Page': str(page + 1) if page < total_pages else ''}
+        if total_pages_header:
+            response.headers['X-Total-Pages'] = str(total_pages)
+        return response
+
+    return get
+
+
+class TestGitLabServicePagination(TestCase):
+    def setUp(self):
+        self.service = GitLabService('https://gitlab.example.com', 'token')
+
+    def test_concurrent_pages_in_order(self):
+        """根据 X-Total-Pages 并发获取其余分页，结果按页序排列"""
+        with mock.patch('biz.utils.http_client.get', side_effect=fake_get(350)) as get, \
+                mock.patch.dict(os.environ, {'GITLAB_API_MAX_RESULTS': '0'}):
+            items = self.service._make_request('api/v4/projects')
+        self.assertEqual([item['id'] for item in items], list(range(350)))
+        self.assertEqual(get.call_count, 4)
+
+    def test_limit_skips_unneeded_pages(self):
+        """只请求满足 limit 所需的分页"""
+        with mock.patch('biz.utils.http_client.get', side_effect=fake_get(1000)) as get:
+            items = self.service._make_request('api/v4/projects', {'simple': True}, max_results=150)
+        self.assertEqual(len(items), 150)
+        self.assertEqual(get.call_count, 2)
+        self.assertTrue(all(call.kwargs['params']['simple'] for call in get.call_args_list))
+
+    def test_next_page_without_total(self):
+        """没有 X-Total-Pages 时按 X-Next-Page 逐页请求，调用方可以提前停止"""
+        with mock.patch('biz.utils.http_client.get', side_effect=fake_get(1000, total_pages_header=False)) as get:
+            items = self.service._paginate('api/v4/projects')
+            self.assertEqual([next(items)['id'] for _ in range(GITLAB_PAGE_SIZE + 1)][-1], GITLAB_PAGE_SIZE)
+        self.assertEqual(get.call_count, 2)
+
+    def test_failed_page_returns_none(self):
+        pages = []
+
+        def get(url, headers=None, params=None, verify=None, defer=True):
+            pages.append(params['page'])
+            if params['page'] == 2:
+                return mock.Mock(status_code=500, text='error')
+            return fake_get(300)(url, headers, params, verify, defer)
+
+        with mock.patch('biz.utils.http_client.get', side_effect=get), \
+                mock.patch('biz.gitlab.gitlab_service.logger') as logger:
+            self.assertIsNone(self.service._make_request('api/v4/projects'))
+        # 第 1 页正常返回，第 2 页的 500 导致整体返回 None
+        self.assertEqual(pages[0], 1)
+        self.assertIn(2, pages)
+        self.assertIn('GitLab API request failed: 500', str(logger.error.call_args))
+
+
+if __name__ == '__main__':
+    main()
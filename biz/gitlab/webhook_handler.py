@@ -1,33 +1,35 @@
-import os
 import re
 import time
 from urllib.parse import urljoin
-import fnmatch
-import requests
 
-from biz.utils.log import logger
+from biz.queue.retry import RetryLater, diff_poll_delays
+from biz.utils import diff_scanner, git_mirror, http_client, protected_branches
+from biz.utils.log import logger, truncated
 
 
 def filter_changes(changes: list):
     '''
     过滤数据，只保留支持的文件类型以及必要的字段信息
     '''
-    # 从环境变量中获取支持的文件扩展名
-    supported_extensions = os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
-
-    filter_deleted_files_changes = [change for change in changes if not change.get("deleted_file")]
-
-    # 过滤 `new_path` 以支持的扩展名结尾的元素, 仅保留diff和new_path字段
-    filtered_changes = [
-        {
-            'diff': item.get('diff', ''),
+    # 从环境变量中获取支持的文件扩展名（按取值缓存为后缀元组）
+    extensions = diff_scanner.supported_extensions()
+
+    # 过滤 `new_path` 以支持的扩展名结尾的未删除文件, 保留diff、路径与新增/重命名标记（diff 模型据此渲染文件状态）
+    filtered_changes = []
+    for item in changes:
+        if item.get('deleted_file') or not diff_scanner.is_supported(item.get('new_path'), extensions):
+            continue
+        diff = item.get('diff', '')
+        additions, deletions = diff_scanner.count_changes(diff)
+        filtered_changes.append({
+            'diff': diff,
             'new_path': item['new_path'],
-            'additions': len(re.findall(r'^\+(?!\+\+)', item.get('diff', ''), re.MULTILINE)),
-            'deletions': len(re.findall(r'^-(?!--)', item.get('diff', ''), re.MULTILINE))
-        }
-        for item in filter_deleted_files_changes
-        if any(item.get('new_path', '').endswith(ext) for ext in supported_extensions)
-    ]
+            'old_path': item.get('old_path'),
+            'new_file': item.get('new_file', False),
+            'renamed_file': item.get('renamed_file', False),
+            'additions': additions,
+            'deletions': deletions,
+        })
     return filtered_changes
 
 
@@ -49,6 +51,37 @@ def slugify_url(original_url: str) -> str:
     return target
 
 
+# merge_status / detailed_merge_status 为以下值时，MR 的 diff 可能仍在生成
+MERGE_STATUS_PREPARING = {'preparing', 'unchecked', 'checking'}
+
+
+def merge_request_diff_ready(merge_request: dict) -> bool:
+    '''根据 GitLab 返回的 merge_status 与 diff_refs 判断 MR 的 diff 是否已生成'''
+    if not merge_request.get('diff_refs'):
+        return False
+    return (merge_request.get('merge_status') not in MERGE_STATUS_PREPARING
+            and merge_request.get('detailed_merge_status') != 'preparing')
+
+
+def mirror_changes(webhook_data: dict, gitlab_token: str, base: str, head: str, merge_base: bool = False):
+    '''
+    开启本地镜像（GIT_MIRROR_ENABLED）时在本地计算 base 与 head 之间的变更
+
+    Returns:
+        changes 列表；未开启、缺少仓库地址或 git 执行失败时返回 None，由调用方改用 REST API
+    '''
+    if not git_mirror.git_mirror_enabled():
+        return None
+    remote_url = webhook_data.get('project', {}).get('git_http_url')
+    if not remote_url or not base or not head or base.startswith('0000000'):
+        return None
+    try:
+        return git_mirror.get_git_mirror().diff(remote_url, base, head, token=gitlab_token, merge_base=merge_base)
+    except Exception as e:
+        logger.warn(f"Failed to get changes from local mirror, falling back to API: {e}")
+        return None
+
+
 class MergeRequestHandler:
     def __init__(self, webhook_data: dict, gitlab_token: str, gitlab_url: str):
         self.merge_request_iid = None
@@ -79,35 +112,78 @@ class MergeRequestHandler:
             logger.warn(f"Invalid event type: {self.event_type}. Only 'merge_request' event is supported now.")
             return []
 
-        # Gitlab merge request changes API可能存在延迟，多次尝试
-        max_retries = 3  # 最大重试次数
-        retry_delay = 10  # 重试间隔时间（秒）
-        for attempt in range(max_retries):
+        # 开启本地镜像时，与 MR 一致地比较目标分支与最新提交的共同祖先
+        object_attributes = self.webhook_data.get('object_attributes', {})
+        changes = mirror_changes(self.webhook_data, self.gitlab_token,
+                                 f"refs/heads/{object_attributes.get('target_branch', '')}",
+                                 object_attributes.get('last_commit', {}).get('id', ''), merge_base=True)
+        if changes is not None:
+            return changes
+
+        # Gitlab merge request changes API可能存在延迟：先按带抖动的指数退避短暂轮询，仍未就绪时延迟重新入队
+        url = urljoin(f"{self.gitlab_url}/",
+                      f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/changes?access_raw_diffs=true")
+        headers = {
+            'Private-Token': self.gitlab_token
+        }
+        delays = diff_poll_delays()
+        merge_request = {}
+        for attempt in range(len(delays) + 1):
             # 调用 GitLab API 获取 Merge Request 的 changes
-            url = urljoin(f"{self.gitlab_url}/",
-                          f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/changes?access_raw_diffs=true")
-            headers = {
-                'Private-Token': self.gitlab_token
-            }
-            response = requests.get(url, headers=headers, verify=False)
+            response = http_client.get(url, headers=headers, verify=False)
             logger.debug(
-                f"Get changes response from GitLab (attempt {attempt + 1}): {response.status_code}, {response.text}, URL: {url}")
+                "Get changes response from GitLab (attempt %s): %s, %s, URL: %s",
+                attempt + 1, response.status_code, truncated(response.text), url)
 
             # 检查请求是否成功
-            if response.status_code == 200:
-                changes = response.json().get('changes', [])
-                if changes:
-                    return changes
-                else:
-                    logger.info(
-                        f"Changes is empty, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries}), URL: {url}")
-                    time.sleep(retry_delay)
-            else:
-                logger.warn(f"Failed to get changes from GitLab (URL: {url}): {response.status_code}, {response.text}")
+            if response.status_code != 200:
+                logger.warn("Failed to get changes from GitLab (URL: %s): %s, %s",
+                            url, response.status_code, truncated(response.text))
                 return []
 
-        logger.warning(f"Max retries ({max_retries}) reached. Changes is still empty.")
-        return []  # 达到最大重试次数后返回空列表
+            merge_request = response.json()
+            changes = merge_request.get('changes', [])
+            if changes:
+                return changes
+            if merge_request_diff_ready(merge_request):
+                logger.info(f"Merge request diff is ready but has no changes, URL: {url}")
+                return []
+            if attempt < len(delays):
+                logger.info(f"Changes is not ready (merge_status={merge_request.get('merge_status')}), "
+                            f"retrying in {delays[attempt]:.1f} seconds... (attempt {attempt + 1}), URL: {url}")
+                time.sleep(delays[attempt])
+
+        raise RetryLater(f"Merge request {self.project_id}!{self.merge_request_iid} diff is not ready "
+                         f"(merge_status={merge_request.get('merge_status')}, "
+                         f"diff_refs={'set' if merge_request.get('diff_refs') else 'missing'})")
+
+    def get_merge_request_compare_changes(self, from_sha: str, to_sha: str):
+        '''
+        获取上次审查的提交与最新提交之间的变更，供增量审查使用
+
+        Returns:
+            与 MR changes 格式相同的 diff 列表；请求失败或 GitLab 比较超时（结果不完整）时返回 None，由调用方回退到完整审查
+        '''
+        changes = mirror_changes(self.webhook_data, self.gitlab_token, from_sha, to_sha)
+        if changes is not None:
+            return changes
+        url = urljoin(f"{self.gitlab_url}/",
+                      f"api/v4/projects/{self.project_id}/repository/compare")
+        headers = {
+            'Private-Token': self.gitlab_token
+        }
+        response = http_client.get(url, headers=headers, params={'from': from_sha, 'to': to_sha, 'straight': 'true'},
+                                   verify=False)
+        logger.debug("Get compare response from GitLab: %s, %s, %s..%s",
+                     response.status_code, truncated(response.text), from_sha, to_sha)
+        if response.status_code != 200:
+            logger.warn("Failed to get compare changes: %s, %s", response.status_code, truncated(response.text))
+            return None
+        compare = response.json()
+        if compare.get('compare_timeout'):
+            logger.warn(f"GitLab compare timed out, {from_sha}..{to_sha}")
+            return None
+        return compare.get('diffs', [])
 
     def get_merge_request_commits(self) -> list:
         # 检查是否为 Merge Request Hook 事件
@@ -120,13 +196,13 @@ class MergeRequestHandler:
         headers = {
             'Private-Token': self.gitlab_token
         }
-        response = requests.get(url, headers=headers, verify=False)
-        logger.debug(f"Get commits response from gitlab: {response.status_code}, {response.text}")
+        response = http_client.get(url, headers=headers, verify=False)
+        logger.debug("Get commits response from gitlab: %s, %s", response.status_code, truncated(response.text))
         # 检查请求是否成功
         if response.status_code == 200:
             return response.json()
         else:
-            logger.warn(f"Failed to get commits: {response.status_code}, {response.text}")
+            logger.warn("Failed to get commits: %s, %s", response.status_code, truncated(response.text))
             return []
 
     def add_merge_request_notes(self, review_result):
@@ -139,31 +215,37 @@ class MergeRequestHandler:
         data = {
             'body': review_result
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
-        logger.debug(f"Add notes to gitlab {url}: {response.status_code}, {response.text}")
+        response = http_client.post(url, headers=headers, json=data, verify=False)
+        logger.debug("Add notes to gitlab %s: %s, %s", url, response.status_code, truncated(response.text))
         if response.status_code == 201:
             logger.info("Note successfully added to merge request.")
         else:
             logger.error(f"Failed to add note: {response.status_code}")
-            logger.error(response.text)
+            logger.error('%s', truncated(response.text))
 
     def target_branch_protected(self) -> bool:
+        # 受保护分支规则按项目缓存，命中时无需请求 GitLab
+        target_branch = self.webhook_data['object_attributes']['target_branch']
+        key = protected_branches.cache_key(slugify_url(self.gitlab_url), str(self.project_id))
+        return protected_branches.branch_protected(key, target_branch, self.get_protected_branch_names)
+
+    def get_protected_branch_names(self):
+        '''获取项目的受保护分支规则（分支名或通配符），请求失败时返回 None'''
         url = urljoin(f"{self.gitlab_url}/",
                       f"api/v4/projects/{self.project_id}/protected_branches")
         headers = {
             'Private-Token': self.gitlab_token,
             'Content-Type': 'application/json'
         }
-        response = requests.get(url, headers=headers, verify=False)
-        logger.debug(f"Get protected branches response from gitlab: {response.status_code}, {response.text}")
+        response = http_client.get(url, headers=headers, verify=False)
+        logger.debug("Get protected branches response from gitlab: %s, %s",
+                     response.status_code, truncated(response.text))
         # 检查请求是否成功
         if response.status_code == 200:
-            data = response.json()
-            target_branch = self.webhook_data['object_attributes']['target_branch']
-            return any(fnmatch.fnmatch(target_branch, item['name']) for item in data)
+            return [item['name'] for item in response.json()]
         else:
-            logger.warn(f"Failed to get protected branches: {response.status_code}, {response.text}")
-            return False
+            logger.warn("Failed to get protected branches: %s, %s", response.status_code, truncated(response.text))
+            return None
 
 
 class PushHandler:
@@ -230,13 +312,13 @@ class PushHandler:
         data = {
             'note': message
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
-        logger.debug(f"Add comment to commit {last_commit_id}: {response.status_code}, {response.text}")
+        response = http_client.post(url, headers=headers, json=data, verify=False)
+        logger.debug("Add comment to commit %s: %s, %s", last_commit_id, response.status_code, truncated(response.text))
         if response.status_code == 201:
             logger.info("Comment successfully added to push commit.")
         else:
             logger.error(f"Failed to add comment: {response.status_code}")
-            logger.error(response.text)
+            logger.error('%s', truncated(response.text))
 
     def __repository_commits(self, ref_name: str = "", since: str = "", until: str = "", pre_page: int = 100,
                              page: int = 1):
@@ -245,15 +327,16 @@ class PushHandler:
         headers = {
             'Private-Token': self.gitlab_token
         }
-        response = requests.get(url, headers=headers, verify=False)
+        response = http_client.get(url, headers=headers, verify=False)
         logger.debug(
-            f"Get commits response from GitLab for repository_commits: {response.status_code}, {response.text}, URL: {url}")
+            "Get commits response from GitLab for repository_commits: %s, %s, URL: %s",
+            response.status_code, truncated(response.text), url)
 
         if response.status_code == 200:
             return response.json()
         else:
             logger.warn(
-                f"Failed to get commits for ref {ref_name}: {response.status_code}, {response.text}")
+                "Failed to get commits for ref %s: %s, %s", ref_name, response.status_code, truncated(response.text))
             return []
 
     def get_parent_commit_id(self, commit_id: str) -> str:
@@ -268,15 +351,16 @@ class PushHandler:
         headers = {
             'Private-Token': self.gitlab_token
         }
-        response = requests.get(url, headers=headers, verify=False)
+        response = http_client.get(url, headers=headers, verify=False)
         logger.debug(
-            f"Get changes response from GitLab for repository_compare: {response.status_code}, {response.text}, URL: {url}")
+            "Get changes response from GitLab for repository_compare: %s, %s, URL: %s",
+            response.status_code, truncated(response.text), url)
 
         if response.status_code == 200:
             return response.json().get('diffs', [])
         else:
             logger.warn(
-                f"Failed to get changes for repository_compare: {response.status_code}, {response.text}")
+                "Failed to get changes for repository_compare: %s, %s", response.status_code, truncated(response.text))
             return []
 
     def get_push_changes(self) -> list:
@@ -306,6 +390,10 @@ class PushHandler:
                 parent_commit_id = self.get_parent_commit_id(first_commit_id)
                 if parent_commit_id:
                     before = parent_commit_id
+            # 与 compare API 的默认行为一致按共同祖先比较（before...after），强制推送后不会把被丢弃的提交显示为回退
+            changes = mirror_changes(self.webhook_data, self.gitlab_token, before, after, merge_base=True)
+            if changes is not None:
+                return changes
             return self.repository_compare(before, after)
         else:
             return []
@@ -5,7 +5,7 @@ from openai import OpenAI
 
 from biz.llm.client.base import BaseClient
 from biz.llm.types import NotGiven, NOT_GIVEN
-from biz.utils.log import logger
+from biz.utils.log import logger, summarize_messages
 
 
 class DeepSeekClient(BaseClient):
@@ -24,7 +24,7 @@ class DeepSeekClient(BaseClient):
                     ) -> str:
         try:
             model = model or self.default_model
-            logger.debug(f"Sending request to DeepSeek API. Model: {model}, Messages: {messages}")
+            logger.debug("Sending request to DeepSeek API. Model: %s, Messages: %s", model, summarize_messages(messages))
             
             completion = self.client.chat.completions.create(
                 model=model,
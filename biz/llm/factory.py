@@ -1,4 +1,5 @@
 import os
+from typing import Dict, Tuple
 
 from biz.llm.client.base import BaseClient
 from biz.llm.client.deepseek import DeepSeekClient
@@ -9,6 +10,10 @@ from biz.llm.client.zhipuai import ZhipuAIClient
 from biz.utils.log import logger
 
 
+# 按 (进程号, 供应商) 缓存的客户端实例，避免 fork 后复用父进程的连接
+_shared_clients: Dict[Tuple[int, str], BaseClient] = {}
+
+
 class Factory:
     @staticmethod
     def getClient(provider: str = None) -> BaseClient:
@@ -26,3 +31,14 @@ class Factory:
             return provider_func()
         else:
             raise Exception(f'Unknown chat model provider: {provider}')
+
+    @staticmethod
+    def getSharedClient(provider: str = None) -> BaseClient:
+        """获取当前进程内复用的客户端实例，工作进程中只初始化一次"""
+        provider = provider or os.getenv("LLM_PROVIDER", "openai")
+        key = (os.getpid(), provider)
+        client = _shared_clients.get(key)
+        if client is None:
+            client = Factory.getClient(provider)
+            _shared_clients[key] = client
+        return client
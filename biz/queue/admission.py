@@ -0,0 +1,168 @@
+"""
+webhook 入口的准入控制与背压
+
+工作进程处理不过来（例如大模型服务故障）时，webhook 入口不再无条件接收事件：
+- 排队任务数或执行中任务数超过上限时，返回 503 并携带 Retry-After，由 GitLab/GitHub 稍后重试
+- 或者按 degrade 策略把超限的事件放入低优先级的回填通道，直到达到更高的硬上限
+所有被拒绝、降级的事件都会计数；计数保存在各 webhook 进程内，定期写入共享存储（见 biz/queue/process_stats.py），
+通过 /api/queue/stats 查看各进程的计数及其合计
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from biz.queue.process_stats import register_stats_provider
+from biz.queue.scheduler import LANE_BACKFILL
+from biz.utils.log import logger
+
+POLICY_REJECT = 'reject'
+POLICY_DEGRADE = 'degrade'
+
+
+class AdmissionDecision(NamedTuple):
+    accepted: bool
+    # 实际入队的通道，被降级时为回填通道
+    lane: str
+    reason: str = ''
+    retry_after: int = 0
+
+
+class AdmissionController:
+    """
+    根据当前队列负载决定是否接收 webhook 事件
+
+    Args:
+        load_fn: 返回 (排队中任务数, 执行中任务数) 的函数，参数为 url_slug
+        max_queue_depth: 排队任务数上限，0 表示不限制
+        max_in_flight: 执行中任务数上限，0 表示不限制
+        policy: 超限时的策略，reject 直接拒绝，degrade 放入回填通道
+        degrade_max_queue_depth: degrade 策略下排队任务数的硬上限，超过后同样拒绝；未设置时为 max_queue_depth 的 2 倍，
+            两者都未设置（只限制执行中任务数）时不限制
+        retry_after: 拒绝时建议的重试间隔（秒）
+    """
+
+    def __init__(self, load_fn: Callable[[str], Tuple[int, int]], max_queue_depth: int = 0, max_in_flight: int = 0,
+                 policy: str = POLICY_REJECT, degrade_max_queue_depth: int = 0, retry_after: int = 30):
+        self.load_fn = load_fn
+        self.max_queue_depth = max_queue_depth
+        self.max_in_flight = max_in_flight
+        self.policy = policy if policy in (POLICY_REJECT, POLICY_DEGRADE) else POLICY_REJECT
+        self.degrade_max_queue_depth = degrade_max_queue_depth or max_queue_depth * 2
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._accepted = 0
+        self._degraded = 0
+        self._shed = 0
+        self._shed_by_reason: Dict[str, int] = {}
+        self._last_shed_at: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, load_fn: Callable[[str], Tuple[int, int]]) -> 'AdmissionController':
+        return cls(
+            load_fn,
+            max_queue_depth=int(os.getenv('WEBHOOK_MAX_QUEUE_DEPTH', 0)),
+            max_in_flight=int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', 0)),
+            policy=os.getenv('WEBHOOK_OVERLOAD_POLICY', POLICY_REJECT),
+            degrade_max_queue_depth=int(os.getenv('WEBHOOK_DEGRADE_MAX_QUEUE_DEPTH', 0)),
+            retry_after=int(os.getenv('WEBHOOK_RETRY_AFTER', 30)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_queue_depth or self.max_in_flight)
+
+    def _overload_reason(self, depth: int, in_flight: int) -> str:
+        if self.max_queue_depth and depth >= self.max_queue_depth:
+            return 'queue_depth'
+        if self.max_in_flight and in_flight >= self.max_in_flight:
+            return 'in_flight'
+        return ''
+
+    def admit(self, lane: str, url_slug: str = '') -> AdmissionDecision:
+        """判断事件能否入队，返回准入结果"""
+        if not self.enabled:
+            return self._accept(lane)
+        try:
+            depth, in_flight = self.load_fn(url_slug)
+        except Exception as e:
+            # 无法获取负载时放行，准入控制不能成为新的故障点
+            logger.error(f"获取队列负载失败，跳过准入控制: {e}")
+            return self._accept(lane)
+
+        reason = self._overload_reason(depth, in_flight)
+        if not reason:
+            return self._accept(lane)
+        if self.policy == POLICY_DEGRADE and lane != LANE_BACKFILL and \
+                (not self.degrade_max_queue_depth or depth < self.degrade_max_queue_depth):
+            with self._lock:
+                self._accepted += 1
+                self._degraded += 1
+            logger.warn(f"队列过载({reason}: depth={depth}, in_flight={in_flight})，事件降级到回填通道")
+            return AdmissionDecision(True, LANE_BACKFILL, reason)
+
+        with self._lock:
+            self._shed += 1
+            self._shed_by_reason[reason] = self._shed_by_reason.get(reason, 0) + 1
+            self._last_shed_at = time.time()
+        logger.warn(f"队列过载({reason}: depth={depth}, in_flight={in_flight})，拒绝事件，"
+                    f"Retry-After={self.retry_after}s")
+        return AdmissionDecision(False, lane, reason, self.retry_after)
+
+    def _accept(self, lane: str) -> AdmissionDecision:
+        with self._lock:
+            self._accepted += 1
+        return AdmissionDecision(True, lane)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'policy': self.policy,
+                'max_queue_depth': self.max_queue_depth,
+                'max_in_flight': self.max_in_flight,
+                'accepted': self._accepted,
+                'degraded': self._degraded,
+                'shed': self._shed,
+                'shed_by_reason': dict(self._shed_by_reason),
+                'last_shed_at': self._last_shed_at,
+            }
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """获取当前进程内的准入控制器（懒加载）"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                from biz.utils.queue import get_queue_load
+
+                _controller = AdmissionController.from_env(get_queue_load)
+                register_stats_provider('admission', _controller.stats)
+    return _controller
+
+
+def get_admission_stats() -> Optional[Dict[str, Any]]:
+    return _controller.stats() if _controller is not None else None
+
+
+def merge_admission_stats(items: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """合计各进程的准入计数；各进程使用同一份配置，配置项取第一个进程的值"""
+    items = [item for item in items if item]
+    if not items:
+        return None
+    merged = {key: items[0][key] for key in ('enabled', 'policy', 'max_queue_depth', 'max_in_flight')}
+    for key in ('accepted', 'degraded', 'shed'):
+        merged[key] = sum(item[key] for item in items)
+    shed_by_reason: Dict[str, int] = {}
+    for item in items:
+        for reason, count in item['shed_by_reason'].items():
+            shed_by_reason[reason] = shed_by_reason.get(reason, 0) + count
+    merged['shed_by_reason'] = shed_by_reason
+    merged['last_shed_at'] = max((item['last_shed_at'] for item in items if item['last_shed_at']), default=None)
+    merged['processes'] = len(items)
+    return merged
@@ -0,0 +1,199 @@
+"""
+同一 Merge Request / Pull Request 的审查任务合并与取代
+
+入队时按 (url_slug, 项目, MR iid / PR number) 计算任务键，并把最新的 head SHA 记录到共享的版本登记表中：
+- 排队中的旧任务会被新任务取代（sqlite 驱动直接标记为 superseded，其他驱动在任务开始时跳过）
+- 执行中的旧任务在各检查点发现版本已变化后主动退出；MR/PR 被关闭或合并时同样会取消审查
+- 只有会触发审查的动作（打开、更新、重新打开）以及关闭、合并参与合并；审批、标签、指派等事件不登记版本，
+  也不会取代排队中的审查；与排队中任务版本相同的新事件不会取代它
+"""
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from biz.utils.log import logger
+
+# MR/PR 关闭或合并后登记的版本，任何进行中的审查都会被取消
+CLOSED_REVISION = 'closed'
+
+GITLAB_CLOSED_ACTIONS = {'close', 'merge'}
+GITHUB_CLOSED_ACTIONS = {'closed'}
+# 会触发审查的动作，worker 只处理这些动作
+GITLAB_REVIEW_ACTIONS = {'open', 'update', 'reopen'}
+GITHUB_REVIEW_ACTIONS = {'opened', 'synchronize', 'reopened'}
+
+
+class JobSuperseded(Exception):
+    """任务已被同一 MR/PR 的新事件取代"""
+    pass
+
+
+def job_identity(webhook_data: dict, url_slug: str) -> Optional[Tuple[str, str]]:
+    """
+    根据 webhook 数据计算任务键与版本
+
+    Returns:
+        (任务键, 版本)，非 MR/PR 事件返回 None
+    """
+    if not isinstance(webhook_data, dict):
+        return None
+
+    # GitLab Merge Request
+    if webhook_data.get('object_kind') == 'merge_request':
+        attributes = webhook_data.get('object_attributes', {})
+        project_id = attributes.get('target_project_id') or webhook_data.get('project', {}).get('id')
+        iid = attributes.get('iid')
+        if project_id is None or iid is None:
+            return None
+        if attributes.get('action') in GITLAB_CLOSED_ACTIONS:
+            revision = CLOSED_REVISION
+        else:
+            revision = attributes.get('last_commit', {}).get('id', '')
+        return f"{url_slug}:{project_id}:mr:{iid}", revision
+
+    # GitHub Pull Request
+    pull_request = webhook_data.get('pull_request')
+    if isinstance(pull_request, dict) and pull_request.get('number') is not None:
+        repo = webhook_data.get('repository', {}).get('full_name')
+        if not repo:
+            return None
+        if webhook_data.get('action') in GITHUB_CLOSED_ACTIONS:
+            revision = CLOSED_REVISION
+        else:
+            revision = pull_request.get('head', {}).get('sha', '')
+        return f"{url_slug}:{repo}:pr:{pull_request['number']}", revision
+
+    return None
+
+
+def coalesce_identity(webhook_data: dict, url_slug: str) -> Optional[Tuple[str, str]]:
+    """
+    参与合并的任务键与版本：只有会触发审查的动作以及关闭、合并事件登记版本、取代旧任务
+
+    Returns:
+        (任务键, 版本)，其他事件返回 None
+    """
+    identity = job_identity(webhook_data, url_slug)
+    if identity is None:
+        return None
+    if webhook_data.get('object_kind') == 'merge_request':
+        action = webhook_data.get('object_attributes', {}).get('action')
+        actions = GITLAB_REVIEW_ACTIONS | GITLAB_CLOSED_ACTIONS
+    else:
+        action = webhook_data.get('action')
+        actions = GITHUB_REVIEW_ACTIONS | GITHUB_CLOSED_ACTIONS
+    return identity if action in actions else None
+
+
+class SqliteRevisionRegistry:
+    """基于 SQLite 的版本登记表，同一主机上的所有进程共享"""
+
+    def __init__(self, ttl_seconds: int, db_file: str = None):
+        from biz.queue.sqlite_queue import LocalConnection
+
+        self.db_file = db_file or os.getenv('SQLITE_QUEUE_DB_FILE', 'data/queue.db')
+        self._connection = LocalConnection(self.db_file)
+        conn = self._connection.get()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS queue_coalesce (
+                key TEXT PRIMARY KEY,
+                revision TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        # 清理长期没有新事件的 MR/PR 记录
+        conn.execute('DELETE FROM queue_coalesce WHERE updated_at < ?', (time.time() - ttl_seconds,))
+
+    def publish(self, key: str, revision: str):
+        self._connection.get().execute(
+            'INSERT INTO queue_coalesce (key, revision, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET revision = excluded.revision, updated_at = excluded.updated_at',
+            (key, revision, time.time()))
+
+    def latest(self, key: str) -> Optional[str]:
+        row = self._connection.get().execute('SELECT revision FROM queue_coalesce WHERE key = ?', (key,)).fetchone()
+        return row['revision'] if row else None
+
+
+class RedisRevisionRegistry:
+    """基于 Redis 的版本登记表，供 rq 驱动下分布在多台机器上的 worker 共享"""
+
+    KEY_PREFIX = 'ai-codereview:coalesce:'
+
+    def __init__(self, connection, ttl_seconds: int):
+        self.connection = connection
+        self.ttl_seconds = ttl_seconds
+
+    def publish(self, key: str, revision: str):
+        self.connection.set(self.KEY_PREFIX + key, revision, ex=self.ttl_seconds)
+
+    def latest(self, key: str) -> Optional[str]:
+        value = self.connection.get(self.KEY_PREFIX + key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def coalesce_enabled() -> bool:
+    return os.getenv('QUEUE_COALESCE_ENABLED', '1') == '1'
+
+
+def get_registry():
+    """获取当前队列驱动对应的版本登记表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                ttl_seconds = int(os.getenv('QUEUE_COALESCE_TTL_HOURS', 72)) * 3600
+                if os.getenv('QUEUE_DRIVER', 'async') == 'rq':
+                    from biz.queue.redis_conn import get_redis_connection
+
+                    _registry = RedisRevisionRegistry(get_redis_connection(), ttl_seconds)
+                else:
+                    _registry = SqliteRevisionRegistry(ttl_seconds)
+    return _registry
+
+
+def publish_revision(webhook_data: dict, url_slug: str) -> Optional[Tuple[str, str]]:
+    """
+    入队时登记 MR/PR 的最新版本
+
+    Returns:
+        (任务键, 版本)，不参与合并的事件或未开启合并时返回 None
+    """
+    if not coalesce_enabled():
+        return None
+    identity = coalesce_identity(webhook_data, url_slug)
+    if identity is None:
+        return None
+    key, revision = identity
+    try:
+        get_registry().publish(key, revision)
+    except Exception as e:
+        # 登记失败时退化为不合并，不影响正常入队
+        logger.error(f"登记任务版本失败: {key}, {e}")
+        return None
+    return identity
+
+
+def ensure_current(webhook_data: dict, url_slug: str, checkpoint: str = ''):
+    """
+    检查点：如果同一 MR/PR 已有更新的事件（新的 head SHA、关闭或合并），抛出 JobSuperseded 以协作方式取消当前任务
+    """
+    if not coalesce_enabled():
+        return
+    identity = coalesce_identity(webhook_data, url_slug)
+    if identity is None:
+        return
+    key, revision = identity
+    try:
+        latest = get_registry().latest(key)
+    except Exception as e:
+        logger.error(f"读取任务版本失败: {key}, {e}")
+        return
+    if latest is not None and latest != revision:
+        raise JobSuperseded(f"{key} 已有更新的事件(revision={latest})，取消当前任务(revision={revision}, "
+                            f"checkpoint={checkpoint})")
@@ -0,0 +1,290 @@
+"""
+审查任务跟踪与分阶段耗时统计
+
+每个 webhook 任务在工作进程中执行时生成一条 job_runs 记录（任务 ID、状态、总耗时），
+执行过程中通过 job_stage() 记录各阶段（获取变更、获取提交、LLM 审查、发布评论、通知、入库）的耗时，
+用于区分代码托管平台的延迟与大模型的延迟；/api/jobs 与 /api/jobs/stats 提供查询与 p50/p95/p99 统计
+"""
+import contextvars
+import functools
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from biz.utils.log import logger, reset_log_project, set_log_project
+
+# 任务状态
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+# 外部状态未就绪，已作为延迟任务重新入队
+JOB_DEFERRED = 'deferred'
+
+PERCENTILES = (50, 95, 99)
+
+_current_job: contextvars.ContextVar[Optional['JobRun']] = contextvars.ContextVar('current_job', default=None)
+
+
+class JobRun:
+    __slots__ = ('id', 'kind', 'project', 'url_slug', 'ref', 'status', 'error', 'started_at', 'finished_at',
+                 'stages')
+
+    def __init__(self, kind: str, project: str, url_slug: str, ref: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.project = project
+        self.url_slug = url_slug
+        self.ref = ref
+        self.status = JOB_RUNNING
+        self.error = ''
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        # (阶段名, 开始时间, 耗时)
+        self.stages: List[tuple] = []
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数，sorted_values 需已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    values = sorted(values)
+    summary = {'count': len(values)}
+    for pct in PERCENTILES:
+        summary[f'p{pct}'] = round(percentile(values, pct), 3)
+    summary['max'] = round(values[-1], 3) if values else 0.0
+    return summary
+
+
+class JobTracker:
+    """任务跟踪记录的 SQLite 存储，与 sqlite 队列共用数据库文件"""
+
+    def __init__(self, db_file: str = None, retention_days: int = None):
+        from biz.queue.sqlite_queue import LocalConnection
+
+        self.db_file = db_file or os.getenv('JOB_TRACKING_DB_FILE') or os.getenv('SQLITE_QUEUE_DB_FILE',
+                                                                                   'data/queue.db')
+        self.retention_days = retention_days or int(os.getenv('JOB_TRACKING_RETENTION_DAYS', 7))
+        self._connection = LocalConnection(self.db_file)
+        conn = self._connection.get()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS job_runs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                project TEXT NOT NULL DEFAULT '',
+                url_slug TEXT NOT NULL DEFAULT '',
+                ref TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL,
+                error TEXT,
+                pid INTEGER,
+                started_at REAL NOT NULL,
+                finished_at REAL,
+                duration REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS job_stages (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                duration REAL NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_job_runs_started ON job_runs (started_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_job_runs_project ON job_runs (project, started_at)')
+        self.purge(self.retention_days * 86400)
+
+    def start(self, run: JobRun):
+        self._connection.get().execute(
+            'INSERT INTO job_runs (id, kind, project, url_slug, ref, status, pid, started_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (run.id, run.kind, run.project, run.url_slug, run.ref, run.status, os.getpid(), run.started_at))
+
+    def finish(self, run: JobRun):
+        """任务结束时一次性写入状态与各阶段耗时"""
+        conn = self._connection.get()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE job_runs SET status = ?, error = ?, finished_at = ?, duration = ? WHERE id = ?',
+                         (run.status, run.error[:2000] or None, run.finished_at, run.finished_at - run.started_at,
+                          run.id))
+            conn.executemany('INSERT INTO job_stages (job_id, seq, stage, started_at, duration) VALUES (?, ?, ?, ?, ?)',
+                             [(run.id, seq, stage, started_at, duration)
+                              for seq, (stage, started_at, duration) in enumerate(run.stages)])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def purge(self, older_than_seconds: int) -> int:
+        conn = self._connection.get()
+        threshold = time.time() - older_than_seconds
+        conn.execute('DELETE FROM job_stages WHERE job_id IN (SELECT id FROM job_runs WHERE started_at < ?)',
+                     (threshold,))
+        return conn.execute('DELETE FROM job_runs WHERE started_at < ?', (threshold,)).rowcount
+
+    def list_jobs(self, status: str = None, project: str = None, kind: str = None, limit: int = 50,
+                  offset: int = 0) -> Dict[str, Any]:
+        conditions, params = [], []
+        for column, value in (('status', status), ('project', project), ('kind', kind)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn = self._connection.get()
+        total = conn.execute(f'SELECT COUNT(*) FROM job_runs {where}', params).fetchone()[0]
+        rows = conn.execute(f'SELECT * FROM job_runs {where} ORDER BY started_at DESC LIMIT ? OFFSET ?',
+                            params + [limit, offset]).fetchall()
+        return {'items': [dict(row) for row in rows], 'total': total}
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connection.get()
+        row = conn.execute('SELECT * FROM job_runs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['stages'] = [dict(stage) for stage in conn.execute(
+            'SELECT stage, started_at, duration FROM job_stages WHERE job_id = ? ORDER BY seq', (job_id,))]
+        return job
+
+    def aggregates(self, since: float, project: str = None) -> Dict[str, Any]:
+        """按阶段以及按项目+阶段统计耗时的 p50/p95/p99；total 为任务总耗时"""
+        conn = self._connection.get()
+        project_filter, params = ('AND r.project = ?', [since, project]) if project else ('', [since])
+        stage_rows = conn.execute(
+            'SELECT r.project, s.stage, s.duration FROM job_stages s JOIN job_runs r ON r.id = s.job_id '
+            f'WHERE r.started_at >= ? {project_filter}', params).fetchall()
+        total_rows = conn.execute(
+            f'SELECT project, duration FROM job_runs r WHERE started_at >= ? AND duration IS NOT NULL {project_filter}',
+            params).fetchall()
+
+        by_stage: Dict[str, List[float]] = {}
+        by_project: Dict[str, Dict[str, List[float]]] = {}
+        for row in stage_rows:
+            by_stage.setdefault(row['stage'], []).append(row['duration'])
+            by_project.setdefault(row['project'], {}).setdefault(row['stage'], []).append(row['duration'])
+        for row in total_rows:
+            by_stage.setdefault('total', []).append(row['duration'])
+            by_project.setdefault(row['project'], {}).setdefault('total', []).append(row['duration'])
+
+        status_counts = {row['status']: row['count'] for row in conn.execute(
+            f'SELECT status, COUNT(*) AS count FROM job_runs r WHERE started_at >= ? {project_filter} GROUP BY status',
+            params)}
+        return {
+            'since': since,
+            'status': status_counts,
+            'stages': {stage: summarize(values) for stage, values in by_stage.items()},
+            'projects': {name: {stage: summarize(values) for stage, values in stages.items()}
+                         for name, stages in by_project.items()},
+        }
+
+
+_tracker: Optional[JobTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def tracking_enabled() -> bool:
+    return os.getenv('JOB_TRACKING_ENABLED', '1') == '1'
+
+
+def get_job_tracker() -> JobTracker:
+    """获取当前进程内的任务跟踪存储（懒加载）"""
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = JobTracker()
+    return _tracker
+
+
+def _job_ref(webhook_data: dict, url_slug: str) -> str:
+    """任务关联的 MR/PR 或 Push 标识，便于在任务列表中定位"""
+    from biz.queue.coalesce import job_identity
+
+    identity = job_identity(webhook_data, url_slug)
+    if identity:
+        return identity[0]
+    if isinstance(webhook_data, dict):
+        return f"push:{webhook_data.get('ref', '')}@{(webhook_data.get('after') or '')[:12]}"
+    return ''
+
+
+def tracked_job(kind: str) -> Callable:
+    """
+    任务跟踪装饰器，用于 worker 中的 webhook 处理函数 (webhook_data, token, url, url_slug)；
+    跟踪存储出错时只记录日志，不影响任务本身
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(webhook_data, token, url, url_slug):
+            if not tracking_enabled():
+                return function(webhook_data, token, url, url_slug)
+
+            from biz.queue.scheduler import project_key
+
+            run = JobRun(kind, project_key(webhook_data, url_slug), url_slug, _job_ref(webhook_data, url_slug))
+            try:
+                get_job_tracker().start(run)
+            except Exception as e:
+                logger.error(f"记录任务开始失败: {e}")
+            context_token = _current_job.set(run)
+            log_token = set_log_project(run.project)
+            try:
+                return function(webhook_data, token, url, url_slug)
+            except BaseException as e:
+                if run.status == JOB_RUNNING:
+                    set_job_status(JOB_FAILED, str(e))
+                raise
+            finally:
+                _current_job.reset(context_token)
+                reset_log_project(log_token)
+                run.finished_at = time.time()
+                if run.status == JOB_RUNNING:
+                    run.status = JOB_DONE
+                try:
+                    get_job_tracker().finish(run)
+                except Exception as e:
+                    logger.error(f"记录任务耗时失败: {e}")
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def job_stage(name: str):
+    """记录当前任务某个阶段的耗时；不在跟踪的任务中时不做任何事"""
+    run = _current_job.get()
+    if run is None:
+        yield
+        return
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        run.stages.append((name, started_at, time.time() - started_at))
+
+
+def set_job_status(status: str, error: str = ''):
+    """处理函数内部捕获异常后，用于标记当前任务失败或被取消"""
+    run = _current_job.get()
+    if run is not None:
+        run.status = status
+        run.error = error
+
+
+def current_job_id() -> Optional[str]:
+    run = _current_job.get()
+    return run.id if run is not None else None
@@ -0,0 +1,36 @@
+"""
+rq 任务载荷压缩
+webhook 数据以紧凑 JSON + zlib 压缩后的字节作为任务参数，而不是把完整的 dict pickle 进 Redis；
+Push 事件中大量重复的提交信息通常可压缩到原来的 10%~20%
+"""
+import json
+import os
+import zlib
+from typing import Any
+
+
+def compression_enabled() -> bool:
+    return os.getenv('RQ_COMPRESS_PAYLOAD', '1') == '1'
+
+
+def pack(data: Any) -> bytes:
+    """序列化并压缩任务数据"""
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(raw, int(os.getenv('RQ_COMPRESS_LEVEL', 6)))
+
+
+def unpack(payload: bytes) -> Any:
+    return json.loads(zlib.decompress(payload))
+
+
+def run_packed(handler: str, payload: bytes, token: str, url: str, url_slug: str):
+    """
+    在 rq worker 中解压任务数据后调用实际的处理函数
+
+    Args:
+        handler: 处理函数引用，如 biz.queue.worker:handle_push_event
+        payload: pack 生成的压缩数据
+    """
+    from biz.queue.sqlite_queue import resolve_function
+
+    resolve_function(handler)(unpack(payload), token, url, url_slug)
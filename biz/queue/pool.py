@@ -0,0 +1,273 @@
+"""
+常驻工作进程池
+为 async 队列驱动提供有上限、可回收、预热的工作进程，替代每个 webhook 单独 fork 一个进程的方式
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.pool import AsyncResult
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from biz.queue.process_stats import register_stats_provider
+from biz.queue.retry import RetryLater
+from biz.utils.log import logger
+
+
+def _execute(function: Callable, args: Tuple) -> Tuple[float, float]:
+    """
+    在工作进程中执行任务，并返回任务实际开始、结束的时间戳，用于统计排队等待与执行耗时
+    """
+    started_at = time.time()
+    try:
+        function(*args)
+    finally:
+        finished_at = time.time()
+    return started_at, finished_at
+
+
+def _run_callback(callback: Optional[Callable], error: Optional[BaseException]):
+    """回调异常不能抛出，否则会导致进程池的结果处理线程退出"""
+    if not callback:
+        return
+    try:
+        callback(error)
+    except Exception as e:
+        logger.error(f"工作进程池回调执行失败: {e}")
+
+
+class WorkerLost(TimeoutError):
+    """任务超过 ASYNC_WORKER_TASK_TIMEOUT 仍未结束：工作进程被杀死（OOM、段错误）时 multiprocessing.Pool 不会回调"""
+
+
+class _Task:
+    __slots__ = ('result', 'deadline', 'callback')
+
+    def __init__(self, deadline: float, callback: Optional[Callable]):
+        self.result: Optional[AsyncResult] = None
+        self.deadline = deadline
+        self.callback = callback
+
+
+class WorkerPool:
+    """
+    常驻工作进程池
+
+    - 进程数量固定（ASYNC_WORKER_POOL_SIZE），超出的任务在池内排队，不会无限制地创建进程
+    - 每个进程执行 max_tasks_per_child 个任务后自动退出并由进程池补齐，防止内存泄漏累积
+    - 退出的子进程由 multiprocessing.Pool 自动 join 回收，不会留下僵尸进程
+    - 子进程启动时执行 initializer 预热 LLM 客户端、tokenizer 与提示词模板
+    - 每个任务记录 AsyncResult 与截止时间；子进程中途被杀死时任务永远不会回调，超过 task_timeout 后按失败回收占用的名额
+    """
+
+    def __init__(self, size: int, max_tasks_per_child: Optional[int] = None, initializer: Callable = None,
+                 start_method: Optional[str] = None, preload_modules: Optional[list] = None,
+                 task_timeout: Optional[float] = None):
+        self.size = max(1, size)
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self.task_timeout = task_timeout or float(os.getenv('ASYNC_WORKER_TASK_TIMEOUT', 1800))
+        self.start_method = start_method or _default_start_method()
+
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == 'forkserver' and preload_modules:
+            # forkserver 预先导入依赖较重的模块，后续每次派生进程时无需重新导入 pandas/openai/tiktoken
+            context.set_forkserver_preload(preload_modules)
+
+        self._pool = context.Pool(processes=self.size, initializer=initializer,
+                                  maxtasksperchild=self.max_tasks_per_child)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._created_at = time.time()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._deferred = 0
+        self._lost = 0
+        self._tasks: Dict[int, _Task] = {}
+        self._next_task_id = 0
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._total_wait_seconds = 0.0
+        self._total_run_seconds = 0.0
+        # 用于计算平均利用率：累计 “忙碌进程数 × 时长”
+        self._busy_area = 0.0
+        self._last_change_at = self._created_at
+
+        logger.info(f"工作进程池已启动: size={self.size}, max_tasks_per_child={self.max_tasks_per_child}, "
+                    f"start_method={self.start_method}")
+
+    def submit(self, function: Callable, *args: Any,
+               callback: Optional[Callable[[Optional[BaseException]], None]] = None) -> None:
+        """
+        提交任务到进程池，立即返回
+
+        Args:
+            function: 任务函数，需可被 pickle（模块级函数）
+            args: 任务参数
+            callback: 任务结束后的回调，成功时参数为 None，失败时为异常对象；在进程池的结果线程中执行
+        """
+        if self._closed:
+            raise RuntimeError("WorkerPool has been closed")
+
+        submitted_at = time.time()
+        task = _Task(submitted_at + self.task_timeout, callback)
+        with self._lock:
+            self._accumulate_busy(submitted_at)
+            self._submitted += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            # 先登记再提交：任务可能在 apply_async 返回前就已完成并回调
+            self._tasks[task_id] = task
+
+        def finish() -> bool:
+            """已按超时回收的任务之后才结束时忽略，避免重复释放名额"""
+            with self._lock:
+                return self._tasks.pop(task_id, None) is not None
+
+        def on_success(result: Tuple[float, float]):
+            if not finish():
+                return
+            started_at, finished_at = result
+            self._on_done(success=True, wait_seconds=started_at - submitted_at,
+                          run_seconds=finished_at - started_at)
+            _run_callback(callback, None)
+
+        def on_error(error: BaseException):
+            if not finish():
+                return
+            if isinstance(error, RetryLater):
+                # 外部状态未就绪，由调度方延迟重新入队，不计为失败
+                self._on_done(success=False, deferred=True)
+            else:
+                logger.error(f"工作进程执行任务失败: {error}")
+                self._on_done(success=False)
+            _run_callback(callback, error)
+
+        task.result = self._pool.apply_async(_execute, (function, args), callback=on_success,
+                                             error_callback=on_error)
+
+    def reap_lost(self) -> int:
+        """
+        回收超过截止时间仍未结束的任务：释放名额，并以 WorkerLost 调用任务回调，由调度方按失败处理
+
+        Returns:
+            回收的任务数量
+        """
+        now = time.time()
+        with self._lock:
+            lost = [(task_id, task) for task_id, task in self._tasks.items()
+                    if task.deadline <= now and not (task.result is not None and task.result.ready())]
+            for task_id, _ in lost:
+                del self._tasks[task_id]
+            self._lost += len(lost)
+        for task_id, task in lost:
+            logger.error(f"工作进程池任务 {task_id} 超过 {self.task_timeout:.0f} 秒仍未结束，"
+                         f"工作进程可能已被杀死，释放其占用的名额")
+            self._on_done(success=False)
+            _run_callback(task.callback, WorkerLost(f"任务超过 {self.task_timeout:.0f} 秒仍未结束"))
+        return len(lost)
+
+    @property
+    def free_slots(self) -> int:
+        """当前空闲的工作进程数量；调度方轮询时顺带回收丢失的任务"""
+        if self._tasks:
+            self.reap_lost()
+        with self._lock:
+            return max(self.size - self._in_flight, 0)
+
+    def _on_done(self, success: bool, wait_seconds: float = 0.0, run_seconds: float = 0.0, deferred: bool = False):
+        with self._lock:
+            self._accumulate_busy(time.time())
+            self._in_flight -= 1
+            if deferred:
+                self._deferred += 1
+            elif success:
+                self._completed += 1
+                self._total_wait_seconds += max(wait_seconds, 0.0)
+                self._total_run_seconds += max(run_seconds, 0.0)
+            else:
+                self._failed += 1
+
+    def _accumulate_busy(self, now: float):
+        """调用方需持有锁"""
+        self._busy_area += min(self._in_flight, self.size) * (now - self._last_change_at)
+        self._last_change_at = now
+
+    def stats(self) -> Dict[str, Any]:
+        """返回进程池利用率统计，用于根据 webhook 速率调整进程池大小"""
+        if self._tasks:
+            self.reap_lost()
+        with self._lock:
+            now = time.time()
+            self._accumulate_busy(now)
+            busy = min(self._in_flight, self.size)
+            uptime = max(now - self._created_at, 1e-6)
+            return {
+                'size': self.size,
+                'max_tasks_per_child': self.max_tasks_per_child,
+                'start_method': self.start_method,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'deferred': self._deferred,
+                'lost': self._lost,
+                'in_flight': self._in_flight,
+                'busy': busy,
+                'queued': max(self._in_flight - self.size, 0),
+                'peak_in_flight': self._peak_in_flight,
+                'utilization': round(busy / self.size, 4),
+                'avg_utilization': round(self._busy_area / (uptime * self.size), 4),
+                'avg_wait_seconds': round(self._total_wait_seconds / self._completed, 3) if self._completed else 0.0,
+                'avg_run_seconds': round(self._total_run_seconds / self._completed, 3) if self._completed else 0.0,
+                'uptime_seconds': round(uptime, 1),
+            }
+
+    def close(self, wait: bool = True):
+        """停止接收新任务；wait=True 时等待已提交任务执行完毕"""
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.close()
+        if wait:
+            self._pool.join()
+        else:
+            self._pool.terminate()
+
+
+def _default_start_method() -> str:
+    method = os.getenv('ASYNC_WORKER_START_METHOD', '')
+    if method:
+        return method
+    # forkserver 避免从多线程的 Flask 进程直接 fork；不支持的平台退回 spawn
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool:
+    """获取当前进程内的全局工作进程池（懒加载）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from biz.queue.worker import init_worker
+
+                _pool = WorkerPool(
+                    size=int(os.getenv('ASYNC_WORKER_POOL_SIZE', os.cpu_count() or 2)),
+                    max_tasks_per_child=int(os.getenv('ASYNC_WORKER_MAX_TASKS_PER_CHILD', 50)),
+                    initializer=init_worker,
+                    preload_modules=['biz.queue.worker'],
+                )
+                atexit.register(_pool.close)
+                register_stats_provider('pool', _pool.stats)
+    return _pool
+
+
+def get_worker_pool_stats() -> Optional[Dict[str, Any]]:
+    """返回进程池统计信息，进程池尚未创建时返回 None"""
+    return _pool.stats() if _pool is not None else None
@@ -0,0 +1,136 @@
+"""
+各进程运行统计的共享存储
+
+准入计数（webhook worker）与工作进程池利用率（持有后台服务锁的进程或独立的队列 worker）保存在各自进程的内存中，
+python serve.py 多 worker 部署时，/api/queue/stats 由哪个 dashboard worker 应答都看不到其他进程的数据。
+因此各进程定期把自己的统计快照写入共享的 SQLite 表，/api/queue/stats 汇总所有存活进程的快照：
+- 每个进程一行，计数都是该进程启动以来的累计值，进程被回收重建后从 0 开始
+- 超过 PROCESS_STATS_TTL 秒未更新的快照视为进程已退出，不再返回
+- rq 驱动下多台机器的进程各自写入本机的数据库，只能看到本机的进程
+"""
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from biz.utils.log import logger
+
+
+class ProcessStatsStore:
+    """保存各进程统计快照的 SQLite 表"""
+
+    def __init__(self, db_file: str = None):
+        from biz.queue.sqlite_queue import LocalConnection
+
+        self.db_file = db_file or os.getenv('SQLITE_QUEUE_DB_FILE', 'data/queue.db')
+        self._connection = LocalConnection(self.db_file)
+        self._connection.get().execute('''
+            CREATE TABLE IF NOT EXISTS queue_process_stats (
+                process TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                process_group TEXT NOT NULL DEFAULT '',
+                stats TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def publish(self, process: str, pid: int, process_group: str, stats: Dict[str, Any]):
+        self._connection.get().execute(
+            'INSERT INTO queue_process_stats (process, pid, process_group, stats, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(process) DO UPDATE SET pid = excluded.pid, process_group = excluded.process_group, '
+            'stats = excluded.stats, updated_at = excluded.updated_at',
+            (process, pid, process_group, json.dumps(stats, ensure_ascii=False), time.time()))
+
+    def remove(self, process: str):
+        self._connection.get().execute('DELETE FROM queue_process_stats WHERE process = ?', (process,))
+
+    def snapshots(self, ttl: float) -> List[Dict[str, Any]]:
+        """返回 ttl 秒内更新过的快照，并清理已过期的记录"""
+        conn = self._connection.get()
+        expired_at = time.time() - ttl
+        conn.execute('DELETE FROM queue_process_stats WHERE updated_at < ?', (expired_at,))
+        return [{'process': row['process'], 'pid': row['pid'], 'group': row['process_group'],
+                 'updated_at': row['updated_at'], **json.loads(row['stats'])}
+                for row in conn.execute('SELECT * FROM queue_process_stats ORDER BY process').fetchall()]
+
+
+def publish_interval() -> float:
+    return float(os.getenv('PROCESS_STATS_INTERVAL', 10))
+
+
+def stats_ttl() -> float:
+    return float(os.getenv('PROCESS_STATS_TTL', publish_interval() * 3))
+
+
+_providers: Dict[str, Callable[[], Optional[Dict[str, Any]]]] = {}
+_store: Optional[ProcessStatsStore] = None
+_publisher_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_store() -> ProcessStatsStore:
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = ProcessStatsStore()
+    return _store
+
+
+def process_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def publish_now():
+    """把当前进程已注册的统计写入共享存储"""
+    stats = {}
+    for name, provider in list(_providers.items()):
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            logger.error(f"收集进程统计失败: {name}, {e}")
+    get_store().publish(process_name(), os.getpid(), os.getenv('GUNICORN_GROUP', ''), stats)
+
+
+def _run_publisher():
+    while True:
+        time.sleep(publish_interval())
+        try:
+            publish_now()
+        except Exception as e:
+            logger.error(f"写入进程统计失败: {e}")
+
+
+def _remove_on_exit():
+    try:
+        get_store().remove(process_name())
+    except Exception:
+        pass
+
+
+def register_stats_provider(name: str, provider: Callable[[], Optional[Dict[str, Any]]]):
+    """
+    注册当前进程的统计来源，并在本进程内启动定期写入的后台线程（fork 后的子进程会各自启动）
+
+    Args:
+        name: 快照中的字段名，如 admission、pool
+        provider: 返回统计字典的函数
+    """
+    global _publisher_pid
+    _providers[name] = provider
+    with _lock:
+        if _publisher_pid == os.getpid():
+            return
+        _publisher_pid = os.getpid()
+    threading.Thread(target=_run_publisher, name='process-stats-publisher', daemon=True).start()
+    atexit.register(_remove_on_exit)
+
+
+def get_process_stats() -> List[Dict[str, Any]]:
+    """汇总所有存活进程的统计快照；当前进程先写入一次，保证返回的是自己的最新数据"""
+    if _providers:
+        publish_now()
+    return get_store().snapshots(stats_ttl())
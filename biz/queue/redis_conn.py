@@ -0,0 +1,32 @@
+"""
+进程内共享的 Redis 连接池
+rq 队列、合并任务的版本登记表等所有 Redis 访问共用同一个连接池，不再为每个 url_slug 单独建立连接
+"""
+import os
+import threading
+from typing import Dict
+
+from redis import ConnectionPool, Redis
+
+from biz.utils.log import logger
+
+_pools: Dict[int, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_redis_connection() -> Redis:
+    """获取使用共享连接池的 Redis 客户端；连接池按进程隔离，fork 出的子进程会重新创建"""
+    pid = os.getpid()
+    pool = _pools.get(pid)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(pid)
+            if pool is None:
+                host = os.getenv('REDIS_HOST', '127.0.0.1')
+                port = int(os.getenv('REDIS_PORT', 6379))
+                logger.info(f'REDIS_HOST: {host}，REDIS_PORT: {port}')
+                pool = ConnectionPool(host=host, port=port,
+                                      max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 32)),
+                                      health_check_interval=30)
+                _pools[pid] = pool
+    return Redis(connection_pool=pool)
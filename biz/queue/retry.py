@@ -0,0 +1,59 @@
+"""
+延迟重试
+
+任务依赖的外部状态尚未就绪（如 MR 的 diff 仍在生成）时，处理函数抛出 RetryLater，
+由队列驱动把任务作为延迟任务重新入队，工作进程不再原地 sleep，可以先处理其他任务：
+- async：调度器在进程池回调中把任务放入延迟队列，到期后重新参与调度
+- sqlite：任务重新置为待执行并推迟 available_at，不计入失败次数
+- rq：入队时附带 rq 的 Retry（需 worker 使用 --with-scheduler 启动）
+"""
+import os
+import random
+from typing import List, Optional
+
+
+class RetryLater(Exception):
+    """任务暂时无法完成，稍后作为延迟任务重新执行"""
+
+    def __init__(self, message: str = '', delay: Optional[float] = None):
+        # args 保留全部参数，异常从工作进程传回时可以被正确反序列化
+        super().__init__(message, delay)
+        self.message = message
+        self.delay = delay
+
+    def __str__(self):
+        return self.message
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """第 attempt 次（从 1 开始）重试前的等待时间：指数退避，并在 [50%, 100%] 区间内随机抖动"""
+    return min(base * (2 ** (attempt - 1)), cap) * random.uniform(0.5, 1.0)
+
+
+def diff_poll_delays() -> List[float]:
+    """MR/PR 的 diff 未就绪时，在当前任务内短暂轮询的各次等待时间；仍未就绪时再抛出 RetryLater"""
+    attempts = int(os.getenv('SCM_DIFF_POLL_ATTEMPTS', 3))
+    base = float(os.getenv('SCM_DIFF_POLL_BASE_DELAY', 0.5))
+    cap = float(os.getenv('SCM_DIFF_POLL_MAX_DELAY', 4))
+    return [backoff_delay(attempt, base, cap) for attempt in range(1, attempts)]
+
+
+def retry_max_attempts() -> int:
+    """同一任务最多延迟重试的次数，超过后放弃"""
+    return int(os.getenv('QUEUE_RETRY_LATER_MAX_ATTEMPTS', 6))
+
+
+def retry_delay(error: RetryLater, attempt: int) -> float:
+    """
+    计算第 attempt 次延迟重试的等待时间；异常中指定了 delay（如限流的重置时间）时优先使用
+    """
+    if error.delay is not None:
+        return max(float(error.delay), 0.0)
+    return backoff_delay(attempt, float(os.getenv('QUEUE_RETRY_LATER_BASE_DELAY', 5)),
+                         float(os.getenv('QUEUE_RETRY_LATER_MAX_DELAY', 120)))
+
+
+def rq_retry_intervals() -> List[int]:
+    """rq 驱动下预先计算好的各次重试间隔（rq 的 Retry 只支持整数秒）"""
+    error = RetryLater()
+    return [max(int(retry_delay(error, attempt)), 1) for attempt in range(1, retry_max_attempts() + 1)]
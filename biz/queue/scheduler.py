@@ -0,0 +1,302 @@
+"""
+审查任务的优先级通道与按项目公平调度
+
+- 通道（lane）严格按优先级调度：MR/PR 审查 > Push 审查 > 回填（backfill）
+- 同一通道内按项目加权轮转（stride scheduling），单个项目的大量 Push 不会饿死其他项目
+- 每个项目可配置最大并发数
+- 抛出 RetryLater 的任务进入延迟队列，到期后重新参与调度
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from biz.queue.retry import RetryLater, retry_delay, retry_max_attempts
+from biz.utils.log import logger
+
+LANE_REVIEW = 'review'
+LANE_PUSH = 'push'
+LANE_BACKFILL = 'backfill'
+# 按优先级从高到低排列
+LANES = [LANE_REVIEW, LANE_PUSH, LANE_BACKFILL]
+
+
+def job_lane(webhook_data: Any) -> str:
+    """根据 webhook 数据推断任务所属通道"""
+    if isinstance(webhook_data, dict):
+        if webhook_data.get('object_kind') == 'merge_request' or isinstance(webhook_data.get('pull_request'), dict):
+            return LANE_REVIEW
+    return LANE_PUSH
+
+
+def project_key(webhook_data: Any, url_slug: str) -> str:
+    """用于公平调度与并发限制的项目标识，如 gitlab_com:group/project"""
+    project = ''
+    if isinstance(webhook_data, dict):
+        gitlab_project = webhook_data.get('project') or {}
+        github_repository = webhook_data.get('repository') or {}
+        project = (gitlab_project.get('path_with_namespace') or github_repository.get('full_name')
+                   or str(gitlab_project.get('id') or github_repository.get('id') or ''))
+    return f"{url_slug}:{project}"
+
+
+def _parse_mapping(value: str, cast: Callable) -> Dict[str, Any]:
+    """解析 "group/a:3,group/b:1" 格式的配置，键支持带 url_slug 前缀或仅项目路径"""
+    mapping = {}
+    for item in (value or '').split(','):
+        name, _, number = item.strip().rpartition(':')
+        if name and number:
+            try:
+                mapping[name] = cast(number)
+            except ValueError:
+                logger.warn(f"无法解析调度配置项: {item}")
+    return mapping
+
+
+class FairPicker:
+    """
+    项目间的加权轮转选择器（stride scheduling）
+
+    每个项目维护一个 pass 值，被选中后增加 1/weight；每次选择 pass 最小且未达到并发上限的项目。
+    空闲后重新活跃的项目 pass 值会被提升到当前通道的虚拟时间，避免积攒额度后突发占满工作进程。
+    """
+
+    def __init__(self, weights: Dict[str, float] = None, default_weight: float = 1.0,
+                 max_concurrency: Dict[str, int] = None, default_max_concurrency: int = 0):
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.max_concurrency = max_concurrency or {}
+        self.default_max_concurrency = default_max_concurrency
+        self._pass: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._virtual_time: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'FairPicker':
+        return cls(
+            weights=_parse_mapping(os.getenv('QUEUE_PROJECT_WEIGHTS', ''), float),
+            default_weight=float(os.getenv('QUEUE_PROJECT_DEFAULT_WEIGHT', 1)),
+            max_concurrency=_parse_mapping(os.getenv('QUEUE_PROJECT_MAX_CONCURRENCY_OVERRIDES', ''), int),
+            default_max_concurrency=int(os.getenv('QUEUE_PROJECT_MAX_CONCURRENCY', 0)),
+        )
+
+    def _lookup(self, mapping: Dict[str, Any], project: str, default: Any) -> Any:
+        if project in mapping:
+            return mapping[project]
+        # 支持不带 url_slug 前缀的项目路径
+        short_name = project.split(':', 1)[-1]
+        return mapping.get(short_name, default)
+
+    def weight(self, project: str) -> float:
+        return max(float(self._lookup(self.weights, project, self.default_weight)), 0.01)
+
+    def concurrency_limit(self, project: str) -> int:
+        """项目最大并发数，0 表示不限制"""
+        return int(self._lookup(self.max_concurrency, project, self.default_max_concurrency))
+
+    def pick(self, lane: str, candidates: Iterable[str], running: Dict[str, int]) -> Optional[str]:
+        """
+        从有待执行任务的项目中选出下一个要执行的项目
+
+        Args:
+            lane: 通道
+            candidates: 当前通道有待执行任务的项目
+            running: 各项目正在执行的任务数
+
+        Returns:
+            选中的项目，所有候选项目都达到并发上限时返回 None
+        """
+        with self._lock:
+            passes = self._pass[lane]
+            virtual_time = self._virtual_time[lane]
+            chosen = None
+            chosen_pass = None
+            for project in candidates:
+                limit = self.concurrency_limit(project)
+                if limit and running.get(project, 0) >= limit:
+                    continue
+                project_pass = max(passes.get(project, virtual_time), virtual_time)
+                if chosen is None or project_pass < chosen_pass:
+                    chosen, chosen_pass = project, project_pass
+            if chosen is None:
+                return None
+            passes[chosen] = chosen_pass + 1.0 / self.weight(chosen)
+            self._virtual_time[lane] = chosen_pass
+            return chosen
+
+
+class _PendingJob:
+    __slots__ = ('function', 'args', 'lane', 'project', 'coalesce_key', 'coalesce_revision', 'enqueued_at',
+                 'cancelled', 'retries')
+
+    def __init__(self, function: Callable, args: tuple, lane: str, project: str, coalesce_key: Optional[str],
+                 coalesce_revision: Optional[str] = None):
+        self.function = function
+        self.args = args
+        self.lane = lane
+        self.project = project
+        self.coalesce_key = coalesce_key
+        self.coalesce_revision = coalesce_revision
+        self.enqueued_at = time.time()
+        self.cancelled = False
+        self.retries = 0
+
+
+class AsyncDispatcher:
+    """
+    async 驱动的调度器：任务先按通道、项目排队，在工作进程池有空闲时按优先级与公平策略提交执行。
+    排队中的同一 MR/PR 任务会被版本不同的新任务直接取代；版本相同时保留排队中的任务，丢弃新任务。
+    任务抛出 RetryLater 时放入按到期时间排序的延迟队列，到期后重新排队。
+    """
+
+    def __init__(self, pool, picker: FairPicker = None):
+        self.pool = pool
+        self.picker = picker or FairPicker.from_env()
+        self._pending: Dict[str, 'OrderedDict[str, Deque[_PendingJob]]'] = {lane: OrderedDict() for lane in LANES}
+        self._by_coalesce_key: Dict[str, _PendingJob] = {}
+        # (到期时间, 序号, 任务)
+        self._delayed: List[Tuple[float, int, _PendingJob]] = []
+        self._delayed_sequence = itertools.count()
+        self._running: Dict[str, int] = defaultdict(int)
+        self._pending_count = 0
+        self._superseded = 0
+        self._retried = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='async-queue-dispatcher', daemon=True)
+        self._thread.start()
+
+    def put(self, function: Callable, args: tuple, lane: str, project: str, coalesce_key: Optional[str] = None,
+            coalesce_revision: Optional[str] = None):
+        job = _PendingJob(function, args, lane if lane in self._pending else LANE_PUSH, project, coalesce_key,
+                          coalesce_revision)
+        with self._condition:
+            if coalesce_key:
+                previous = self._by_coalesce_key.get(coalesce_key)
+                if (previous is not None and not previous.cancelled and coalesce_revision is not None
+                        and previous.coalesce_revision == coalesce_revision):
+                    logger.info(f"{coalesce_key} 已有相同版本的任务排队，忽略新的事件")
+                    return
+                self._by_coalesce_key.pop(coalesce_key, None)
+                if previous is not None and not previous.cancelled:
+                    previous.cancelled = True
+                    self._pending_count -= 1
+                    self._superseded += 1
+                    logger.info(f"{coalesce_key} 有新的事件入队，已取代排队中的任务")
+                self._by_coalesce_key[coalesce_key] = job
+            self._pending[job.lane].setdefault(project, deque()).append(job)
+            self._pending_count += 1
+            self._condition.notify()
+
+    def _retry_later(self, job: _PendingJob, error: RetryLater):
+        """调用方需持有锁"""
+        if job.coalesce_key and job.coalesce_key in self._by_coalesce_key:
+            logger.info(f"{job.coalesce_key} 已有新的事件排队，放弃延迟重试: {error}")
+            return
+        if job.retries >= retry_max_attempts():
+            logger.error(f"任务延迟重试 {job.retries} 次后仍未就绪，已放弃({job.project}): {error}")
+            return
+        job.retries += 1
+        delay = retry_delay(error, job.retries)
+        if job.coalesce_key:
+            self._by_coalesce_key[job.coalesce_key] = job
+        heapq.heappush(self._delayed, (time.time() + delay, next(self._delayed_sequence), job))
+        self._pending_count += 1
+        self._retried += 1
+        logger.info(f"任务 {delay:.1f} 秒后第 {job.retries} 次延迟重试({job.project}): {error}")
+
+    def _promote_due_jobs(self):
+        """调用方需持有锁：将到期的延迟任务移回所在通道排队"""
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            job = heapq.heappop(self._delayed)[2]
+            if not job.cancelled:
+                self._pending[job.lane].setdefault(job.project, deque()).append(job)
+
+    def _next_job(self) -> Optional[_PendingJob]:
+        """调用方需持有锁"""
+        self._promote_due_jobs()
+        for lane in LANES:
+            projects = self._pending[lane]
+            while projects:
+                project = self.picker.pick(lane, list(projects), self._running)
+                if project is None:
+                    break
+                queue = projects[project]
+                job = queue.popleft()
+                if not queue:
+                    del projects[project]
+                if job.cancelled:
+                    continue
+                if job.coalesce_key and self._by_coalesce_key.get(job.coalesce_key) is job:
+                    del self._by_coalesce_key[job.coalesce_key]
+                return job
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                job = None
+                while job is None:
+                    if self.pool.free_slots > 0:
+                        job = self._next_job()
+                    if job is None:
+                        self._condition.wait(timeout=1)
+                self._pending_count -= 1
+                self._running[job.project] += 1
+            try:
+                self.pool.submit(job.function, *job.args, callback=self._make_callback(job))
+            except Exception as e:
+                logger.error(f"提交任务到工作进程池失败: {e}")
+                self._make_callback(job)(e)
+
+    def _make_callback(self, job: _PendingJob):
+        def callback(error: Optional[BaseException]):
+            with self._condition:
+                self._running[job.project] -= 1
+                if self._running[job.project] <= 0:
+                    del self._running[job.project]
+                if isinstance(error, RetryLater):
+                    self._retry_later(job, error)
+                self._condition.notify()
+
+        return callback
+
+    def load(self) -> Tuple[int, int]:
+        """返回 (排队中任务数, 执行中任务数)"""
+        with self._condition:
+            return self._pending_count, sum(self._running.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                'pending': self._pending_count,
+                'lanes': {lane: sum(len([job for job in queue if not job.cancelled]) for queue in projects.values())
+                          for lane, projects in self._pending.items()},
+                'delayed': sum(1 for _, _, job in self._delayed if not job.cancelled),
+                'running_by_project': dict(self._running),
+                'superseded': self._superseded,
+                'retried': self._retried,
+            }
+
+
+_dispatcher: Optional[AsyncDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> AsyncDispatcher:
+    """获取当前进程内的 async 调度器（懒加载）"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                from biz.queue.pool import get_worker_pool
+
+                _dispatcher = AsyncDispatcher(get_worker_pool())
+    return _dispatcher
+
+
+def get_dispatcher_stats() -> Optional[Dict[str, Any]]:
+    return _dispatcher.stats() if _dispatcher is not None else None
@@ -0,0 +1,162 @@
+"""
+webhook 原始请求体暂存（spool）
+
+入口只把原始请求字节写入一次 SQLite（BLOB），队列中只传递很小的任务描述（spool_id、事件类型、url_slug），
+由工作进程自行读取并解析请求体：
+- 大体积的 Push 事件（数 MB）不再被重复序列化、pickle 到子进程或写入 Redis，webhook 响应时间保持平稳
+- 原始请求体按保留期限保存，可用于问题排查与重放：python -m biz.queue.spool replay <spool_id>
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from biz.utils.log import logger
+
+
+class WebhookSpool:
+    """基于 SQLite BLOB 表的仅追加暂存区，使用独立的数据库文件，避免大体积请求体拖慢任务表"""
+
+    PURGE_INTERVAL_SECONDS = 3600
+
+    def __init__(self, db_file: str = None, retention_seconds: int = None):
+        from biz.queue.sqlite_queue import LocalConnection
+
+        self.db_file = db_file or os.getenv('WEBHOOK_SPOOL_DB_FILE', 'data/webhook_spool.db')
+        self.retention_seconds = retention_seconds or int(os.getenv('WEBHOOK_SPOOL_RETENTION_HOURS', 72)) * 3600
+        self._connection = LocalConnection(self.db_file)
+        self._last_purge_at = 0.0
+        self._connection.get().execute('''
+            CREATE TABLE IF NOT EXISTS webhook_spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                event TEXT NOT NULL,
+                url TEXT NOT NULL,
+                url_slug TEXT NOT NULL,
+                handler TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                received_at REAL NOT NULL
+            )
+        ''')
+        self._connection.get().execute(
+            'CREATE INDEX IF NOT EXISTS idx_webhook_spool_received ON webhook_spool (received_at)')
+
+    def append(self, body: bytes, source: str, event: str, url: str, url_slug: str, handler: str) -> int:
+        """写入原始请求体，返回 spool_id"""
+        now = time.time()
+        if now - self._last_purge_at > self.PURGE_INTERVAL_SECONDS:
+            self._last_purge_at = now
+            self.purge(self.retention_seconds)
+        cursor = self._connection.get().execute(
+            'INSERT INTO webhook_spool (source, event, url, url_slug, handler, length, body, received_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (source, event, url, url_slug, handler, len(body), body, now))
+        return cursor.lastrowid
+
+    def read(self, spool_id: int) -> Optional[bytes]:
+        row = self._connection.get().execute('SELECT body FROM webhook_spool WHERE id = ?', (spool_id,)).fetchone()
+        return bytes(row['body']) if row else None
+
+    def get(self, spool_id: int) -> Optional[Dict[str, Any]]:
+        """读取暂存记录的元数据（不含请求体）"""
+        row = self._connection.get().execute(
+            'SELECT id, source, event, url, url_slug, handler, length, received_at FROM webhook_spool WHERE id = ?',
+            (spool_id,)).fetchone()
+        return dict(row) if row else None
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = self._connection.get().execute(
+            'SELECT id, source, event, url_slug, handler, length, received_at FROM webhook_spool '
+            'ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge(self, older_than_seconds: int) -> int:
+        """删除超过保留期限的请求体"""
+        cursor = self._connection.get().execute('DELETE FROM webhook_spool WHERE received_at < ?',
+                                                (time.time() - older_than_seconds,))
+        if cursor.rowcount:
+            logger.info(f"已清理 {cursor.rowcount} 条过期的 webhook 暂存记录")
+        return cursor.rowcount
+
+
+def spool_enabled() -> bool:
+    """
+    是否启用暂存；rq 驱动的 worker 可能部署在其他机器上，默认不启用，
+    除非 WEBHOOK_SPOOL_DB_FILE 位于各 worker 共享的存储上
+    """
+    default = '0' if os.getenv('QUEUE_DRIVER', 'async') == 'rq' else '1'
+    return os.getenv('WEBHOOK_SPOOL_ENABLED', default) == '1'
+
+
+_spool: Optional[WebhookSpool] = None
+_spool_lock = threading.Lock()
+
+
+def get_spool() -> WebhookSpool:
+    """获取当前进程内的暂存区（懒加载）"""
+    global _spool
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = WebhookSpool()
+    return _spool
+
+
+def run_spooled(handler: str, spool_id: int, token: str, url: str, url_slug: str):
+    """
+    在工作进程中执行暂存的 webhook 事件：读取并解析原始请求体后调用实际的处理函数
+
+    Args:
+        handler: 处理函数引用，如 biz.queue.worker:handle_push_event
+        spool_id: 暂存记录 ID
+    """
+    from biz.queue.sqlite_queue import resolve_function
+
+    body = get_spool().read(spool_id)
+    if body is None:
+        logger.error(f"webhook 暂存记录不存在或已过期: spool_id={spool_id}")
+        return
+    resolve_function(handler)(json.loads(body), token, url, url_slug)
+
+
+def replay(spool_ids: List[int]) -> int:
+    """将暂存的 webhook 事件批量重新入队，访问令牌从环境变量读取；返回重新投递的事件数"""
+    from biz.queue.sqlite_queue import resolve_function
+    from biz.utils.queue import handle_queue_many
+
+    items = []
+    for spool_id in spool_ids:
+        record = get_spool().get(spool_id)
+        if record is None:
+            logger.warn(f"webhook 暂存记录不存在: spool_id={spool_id}")
+            continue
+        token_env = 'GITHUB_ACCESS_TOKEN' if record['source'] == 'github' else 'GITLAB_ACCESS_TOKEN'
+        token = os.getenv(token_env)
+        if not token:
+            raise ValueError(f"重放需要配置 {token_env}")
+        body = get_spool().read(spool_id)
+        items.append(dict(function=resolve_function(record['handler']), data=json.loads(body), token=token,
+                          url=record['url'], url_slug=record['url_slug'], raw_body=body, source=record['source'],
+                          event=record['event']))
+    if items:
+        handle_queue_many(items)
+    return len(items)
+
+
+if __name__ == '__main__':
+    # python -m biz.queue.spool [list | replay <spool_id> [<spool_id> ...]]
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv("conf/.env")
+
+    if len(sys.argv) > 2 and sys.argv[1] == 'replay':
+        count = replay([int(spool_id) for spool_id in sys.argv[2:]])
+        print(f"已重新投递 {count} 个 webhook 事件")
+    else:
+        for item in get_spool().recent():
+            print(f"{item['id']}\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(item['received_at']))}\t"
+                  f"{item['source']}\t{item['event']}\t{item['url_slug']}\t{item['length']} bytes")
@@ -0,0 +1,517 @@
+"""
+基于 SQLite 的持久化任务队列
+无需 Redis 即可在单机部署中获得持久化队列：租约（可见性超时）、失败重试与退避、死信状态以及启动时的崩溃恢复
+"""
+import importlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from biz.queue.retry import RetryLater, retry_delay, retry_max_attempts
+from biz.queue.scheduler import FairPicker, LANES, LANE_PUSH
+from biz.utils.log import logger
+
+# 任务状态
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_DEAD = 'dead'
+STATUS_SUPERSEDED = 'superseded'
+
+
+class LocalConnection:
+    """每个线程（以及 fork 后的每个进程）复用一个 SQLite 连接；WAL 模式下读写互不阻塞，入队可达每秒数千次"""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            db_dir = os.path.dirname(self.db_file)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL;')
+            conn.execute('PRAGMA synchronous = NORMAL;')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+def function_path(function: Callable) -> str:
+    """将模块级函数转换为可持久化的引用，如 biz.queue.worker:handle_push_event"""
+    return f"{function.__module__}:{function.__qualname__}"
+
+
+def resolve_function(path: str) -> Callable:
+    """根据 function_path 生成的引用导入函数"""
+    module_name, _, qualname = path.partition(':')
+    target = importlib.import_module(module_name)
+    for attr in qualname.split('.'):
+        target = getattr(target, attr)
+    return target
+
+
+class SqliteJobQueue:
+    """
+    SQLite 任务表
+
+    - 入队即写入 queue_jobs 表，进程重启后任务不会丢失
+    - 领取任务时设置租约 lease_expires_at，执行期间由消费者续约；租约过期的任务会被重新投递
+    - 任务抛出异常后按指数退避重试，超过 max_attempts 进入 dead（死信）状态
+    - 任务抛出 RetryLater 时推迟执行，不计入失败次数
+    """
+
+    def __init__(self, db_file: str = None, visibility_timeout: int = None, max_attempts: int = None,
+                 retry_backoff: float = None, retry_backoff_max: float = None):
+        self.db_file = db_file or os.getenv('SQLITE_QUEUE_DB_FILE', 'data/queue.db')
+        self.visibility_timeout = visibility_timeout or int(os.getenv('SQLITE_QUEUE_VISIBILITY_TIMEOUT', 600))
+        self.max_attempts = max_attempts or int(os.getenv('SQLITE_QUEUE_MAX_ATTEMPTS', 3))
+        self.retry_backoff = retry_backoff or float(os.getenv('SQLITE_QUEUE_RETRY_BACKOFF', 10))
+        self.retry_backoff_max = retry_backoff_max or float(os.getenv('SQLITE_QUEUE_RETRY_BACKOFF_MAX', 600))
+        self._connection = LocalConnection(self.db_file)
+        self.init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connection.get()
+
+    def init_db(self):
+        """初始化任务表"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS queue_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                queue TEXT NOT NULL,
+                function TEXT NOT NULL,
+                args TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                available_at REAL NOT NULL,
+                lease_expires_at REAL,
+                worker_id TEXT,
+                last_error TEXT,
+                coalesce_key TEXT,
+                coalesce_revision TEXT,
+                lane TEXT NOT NULL DEFAULT 'push',
+                project TEXT NOT NULL DEFAULT '',
+                retries INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        # 兼容旧版本的任务表
+        current_columns = [col[1] for col in conn.execute("PRAGMA table_info(queue_jobs)").fetchall()]
+        new_columns = [
+            ('coalesce_key', 'TEXT'),
+            ('coalesce_revision', 'TEXT'),
+            ('lane', "TEXT NOT NULL DEFAULT 'push'"),
+            ('project', "TEXT NOT NULL DEFAULT ''"),
+            ('retries', 'INTEGER NOT NULL DEFAULT 0'),
+        ]
+        for column_name, column_type in new_columns:
+            if column_name not in current_columns:
+                conn.execute(f"ALTER TABLE queue_jobs ADD COLUMN {column_name} {column_type}")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_queue_jobs_status_available ON queue_jobs (status, available_at, id);')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_queue_jobs_status_lease ON queue_jobs (status, lease_expires_at);')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_queue_jobs_coalesce_key ON queue_jobs (coalesce_key, status);')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_queue_jobs_lane_project ON queue_jobs '
+                     '(status, lane, project, available_at);')
+
+    def enqueue(self, function: Callable, args: tuple, queue: str = 'default', delay: float = 0,
+                coalesce_key: str = None, lane: str = LANE_PUSH, project: str = '', coalesce_revision: str = None) -> int:
+        """
+        任务入队
+
+        Args:
+            function: 模块级任务函数
+            args: 任务参数，需可 JSON 序列化
+            queue: 队列名称（通常为 url_slug）
+            delay: 延迟执行的秒数
+            coalesce_key: 合并键，同一键下尚未执行、版本不同的旧任务会被新任务取代
+            lane: 优先级通道
+            project: 项目标识，用于公平调度与并发限制
+            coalesce_revision: 合并版本，同一键下已有相同版本的任务排队时不再重复入队，返回排队中任务的 ID
+
+        Returns:
+            任务 ID
+        """
+        return self.enqueue_many([dict(function=function, args=args, queue=queue, delay=delay,
+                                       coalesce_key=coalesce_key, lane=lane, project=project,
+                                       coalesce_revision=coalesce_revision)])[0]
+
+    def enqueue_many(self, jobs: List[Dict[str, Any]]) -> List[int]:
+        """
+        批量入队，所有任务在同一个事务中写入，供重放、回填等工具使用
+
+        Args:
+            jobs: 任务列表，每项的键与 enqueue 的参数相同（function、args 必填）
+
+        Returns:
+            任务 ID 列表
+        """
+        now = time.time()
+        job_ids = []
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for job in jobs:
+                coalesce_key = job.get('coalesce_key')
+                coalesce_revision = job.get('coalesce_revision')
+                if coalesce_key:
+                    duplicate = coalesce_revision is not None and conn.execute(
+                        'SELECT id FROM queue_jobs WHERE coalesce_key = ? AND status = ? AND coalesce_revision = ? '
+                        'ORDER BY id DESC LIMIT 1', (coalesce_key, STATUS_PENDING, coalesce_revision)).fetchone()
+                    if duplicate:
+                        logger.info(f"{coalesce_key} 已有相同版本的任务排队，忽略新的事件")
+                        job_ids.append(duplicate['id'])
+                        continue
+                    superseded = conn.execute(
+                        'UPDATE queue_jobs SET status = ?, updated_at = ? WHERE coalesce_key = ? AND status = ?',
+                        (STATUS_SUPERSEDED, now, coalesce_key, STATUS_PENDING)).rowcount
+                    if superseded:
+                        logger.info(f"{coalesce_key} 有新的事件入队，已取代 {superseded} 个排队中的任务")
+                cursor = conn.execute(
+                    'INSERT INTO queue_jobs (queue, function, args, status, max_attempts, available_at, coalesce_key, '
+                    'coalesce_revision, lane, project, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job.get('queue', 'default'), function_path(job['function']),
+                     json.dumps(list(job['args']), ensure_ascii=False), STATUS_PENDING, self.max_attempts,
+                     now + job.get('delay', 0), coalesce_key, coalesce_revision, job.get('lane', LANE_PUSH),
+                     job.get('project', ''), now, now))
+                job_ids.append(cursor.lastrowid)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return job_ids
+
+    def claim(self, worker_id: str, picker: FairPicker = None) -> Optional[Dict[str, Any]]:
+        """
+        领取一个到期的待执行任务并加租约，没有可执行任务时返回 None。
+        按通道优先级依次查找，同一通道内由 picker 在各项目间加权轮转，并跳过达到并发上限的项目。
+        """
+        picker = picker or FairPicker()
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            running = {row['project']: row['count'] for row in conn.execute(
+                'SELECT project, COUNT(*) AS count FROM queue_jobs WHERE status = ? GROUP BY project',
+                (STATUS_RUNNING,)).fetchall()}
+            row = None
+            for lane in LANES:
+                candidates = {candidate['project']: candidate['id'] for candidate in conn.execute(
+                    'SELECT project, MIN(id) AS id FROM queue_jobs WHERE status = ? AND lane = ? AND available_at <= ? '
+                    'GROUP BY project', (STATUS_PENDING, lane, now)).fetchall()}
+                if not candidates:
+                    continue
+                project = picker.pick(lane, sorted(candidates, key=candidates.get), running)
+                if project is None:
+                    continue
+                row = conn.execute(
+                    '''
+                    UPDATE queue_jobs
+                    SET status = ?, attempts = attempts + 1, worker_id = ?, lease_expires_at = ?, updated_at = ?
+                    WHERE id = ? AND status = ?
+                    RETURNING id, queue, function, args, attempts, max_attempts, lane, project
+                    ''',
+                    (STATUS_RUNNING, worker_id, now + self.visibility_timeout, now, candidates[project], STATUS_PENDING)
+                ).fetchone()
+                break
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        job = dict(row)
+        job['args'] = json.loads(job['args'])
+        return job
+
+    def heartbeat(self, job_ids: List[int], worker_id: str):
+        """为执行中的任务续约"""
+        if not job_ids:
+            return
+        placeholders = ','.join('?' * len(job_ids))
+        self._connect().execute(
+            f'UPDATE queue_jobs SET lease_expires_at = ?, updated_at = ? '
+            f'WHERE status = ? AND worker_id = ? AND id IN ({placeholders})',
+            (time.time() + self.visibility_timeout, time.time(), STATUS_RUNNING, worker_id, *job_ids))
+
+    def ack(self, job_id: int):
+        """任务执行成功"""
+        self._connect().execute(
+            'UPDATE queue_jobs SET status = ?, lease_expires_at = NULL, updated_at = ? WHERE id = ?',
+            (STATUS_DONE, time.time(), job_id))
+
+    def fail(self, job_id: int, error: str):
+        """任务执行失败：未超过最大次数时按指数退避（带抖动）重新排队，否则进入死信状态"""
+        conn = self._connect()
+        row = conn.execute('SELECT attempts, max_attempts FROM queue_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return
+        now = time.time()
+        if row['attempts'] >= row['max_attempts']:
+            conn.execute(
+                'UPDATE queue_jobs SET status = ?, lease_expires_at = NULL, last_error = ?, updated_at = ? WHERE id = ?',
+                (STATUS_DEAD, error, now, job_id))
+            logger.error(f"队列任务 {job_id} 重试 {row['attempts']} 次后仍失败，已转入死信: {error}")
+            return
+        delay = min(self.retry_backoff * (2 ** (row['attempts'] - 1)), self.retry_backoff_max)
+        delay *= random.uniform(0.5, 1.0)
+        conn.execute(
+            'UPDATE queue_jobs SET status = ?, available_at = ?, lease_expires_at = NULL, last_error = ?, '
+            'updated_at = ? WHERE id = ?',
+            (STATUS_PENDING, now + delay, error, now, job_id))
+        logger.warn(f"队列任务 {job_id} 执行失败，{delay:.1f} 秒后第 {row['attempts'] + 1} 次尝试: {error}")
+
+    def defer(self, job_id: int, error: RetryLater):
+        """任务依赖的外部状态未就绪：重新置为待执行并推迟 available_at，超过最大延迟重试次数后进入死信状态"""
+        conn = self._connect()
+        row = conn.execute('SELECT retries FROM queue_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return
+        now = time.time()
+        if row['retries'] >= retry_max_attempts():
+            conn.execute(
+                'UPDATE queue_jobs SET status = ?, lease_expires_at = NULL, last_error = ?, updated_at = ? WHERE id = ?',
+                (STATUS_DEAD, str(error), now, job_id))
+            logger.error(f"队列任务 {job_id} 延迟重试 {row['retries']} 次后仍未就绪，已转入死信: {error}")
+            return
+        delay = retry_delay(error, row['retries'] + 1)
+        # 领取时增加的 attempts 退回，延迟重试不占用失败重试次数
+        conn.execute(
+            'UPDATE queue_jobs SET status = ?, available_at = ?, lease_expires_at = NULL, last_error = ?, '
+            'attempts = MAX(attempts - 1, 0), retries = retries + 1, updated_at = ? WHERE id = ?',
+            (STATUS_PENDING, now + delay, str(error), now, job_id))
+        logger.info(f"队列任务 {job_id} {delay:.1f} 秒后第 {row['retries'] + 1} 次延迟重试: {error}")
+
+    def recover(self, worker_id_prefix: str = None) -> int:
+        """
+        崩溃恢复：将租约已过期的任务重新置为待执行；
+        指定 worker_id_prefix（主机名）时，同时回收本机上已不存在的进程所持有的任务
+
+        Returns:
+            重新投递的任务数量
+        """
+        conn = self._connect()
+        now = time.time()
+        recovered = conn.execute(
+            'UPDATE queue_jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? '
+            'WHERE status = ? AND lease_expires_at < ?',
+            (STATUS_PENDING, now, STATUS_RUNNING, now)).rowcount
+
+        if worker_id_prefix:
+            rows = conn.execute('SELECT DISTINCT worker_id FROM queue_jobs WHERE status = ? AND worker_id LIKE ?',
+                                (STATUS_RUNNING, f'{worker_id_prefix}:%')).fetchall()
+            for row in rows:
+                pid = row['worker_id'].rsplit(':', 1)[-1]
+                if pid.isdigit() and not _pid_alive(int(pid)):
+                    recovered += conn.execute(
+                        'UPDATE queue_jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? '
+                        'WHERE status = ? AND worker_id = ?',
+                        (STATUS_PENDING, now, STATUS_RUNNING, row['worker_id'])).rowcount
+        if recovered:
+            logger.warn(f"已重新投递 {recovered} 个中断的队列任务")
+        return recovered
+
+    def requeue_dead(self, job_id: int = None) -> int:
+        """将死信任务重新置为待执行，不指定 job_id 时处理全部死信"""
+        now = time.time()
+        sql = 'UPDATE queue_jobs SET status = ?, attempts = 0, available_at = ?, updated_at = ? WHERE status = ?'
+        params = [STATUS_PENDING, now, now, STATUS_DEAD]
+        if job_id is not None:
+            sql += ' AND id = ?'
+            params.append(job_id)
+        return self._connect().execute(sql, params).rowcount
+
+    def purge(self, older_than_seconds: int) -> int:
+        """清理已完成或已被取代的历史任务"""
+        return self._connect().execute('DELETE FROM queue_jobs WHERE status IN (?, ?) AND updated_at < ?',
+                                       (STATUS_DONE, STATUS_SUPERSEDED, time.time() - older_than_seconds)).rowcount
+
+    def load(self) -> Tuple[int, int]:
+        """返回 (待执行任务数, 执行中任务数)，用于入口的准入控制"""
+        rows = self._connect().execute(
+            'SELECT status, COUNT(*) AS count FROM queue_jobs WHERE status IN (?, ?) GROUP BY status',
+            (STATUS_PENDING, STATUS_RUNNING)).fetchall()
+        counts = {row['status']: row['count'] for row in rows}
+        return counts.get(STATUS_PENDING, 0), counts.get(STATUS_RUNNING, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """按状态统计任务数量，并给出各通道待执行数与各项目执行中的任务数"""
+        conn = self._connect()
+        rows = conn.execute('SELECT status, COUNT(*) AS count FROM queue_jobs GROUP BY status').fetchall()
+        counts = {STATUS_PENDING: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_DEAD: 0, STATUS_SUPERSEDED: 0}
+        counts.update({row['status']: row['count'] for row in rows})
+        lanes = {lane: 0 for lane in LANES}
+        lanes.update({row['lane']: row['count'] for row in conn.execute(
+            'SELECT lane, COUNT(*) AS count FROM queue_jobs WHERE status = ? GROUP BY lane', (STATUS_PENDING,))})
+        counts['lanes'] = lanes
+        counts['running_by_project'] = {row['project']: row['count'] for row in conn.execute(
+            'SELECT project, COUNT(*) AS count FROM queue_jobs WHERE status = ? GROUP BY project', (STATUS_RUNNING,))}
+        return counts
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SqliteQueueWorker:
+    """
+    SQLite 队列消费者：从任务表领取任务并交给常驻工作进程池执行，同时负责续约、失败重试与崩溃恢复
+    """
+
+    def __init__(self, job_queue: SqliteJobQueue, pool, poll_interval: float = None):
+        self.job_queue = job_queue
+        self.pool = pool
+        self.poll_interval = poll_interval or float(os.getenv('SQLITE_QUEUE_POLL_INTERVAL', 0.5))
+        self.hostname = socket.gethostname()
+        self.worker_id = f"{self.hostname}:{os.getpid()}"
+        self.retention_seconds = int(os.getenv('SQLITE_QUEUE_RETENTION_HOURS', 24)) * 3600
+        self.picker = FairPicker.from_env()
+        self._running_jobs: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wakeup_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """在后台线程中启动消费循环"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run_forever, name='sqlite-queue-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup_event.set()
+
+    def wakeup(self):
+        """有新任务入队时唤醒消费循环，避免等待轮询间隔"""
+        self._wakeup_event.set()
+
+    def run_forever(self):
+        logger.info(f"SQLite 队列消费者已启动: worker_id={self.worker_id}, db={self.job_queue.db_file}")
+        # 启动时回收上次崩溃遗留的任务
+        self.job_queue.recover(worker_id_prefix=self.hostname)
+        last_maintenance = time.time()
+        heartbeat_interval = max(self.job_queue.visibility_timeout / 3, 1)
+
+        while not self._stop_event.is_set():
+            try:
+                dispatched = self._dispatch()
+
+                now = time.time()
+                if now - last_maintenance >= heartbeat_interval:
+                    with self._lock:
+                        running_ids = list(self._running_jobs)
+                    self.job_queue.heartbeat(running_ids, self.worker_id)
+                    self.job_queue.recover()
+                    self.job_queue.purge(self.retention_seconds)
+                    last_maintenance = now
+
+                if not dispatched:
+                    self._wakeup_event.wait(self.poll_interval)
+                    self._wakeup_event.clear()
+            except Exception as e:
+                logger.error(f"SQLite 队列消费循环异常: {e}")
+                self._stop_event.wait(self.poll_interval)
+
+    def _dispatch(self) -> int:
+        """在工作进程池有空闲时领取并提交任务，返回本轮提交的任务数量"""
+        dispatched = 0
+        while self.pool.free_slots > 0:
+            job = self.job_queue.claim(self.worker_id, self.picker)
+            if job is None:
+                break
+            try:
+                function = resolve_function(job['function'])
+            except (ImportError, AttributeError) as e:
+                self.job_queue.fail(job['id'], f"无法加载任务函数 {job['function']}: {e}")
+                continue
+            with self._lock:
+                self._running_jobs[job['id']] = time.time()
+            self.pool.submit(function, *job['args'], callback=self._make_callback(job['id']))
+            dispatched += 1
+        return dispatched
+
+    def _make_callback(self, job_id: int):
+        def callback(error: Optional[BaseException]):
+            with self._lock:
+                self._running_jobs.pop(job_id, None)
+            if error is None:
+                self.job_queue.ack(job_id)
+            elif isinstance(error, RetryLater):
+                self.job_queue.defer(job_id, error)
+            else:
+                self.job_queue.fail(job_id, f"{type(error).__name__}: {error}")
+            self.wakeup()
+
+        return callback
+
+
+_job_queue: Optional[SqliteJobQueue] = None
+_worker: Optional[SqliteQueueWorker] = None
+_init_lock = threading.Lock()
+
+
+def get_job_queue() -> SqliteJobQueue:
+    """获取当前进程内的全局 SQLite 任务队列"""
+    global _job_queue
+    if _job_queue is None:
+        with _init_lock:
+            if _job_queue is None:
+                _job_queue = SqliteJobQueue()
+    return _job_queue
+
+
+def start_consumer() -> SqliteQueueWorker:
+    """在当前进程启动 SQLite 队列消费者（后台线程）"""
+    global _worker
+    from biz.queue.pool import get_worker_pool
+
+    with _init_lock:
+        if _worker is None:
+            _worker = SqliteQueueWorker(get_job_queue(), get_worker_pool())
+            _worker.start()
+    return _worker
+
+
+def get_consumer() -> Optional[SqliteQueueWorker]:
+    return _worker
+
+
+if __name__ == '__main__':
+    # 独立运行消费者：python -m biz.queue.sqlite_queue [requeue-dead]
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv("conf/.env")
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'requeue-dead':
+        count = get_job_queue().requeue_dead()
+        print(f"已重新投递 {count} 个死信任务")
+    else:
+        consumer = start_consumer()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            consumer.stop()
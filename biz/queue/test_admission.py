@@ -0,0 +1,64 @@
+from unittest import TestCase, main
+
+from biz.queue.admission import AdmissionController
+from biz.queue.scheduler import LANE_BACKFILL, LANE_REVIEW
+
+
+class TestAdmissionController(TestCase):
+    def setUp(self):
+        self.load = (0, 0)
+
+    def controller(self, **kwargs) -> AdmissionController:
+        return AdmissionController(lambda url_slug: self.load, **kwargs)
+
+    def test_disabled_by_default(self):
+        """未配置上限时始终接收"""
+        self.load = (10000, 10000)
+        decision = self.controller().admit(LANE_REVIEW)
+        self.assertTrue(decision.accepted)
+        self.assertEqual(decision.lane, LANE_REVIEW)
+
+    def test_reject_over_limit(self):
+        """超过排队上限时拒绝并计数"""
+        controller = self.controller(max_queue_depth=10, retry_after=15)
+        self.load = (9, 0)
+        self.assertTrue(controller.admit(LANE_REVIEW).accepted)
+        self.load = (10, 0)
+        decision = controller.admit(LANE_REVIEW)
+        self.assertFalse(decision.accepted)
+        self.assertEqual((decision.reason, decision.retry_after), ('queue_depth', 15))
+        self.assertEqual(controller.stats()['shed_by_reason'], {'queue_depth': 1})
+
+    def test_degrade_to_backfill(self):
+        """degrade 策略下超限事件进入回填通道，达到硬上限后拒绝"""
+        controller = self.controller(max_in_flight=4, max_queue_depth=10, policy='degrade')
+        self.load = (0, 4)
+        decision = controller.admit(LANE_REVIEW)
+        self.assertTrue(decision.accepted)
+        self.assertEqual(decision.lane, LANE_BACKFILL)
+        self.load = (20, 4)
+        self.assertFalse(controller.admit(LANE_REVIEW).accepted)
+        stats = controller.stats()
+        self.assertEqual((stats['degraded'], stats['shed']), (1, 1))
+
+    def test_degrade_with_only_in_flight_limit(self):
+        """只配置执行中上限时 degrade 策略仍然降级，而不是等同于 reject"""
+        controller = self.controller(max_in_flight=4, policy='degrade')
+        self.load = (500, 4)
+        decision = controller.admit(LANE_REVIEW)
+        self.assertTrue(decision.accepted)
+        self.assertEqual(decision.lane, LANE_BACKFILL)
+
+        controller = self.controller(max_in_flight=4, policy='degrade', degrade_max_queue_depth=100)
+        self.assertFalse(controller.admit(LANE_REVIEW).accepted)
+
+    def test_load_error_fails_open(self):
+        """获取负载失败时放行"""
+        def broken(url_slug):
+            raise RuntimeError('redis down')
+
+        self.assertTrue(AdmissionController(broken, max_queue_depth=1).admit(LANE_REVIEW).accepted)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import os
+import tempfile
+from unittest import TestCase, main
+
+from biz.queue import coalesce
+from biz.queue.coalesce import JobSuperseded, SqliteRevisionRegistry, ensure_current, job_identity, \
+    publish_revision
+from biz.queue.scheduler import AsyncDispatcher, FairPicker
+from biz.queue.sqlite_queue import SqliteJobQueue
+from biz.utils.queue import _prepare_job
+
+
+def merge_request_event(sha: str, action: str = 'update') -> dict:
+    return {
+        'object_kind': 'merge_request',
+        'project': {'id': 7},
+        'object_attributes': {'iid': 3, 'target_project_id': 7, 'action': action, 'last_commit': {'id': sha}},
+    }
+
+
+def pull_request_event(sha: str, action: str = 'synchronize') -> dict:
+    return {'action': action, 'repository': {'full_name': 'owner/repo'},
+            'pull_request': {'number': 5, 'head': {'sha': sha}}}
+
+
+def sample_job(data, token, url, url_slug):
+    return None
+
+
+class BusyPool:
+    """没有空闲名额的进程池，任务一直留在调度器中排队"""
+    free_slots = 0
+
+
+class TestCoalesce(TestCase):
+    def setUp(self):
+        """使用临时数据库作为版本登记表"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        coalesce._registry = SqliteRevisionRegistry(3600, db_file=os.path.join(self.tmp_dir.name, 'queue.db'))
+
+    def tearDown(self):
+        coalesce._registry = None
+        self.tmp_dir.cleanup()
+
+    def test_job_identity(self):
+        self.assertEqual(job_identity(merge_request_event('abc'), 'gitlab_com'), ('gitlab_com:7:mr:3', 'abc'))
+        pull_request = {'action': 'synchronize', 'repository': {'full_name': 'owner/repo'},
+                        'pull_request': {'number': 5, 'head': {'sha': 'def'}}}
+        self.assertEqual(job_identity(pull_request, 'github_com'), ('github_com:owner/repo:pr:5', 'def'))
+        self.assertIsNone(job_identity({'object_kind': 'push'}, 'gitlab_com'))
+
+    def test_newer_sha_supersedes(self):
+        """新的提交到达后，旧任务在检查点被取消"""
+        old_event = merge_request_event('sha1')
+        publish_revision(old_event, 'gitlab_com')
+        ensure_current(old_event, 'gitlab_com')
+
+        publish_revision(merge_request_event('sha2'), 'gitlab_com')
+        with self.assertRaises(JobSuperseded):
+            ensure_current(old_event, 'gitlab_com')
+
+    def test_close_cancels_review(self):
+        """MR 合并后，进行中的审查被取消"""
+        event = merge_request_event('sha1')
+        publish_revision(event, 'gitlab_com')
+        publish_revision(merge_request_event('sha1', action='merge'), 'gitlab_com')
+        with self.assertRaises(JobSuperseded):
+            ensure_current(event, 'gitlab_com')
+
+
+    def test_non_review_action_not_published(self):
+        """审批、指派等事件不登记版本，也不会取消进行中的审查"""
+        event = pull_request_event('sha1', action='opened')
+        publish_revision(event, 'github_com')
+        self.assertIsNone(publish_revision(pull_request_event('sha2', action='review_requested'), 'github_com'))
+        self.assertIsNone(publish_revision(merge_request_event('sha2', action='approved'), 'gitlab_com'))
+        ensure_current(event, 'github_com')
+
+
+class TestCoalesceDispatch(TestCase):
+    """非审查事件或相同版本的事件不能取代排队中的审查任务"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(self.tmp_dir.name, 'queue.db')
+        coalesce._registry = SqliteRevisionRegistry(3600, db_file=db_file)
+        self.queue = SqliteJobQueue(db_file=db_file)
+
+    def tearDown(self):
+        coalesce._registry = None
+        self.tmp_dir.cleanup()
+
+    def events(self):
+        return [
+            (pull_request_event('sha1', action='opened'), 'github_com'),
+            (pull_request_event('sha1', action='review_requested'), 'github_com'),
+            (pull_request_event('sha1', action='synchronize'), 'github_com'),
+            (merge_request_event('sha1', action='open'), 'gitlab_com'),
+            (merge_request_event('sha1', action='approved'), 'gitlab_com'),
+            (merge_request_event('sha1', action='update'), 'gitlab_com'),
+        ]
+
+    def test_sqlite_queue_keeps_pending_review(self):
+        for event, url_slug in self.events():
+            self.queue.enqueue_many([_prepare_job(sample_job, event, '', '', url_slug)])
+        self.assertEqual(self.queue.stats()['superseded'], 0)
+        actions = []
+        while True:
+            job = self.queue.claim('host:1')
+            if job is None:
+                break
+            data = job['args'][0]
+            actions.append(data.get('action') or data.get('object_attributes', {}).get('action'))
+        self.assertEqual(sorted(actions), ['approved', 'open', 'opened', 'review_requested'])
+
+    def test_async_dispatcher_keeps_pending_review(self):
+        dispatcher = AsyncDispatcher(BusyPool(), FairPicker())
+        for event, url_slug in self.events():
+            job = _prepare_job(sample_job, event, '', '', url_slug)
+            dispatcher.put(job['function'], job['args'], lane=job['lane'], project=job['project'],
+                           coalesce_key=job['coalesce_key'], coalesce_revision=job['coalesce_revision'])
+        stats = dispatcher.stats()
+        self.assertEqual(stats['superseded'], 0)
+        self.assertEqual(stats['pending'], 4)
+
+    def test_newer_revision_still_supersedes(self):
+        self.queue.enqueue_many([_prepare_job(sample_job, pull_request_event('sha1', action='opened'), '', '',
+                                              'github_com')])
+        self.queue.enqueue_many([_prepare_job(sample_job, pull_request_event('sha2'), '', '', 'github_com')])
+        self.assertEqual(self.queue.stats()['superseded'], 1)
+        self.assertEqual(self.queue.claim('host:1')['args'][0]['pull_request']['head']['sha'], 'sha2')
+
+
+if __name__ == '__main__':
+    main()
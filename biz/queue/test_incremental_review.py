@@ -0,0 +1,51 @@
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.entity.review_entity import MergeRequestReviewEntity
+from biz.queue.worker import commits_since, incremental_fallback_reason
+from biz.service.review_service import ReviewService
+
+
+def change(lines: int) -> dict:
+    return {'new_path': 'a.py', 'diff': '', 'additions': lines, 'deletions': 0}
+
+
+class TestIncrementalReview(TestCase):
+    def test_commits_since(self):
+        """GitLab 按时间倒序返回 commits，上次审查的提交之前的为新增提交"""
+        commits = [{'id': 'c3'}, {'id': 'c2'}, {'id': 'c1'}]
+        self.assertEqual(commits_since(commits, 'c2'), [{'id': 'c3'}])
+        self.assertEqual(commits_since(commits, 'c3'), [])
+        self.assertIsNone(commits_since(commits, 'rebased'))
+
+    def test_fallback_reason(self):
+        new_commits = [{'id': 'c3', 'parent_ids': ['c2']}]
+        self.assertEqual(incremental_fallback_reason([change(10)], new_commits), '')
+        self.assertIn('无法获取', incremental_fallback_reason(None, new_commits))
+        self.assertIn('rebase', incremental_fallback_reason([change(10)], None))
+        self.assertIn('合并提交', incremental_fallback_reason([change(10)], [{'id': 'm', 'parent_ids': ['a', 'b']}]))
+        with patch.dict(os.environ, {'MR_INCREMENTAL_REVIEW_MAX_LINES': '100'}):
+            self.assertIn('超过', incremental_fallback_reason([change(60), change(60)], new_commits))
+        with patch.dict(os.environ, {'MR_INCREMENTAL_REVIEW_MAX_LINES': '0'}):
+            self.assertEqual(incremental_fallback_reason([change(10000)], new_commits), '')
+
+    def test_get_last_mr_review(self):
+        """取同一 MR 最近一次记录了 last_commit_id 的审查结果"""
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch.object(ReviewService, 'DB_FILE', os.path.join(tmp_dir, 'data.db')):
+            ReviewService.init_db()
+            self.assertIsNone(ReviewService.get_last_mr_review('demo', 'feature', 'main'))
+            for updated_at, sha, result in [(1, 'c1', '总分:70分'), (2, 'c2', '总分:80分'), (3, '', '旧记录')]:
+                ReviewService.insert_mr_review_log(MergeRequestReviewEntity(
+                    project_name='demo', author='dev', source_branch='feature', target_branch='main',
+                    updated_at=updated_at, commits=[{'message': 'fix'}], score=0, url='', review_result=result,
+                    url_slug='gitlab_com', webhook_data={}, additions=1, deletions=0, last_commit_id=sha))
+            previous = ReviewService.get_last_mr_review('demo', 'feature', 'main')
+            self.assertEqual(previous['last_commit_id'], 'c2')
+            self.assertEqual(previous['review_result'], '总分:80分')
+
+
+if __name__ == '__main__':
+    main()
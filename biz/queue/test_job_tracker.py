@@ -0,0 +1,73 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.queue import job_tracker
+from biz.queue.job_tracker import JOB_CANCELLED, JobTracker, job_stage, percentile, set_job_status, tracked_job
+
+WEBHOOK_DATA = {'object_kind': 'merge_request', 'project': {'id': 1, 'path_with_namespace': 'group/app'},
+                'object_attributes': {'iid': 7, 'last_commit': {'id': 'abc'}}}
+
+
+@tracked_job('merge_request')
+def sample_handler(webhook_data, token, url, url_slug):
+    with job_stage('fetch_changes'):
+        time.sleep(0.01)
+    with job_stage('llm_review'):
+        pass
+
+
+@tracked_job('merge_request')
+def cancelled_handler(webhook_data, token, url, url_slug):
+    set_job_status(JOB_CANCELLED, 'superseded')
+
+
+class TestJobTracker(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tracker = JobTracker(db_file=os.path.join(self.tmp_dir.name, 'queue.db'))
+        patcher = patch.object(job_tracker, '_tracker', self.tracker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_records_stages(self):
+        """记录任务状态与各阶段耗时"""
+        sample_handler(WEBHOOK_DATA, 'token', 'url', 'slug')
+        jobs = self.tracker.list_jobs()
+        self.assertEqual(jobs['total'], 1)
+        job = self.tracker.get_job(jobs['items'][0]['id'])
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['project'], 'slug:group/app')
+        self.assertEqual(job['ref'], 'slug:1:mr:7')
+        self.assertEqual([stage['stage'] for stage in job['stages']], ['fetch_changes', 'llm_review'])
+        self.assertGreaterEqual(job['stages'][0]['duration'], 0.01)
+
+    def test_status_and_aggregates(self):
+        """标记的状态与按阶段、按项目的百分位统计"""
+        sample_handler(WEBHOOK_DATA, 'token', 'url', 'slug')
+        cancelled_handler(WEBHOOK_DATA, 'token', 'url', 'slug')
+        stats = self.tracker.aggregates(since=0)
+        self.assertEqual(stats['status'], {'done': 1, 'cancelled': 1})
+        self.assertEqual(stats['stages']['fetch_changes']['count'], 1)
+        self.assertEqual(stats['stages']['total']['count'], 2)
+        self.assertIn('llm_review', stats['projects']['slug:group/app'])
+
+    def test_stage_outside_job(self):
+        """不在任务中时 job_stage 不做任何事"""
+        with job_stage('fetch_changes'):
+            pass
+        self.assertEqual(self.tracker.list_jobs()['total'], 0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile(values, 99)), (50, 95, 99))
+        self.assertEqual(percentile([], 50), 0.0)
+
+
+if __name__ == '__main__':
+    main()
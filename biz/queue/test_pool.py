@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+from unittest import TestCase, main
+
+from biz.queue.pool import WorkerLost, WorkerPool
+
+
+def sample_job():
+    return None
+
+
+def killed_job():
+    # 模拟工作进程在任务中途被 OOM killer 杀死
+    os._exit(1)
+
+
+class TestWorkerPool(TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(size=1, start_method='fork', task_timeout=0.5)
+
+    def tearDown(self):
+        self.pool.close(wait=False)
+
+    def submit(self, function):
+        done = threading.Event()
+        errors = []
+
+        def callback(error):
+            errors.append(error)
+            done.set()
+
+        self.pool.submit(function, callback=callback)
+        return done, errors
+
+    def test_completed_task_releases_slot(self):
+        done, errors = self.submit(sample_job)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(errors, [None])
+        self.assertEqual(self.pool.free_slots, 1)
+
+    def test_lost_task_releases_slot(self):
+        """工作进程被杀死时没有回调，超时后释放名额并以 WorkerLost 通知调度方"""
+        done, errors = self.submit(killed_job)
+        self.assertEqual(self.pool.free_slots, 0)
+        time.sleep(0.6)
+        self.assertEqual(self.pool.free_slots, 1)
+        self.assertTrue(done.is_set())
+        self.assertIsInstance(errors[0], WorkerLost)
+        self.assertEqual(self.pool.stats()['lost'], 1)
+
+        # 进程池补齐工作进程后仍可继续执行任务
+        done, errors = self.submit(sample_job)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(errors, [None])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+
+from biz.queue.admission import AdmissionController, merge_admission_stats
+from biz.queue.process_stats import ProcessStatsStore
+
+
+class TestProcessStats(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = ProcessStatsStore(db_file=os.path.join(self.tmp_dir.name, 'queue.db'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_snapshots_from_all_processes(self):
+        """webhook worker 的准入计数与 leader 的进程池统计都能从共享存储读到"""
+        webhook = AdmissionController(lambda url_slug: (10, 0), max_queue_depth=10)
+        webhook.admit('review')
+        self.store.publish('host:1', 1, 'webhook', {'admission': webhook.stats()})
+        self.store.publish('host:2', 2, 'dashboard', {'admission': None, 'pool': {'utilization': 0.5}})
+
+        snapshots = self.store.snapshots(ttl=60)
+        self.assertEqual([(s['process'], s['group']) for s in snapshots], [('host:1', 'webhook'),
+                                                                          ('host:2', 'dashboard')])
+        self.assertEqual(snapshots[1]['pool'], {'utilization': 0.5})
+        merged = merge_admission_stats([s.get('admission') for s in snapshots])
+        self.assertEqual((merged['shed'], merged['processes']), (1, 1))
+
+    def test_stale_snapshots_dropped(self):
+        """超过 ttl 未更新的进程视为已退出"""
+        self.store.publish('host:1', 1, 'webhook', {})
+        time.sleep(0.05)
+        self.assertEqual(self.store.snapshots(ttl=0.01), [])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import time
+from collections import Counter
+from unittest import TestCase, main
+
+from biz.queue.retry import RetryLater
+from biz.queue.scheduler import AsyncDispatcher, FairPicker, LANE_BACKFILL, LANE_PUSH, LANE_REVIEW
+from biz.queue.sqlite_queue import SqliteJobQueue
+
+
+def sample_job(*args):
+    return None
+
+
+class TestFairPicker(TestCase):
+    def test_weighted_round_robin(self):
+        """按权重在项目间轮转"""
+        picker = FairPicker(weights={'group/a': 3})
+        picks = Counter(picker.pick(LANE_PUSH, ['slug:group/a', 'slug:group/b'], {}) for _ in range(40))
+        self.assertEqual(picks['slug:group/a'], 30)
+        self.assertEqual(picks['slug:group/b'], 10)
+
+    def test_concurrency_limit(self):
+        """达到并发上限的项目被跳过"""
+        picker = FairPicker(default_max_concurrency=1)
+        self.assertEqual(picker.pick(LANE_PUSH, ['a', 'b'], {'a': 1}), 'b')
+        self.assertIsNone(picker.pick(LANE_PUSH, ['a'], {'a': 1}))
+
+
+class RetryOncePool:
+    """第一次执行抛出 RetryLater，之后正常完成"""
+    free_slots = 1
+
+    def __init__(self):
+        self.submitted_at = []
+
+    def submit(self, function, *args, callback=None):
+        self.submitted_at.append(time.time())
+        callback(RetryLater('not ready', delay=0.2) if len(self.submitted_at) == 1 else None)
+
+
+class TestAsyncDispatcherRetry(TestCase):
+    def test_retry_later_is_delayed(self):
+        """抛出 RetryLater 的任务进入延迟队列，到期后重新执行"""
+        pool = RetryOncePool()
+        dispatcher = AsyncDispatcher(pool, FairPicker())
+        dispatcher.put(sample_job, (), lane=LANE_REVIEW, project='app')
+        deadline = time.time() + 5
+        while len(pool.submitted_at) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(pool.submitted_at), 2)
+        self.assertGreaterEqual(pool.submitted_at[1] - pool.submitted_at[0], 0.2)
+        self.assertEqual(dispatcher.stats()['retried'], 1)
+
+
+class TestSqliteLanes(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue = SqliteJobQueue(db_file=os.path.join(self.tmp_dir.name, 'queue.db'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lane_priority_and_fairness(self):
+        """MR 审查优先于 Push，同一通道内项目轮转"""
+        for i in range(3):
+            self.queue.enqueue(sample_job, (f'mono-{i}',), lane=LANE_PUSH, project='mono')
+        self.queue.enqueue(sample_job, ('app',), lane=LANE_PUSH, project='app')
+        self.queue.enqueue(sample_job, ('backfill',), lane=LANE_BACKFILL, project='app')
+        self.queue.enqueue(sample_job, ('mr',), lane=LANE_REVIEW, project='app')
+
+        picker = FairPicker()
+        order = [self.queue.claim('host:1', picker)['args'][0] for _ in range(6)]
+        self.assertEqual(order[0], 'mr')
+        self.assertEqual(order[1:3], ['mono-0', 'app'])
+        self.assertEqual(order[-1], 'backfill')
+
+    def test_project_concurrency_cap(self):
+        """项目达到并发上限时领取其他项目的任务"""
+        self.queue.enqueue(sample_job, ('mono-0',), project='mono')
+        self.queue.enqueue(sample_job, ('mono-1',), project='mono')
+        self.queue.enqueue(sample_job, ('app',), project='app')
+
+        picker = FairPicker(default_max_concurrency=1)
+        self.assertEqual(self.queue.claim('host:1', picker)['args'][0], 'mono-0')
+        self.assertEqual(self.queue.claim('host:1', picker)['args'][0], 'app')
+        self.assertIsNone(self.queue.claim('host:1', picker))
+
+
+if __name__ == '__main__':
+    main()
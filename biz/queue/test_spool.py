@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.queue import spool
+from biz.queue.spool import WebhookSpool, run_spooled
+
+received = []
+
+
+def sample_handler(data, token, url, url_slug):
+    received.append((data, token, url, url_slug))
+
+
+class TestWebhookSpool(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spool = WebhookSpool(db_file=os.path.join(self.tmp_dir.name, 'spool.db'))
+        received.clear()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_and_read(self):
+        """原始请求体按字节原样保存"""
+        body = json.dumps({'object_kind': 'push', 'commits': ['x' * 1024] * 100}).encode('utf-8')
+        spool_id = self.spool.append(body, 'gitlab', 'push', 'https://gitlab.example.com', 'gitlab_example_com',
+                                     f'{__name__}:sample_handler')
+        self.assertEqual(self.spool.read(spool_id), body)
+        self.assertEqual(self.spool.get(spool_id)['length'], len(body))
+        self.assertIsNone(self.spool.read(spool_id + 1))
+
+    def test_run_spooled(self):
+        """工作进程读取暂存的请求体并调用实际的处理函数"""
+        handler = f'{__name__}:sample_handler'
+        spool_id = self.spool.append(b'{"object_kind": "push"}', 'gitlab', 'push', 'url', 'slug', handler)
+        with patch.object(spool, '_spool', self.spool):
+            run_spooled(handler, spool_id, 'token', 'url', 'slug')
+            run_spooled(handler, spool_id + 1, 'token', 'url', 'slug')
+        self.assertEqual(received, [({'object_kind': 'push'}, 'token', 'url', 'slug')])
+
+    def test_purge(self):
+        self.spool.append(b'{}', 'github', 'push', 'url', 'slug', 'handler')
+        self.assertEqual(self.spool.purge(-1), 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+
+from biz.queue.retry import RetryLater
+from biz.queue.sqlite_queue import SqliteJobQueue, function_path, resolve_function
+
+
+def sample_job(data, token, url, url_slug):
+    return data
+
+
+class TestSqliteJobQueue(TestCase):
+    def setUp(self):
+        """使用临时数据库文件"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue = SqliteJobQueue(db_file=os.path.join(self.tmp_dir.name, 'queue.db'), visibility_timeout=60,
+                                    max_attempts=2, retry_backoff=0.01, retry_backoff_max=0.01)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_enqueue_claim_ack(self):
+        """入队、领取、确认"""
+        job_id = self.queue.enqueue(sample_job, ({'a': 1}, 'token', 'url', 'slug'), queue='slug')
+        job = self.queue.claim('host:1')
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(job['args'], [{'a': 1}, 'token', 'url', 'slug'])
+        self.assertIs(resolve_function(job['function']), sample_job)
+        self.assertIsNone(self.queue.claim('host:1'))
+
+        self.queue.ack(job_id)
+        self.assertEqual(self.queue.stats()['done'], 1)
+
+    def test_delayed_job(self):
+        """延迟任务到期前不会被领取"""
+        self.queue.enqueue(sample_job, ({}, '', '', ''), delay=60)
+        self.assertIsNone(self.queue.claim('host:1'))
+
+    def test_retry_then_dead_letter(self):
+        """失败后退避重试，超过最大次数进入死信"""
+        job_id = self.queue.enqueue(sample_job, ({}, '', '', ''))
+        self.queue.claim('host:1')
+        self.queue.fail(job_id, 'boom')
+        self.assertEqual(self.queue.stats()['pending'], 1)
+
+        time.sleep(0.02)
+        job = self.queue.claim('host:1')
+        self.assertEqual(job['attempts'], 2)
+        self.queue.fail(job_id, 'boom again')
+        self.assertEqual(self.queue.stats()['dead'], 1)
+
+        self.assertEqual(self.queue.requeue_dead(), 1)
+        self.assertEqual(self.queue.stats()['pending'], 1)
+
+    def test_recover_expired_lease(self):
+        """租约过期的任务在恢复时重新投递"""
+        self.queue.visibility_timeout = -1
+        self.queue.enqueue(sample_job, ({}, '', '', ''))
+        self.queue.claim('host:1')
+        self.assertEqual(self.queue.recover(), 1)
+        self.assertIsNotNone(self.queue.claim('host:2'))
+
+    def test_recover_dead_process(self):
+        """本机已退出进程持有的任务在启动时回收"""
+        self.queue.enqueue(sample_job, ({}, '', '', ''))
+        self.queue.claim('host:99999999')
+        self.assertEqual(self.queue.recover(worker_id_prefix='host'), 1)
+
+    def test_coalesce_supersedes_pending(self):
+        """同一合并键的新任务取代排队中的旧任务"""
+        self.queue.enqueue(sample_job, ({'sha': 1}, '', '', ''), coalesce_key='slug:1:mr:2')
+        self.queue.enqueue(sample_job, ({'sha': 2}, '', '', ''), coalesce_key='slug:1:mr:2')
+        self.assertEqual(self.queue.stats()['superseded'], 1)
+        job = self.queue.claim('host:1')
+        self.assertEqual(job['args'][0], {'sha': 2})
+        self.assertIsNone(self.queue.claim('host:1'))
+
+    def test_defer_does_not_consume_attempts(self):
+        """RetryLater 推迟任务且不占用失败重试次数"""
+        job_id = self.queue.enqueue(sample_job, ({}, '', '', ''))
+        self.queue.claim('host:1')
+        self.queue.defer(job_id, RetryLater('diff not ready', delay=0))
+        job = self.queue.claim('host:1')
+        self.assertEqual(job['attempts'], 1)
+
+        self.queue.defer(job_id, RetryLater('diff not ready', delay=60))
+        self.assertIsNone(self.queue.claim('host:1'))
+        self.assertEqual(self.queue.stats()['pending'], 1)
+
+    def test_function_path(self):
+        self.assertEqual(function_path(sample_job), f'{__name__}:sample_job')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import os
 import traceback
 from datetime import datetime
+from typing import List
 
 from biz.entity.review_entity import MergeRequestReviewEntity, PushReviewEntity
 from biz.event.event_manager import event_manager
@@ -9,16 +10,122 @@ from biz.github.webhook_handler import filter_changes as filter_github_changes,
 from biz.service.review_service import ReviewService
 from biz.utils.code_reviewer import CodeReviewer
 from biz.utils.im import notifier
-from biz.utils.log import logger
+from biz.llm.factory import Factory
+from biz.queue.coalesce import GITHUB_REVIEW_ACTIONS, GITLAB_REVIEW_ACTIONS, JobSuperseded, ensure_current
+from biz.queue.job_tracker import JOB_CANCELLED, JOB_DEFERRED, JOB_FAILED, job_stage, set_job_status, tracked_job
+from biz.queue.retry import RetryLater
+from biz.utils import diff_model
+from biz.utils.code_reviewer import load_prompt_templates
+from biz.utils.diff_minifier import minify_for_review
+from biz.utils.diff_packer import chunk_for_review
+from biz.utils.log import logger, summarize_changes
+from biz.utils.parallel import run_parallel
+from biz.utils.token_util import get_encoding
+
+
+def init_worker():
+    '''
+    工作进程初始化：预热 LLM 客户端、tokenizer 与提示词模板，进程生命周期内只执行一次
+    '''
+    try:
+        get_encoding()
+        load_prompt_templates("code_review_prompt", os.getenv("REVIEW_STYLE", "professional"))
+        Factory.getSharedClient()
+        logger.info(f'工作进程 {os.getpid()} 预热完成')
+    except Exception as e:
+        # 预热失败不影响进程启动，任务执行时会再次初始化并上报错误
+        logger.error(f'工作进程 {os.getpid()} 预热失败: {e}')
+
+
+def check_target_branch_protected(handler) -> bool:
+    '''判断目标分支是否为受保护分支，并记录查询耗时'''
+    with job_stage('check_protected_branch'):
+        return handler.target_branch_protected()
+
+
+def staged(name: str, function):
+    '''包装为记录阶段耗时的无参调用，供 run_parallel 并发执行'''
+    def call():
+        with job_stage(name):
+            return function()
+
+    return call
+
+
+def fetch_review_inputs(handler, get_changes, get_commits, check_protected: bool) -> dict:
+    '''
+    并发获取 changes、commits 以及（按需）目标分支是否受保护，耗时取决于最慢的一个请求
+
+    Returns:
+        {'changes': [...], 'commits': [...], 'protected': bool}，未检查受保护分支时 protected 为 True
+    '''
+    calls = {
+        'changes': staged('fetch_changes', get_changes),
+        'commits': staged('fetch_commits', get_commits),
+    }
+    if check_protected:
+        calls['protected'] = lambda: check_target_branch_protected(handler)
+    fetched = run_parallel(calls)
+    fetched.setdefault('protected', True)
+    return fetched
+
+
+def render_review_changes(changes: list) -> List[str]:
+    '''
+    把过滤后的 changes 构建为 diff 模型，精简（DIFF_MINIFY_ENABLED）并按 REVIEW_MAX_TOKENS 分配预算后，
+    渲染为发送给 LLM 的紧凑 diff 文本；超大变更（REVIEW_MAP_REDUCE_ENABLED）按文件边界切分为多段，交给
+    CodeReviewer.review_chunks 并发审查。变更全部被精简掉（生成文件、依赖目录、纯重命名、纯空白修改）时返回空列表
+    '''
+    with job_stage('minify_diff'):
+        files = minify_for_review(diff_model.from_changes(changes))
+    with job_stage('pack_diff'):
+        return chunk_for_review(files)
+
+
+def commits_since(commits: list, base_sha: str):
+    '''
+    MR 的 commits（GitLab 按时间倒序返回）中 base_sha 之后新增的提交；
+    base_sha 已不在 MR 中（rebase 或强制推送）时返回 None
+    '''
+    for index, commit in enumerate(commits):
+        if commit.get('id') == base_sha:
+            return commits[:index]
+    return None
+
 
+def incremental_fallback_reason(changes, new_commits) -> str:
+    '''
+    判断增量审查是否需要回退到完整审查
 
+    Args:
+        changes: 过滤后的增量变更，获取失败时为 None
+        new_commits: commits_since 的结果
 
+    Returns:
+        回退原因，可以增量审查时返回空字符串
+    '''
+    if changes is None:
+        return '无法获取增量变更'
+    if new_commits is None:
+        return '上次审查的提交已不在 MR 中（可能经过 rebase 或强制推送）'
+    # 合并目标分支产生的提交会把目标分支的改动带入增量 diff
+    if any(len(commit.get('parent_ids') or []) > 1 for commit in new_commits):
+        return '新增提交中包含合并提交'
+    max_lines = int(os.environ.get('MR_INCREMENTAL_REVIEW_MAX_LINES', 500))
+    lines = sum(item['additions'] + item['deletions'] for item in changes)
+    if max_lines and lines > max_lines:
+        return f'增量变更 {lines} 行，超过 MR_INCREMENTAL_REVIEW_MAX_LINES={max_lines}'
+    return ''
+
+
+@tracked_job('push')
 def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gitlab_url_slug: str):
     push_review_enabled = os.environ.get('PUSH_REVIEW_ENABLED', '0') == '1'
     try:
         handler = PushHandler(webhook_data, gitlab_token, gitlab_url)
         logger.info('Push Hook event received')
-        commits = handler.get_push_commits()
+        with job_stage('fetch_commits'):
+            commits = handler.get_push_commits()
         if not commits:
             logger.error('Failed to get commits')
             return
@@ -29,22 +136,27 @@ def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gi
         deletions = 0
         if push_review_enabled:
             # 获取PUSH的changes
-            changes = handler.get_push_changes()
-            logger.info('changes: %s', changes)
+            with job_stage('fetch_changes'):
+                changes = handler.get_push_changes()
+            logger.info('changes: %s', summarize_changes(changes))
             changes = filter_changes(changes)
             if not changes:
                 logger.info('未检测到PUSH代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             review_result = "关注的文件没有修改"
 
             if len(changes) > 0:
-                commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
-                review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
-                score = CodeReviewer.parse_review_score(review_text=review_result)
+                review_chunks = render_review_changes(changes)
+                if review_chunks:
+                    commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
+                    with job_stage('llm_review'):
+                        review_result = CodeReviewer().review_chunks(review_chunks, commits_text)
+                    score = CodeReviewer.parse_review_score(review_text=review_result)
                 for item in changes:
                     additions += item['additions']
                     deletions += item['deletions']
             # 将review结果提交到Gitlab的 notes
-            handler.add_push_notes(f'Auto Review Result: \n{review_result}')
+            with job_stage('post_note'):
+                handler.add_push_notes(f'Auto Review Result: \n{review_result}')
 
         event_manager['push_reviewed'].send(PushReviewEntity(
             project_name=webhook_data['project']['name'],
@@ -60,12 +172,19 @@ def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gi
             deletions=deletions,
         ))
 
+    except RetryLater as e:
+        # 交给队列驱动作为延迟任务重新入队
+        set_job_status(JOB_DEFERRED, str(e))
+        logger.info(f'Push review deferred: {e}')
+        raise
     except Exception as e:
+        set_job_status(JOB_FAILED, str(e))
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
         logger.error('出现未知错误: %s', error_message)
 
 
+@tracked_job('merge_request')
 def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gitlab_url_slug: str):
     '''
     处理Merge Request Hook事件
@@ -76,10 +195,13 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
     :return:
     '''
     merge_review_only_protected_branches = os.environ.get('MERGE_REVIEW_ONLY_PROTECTED_BRANCHES_ENABLED', '0') == '1'
+    incremental_review_enabled = os.environ.get('MR_INCREMENTAL_REVIEW_ENABLED', '0') == '1'
     try:
         # 解析Webhook数据
         handler = MergeRequestHandler(webhook_data, gitlab_token, gitlab_url)
         logger.info('Merge Request Hook event received')
+        # 同一MR已有更新的事件（新的提交、关闭或合并）时，直接跳过
+        ensure_current(webhook_data, gitlab_url_slug, 'start')
 
         # 新增：判断是否为draft（草稿）MR
         object_attributes = webhook_data.get('object_attributes', {})
@@ -90,31 +212,58 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
             logger.info("MR为draft，仅发送通知，不触发AI review。")
             return
 
-        # 如果开启了仅review projected branches的，判断当前目标分支是否为projected branches
-        if merge_review_only_protected_branches and not handler.target_branch_protected():
-            logger.info("Merge Request target branch not match protected branches, ignored.")
-            return
-
-        if handler.action not in ['open', 'update']:
+        if handler.action not in GITLAB_REVIEW_ACTIONS:
             logger.info(f"Merge Request Hook event, action={handler.action}, ignored.")
             return
 
         # 检查last_commit_id是否已经存在，如果存在则跳过处理
         last_commit_id = object_attributes.get('last_commit', {}).get('id', '')
+        project_name = webhook_data['project']['name']
+        source_branch = object_attributes.get('source_branch', '')
+        target_branch = object_attributes.get('target_branch', '')
         if last_commit_id:
-            project_name = webhook_data['project']['name']
-            source_branch = object_attributes.get('source_branch', '')
-            target_branch = object_attributes.get('target_branch', '')
-            
             if ReviewService.check_mr_last_commit_id_exists(project_name, source_branch, target_branch, last_commit_id):
                 logger.info(f"Merge Request with last_commit_id {last_commit_id} already exists, skipping review for {project_name}.")
                 return
 
+        # 增量审查：MR更新时只审查上次审查的提交之后的变更，并带上上次的审查结论
+        previous_review = None
+        if incremental_review_enabled and handler.action == 'update' and last_commit_id:
+            previous_review = ReviewService.get_last_mr_review(project_name, source_branch, target_branch)
+        get_changes = handler.get_merge_request_changes
+        if previous_review:
+            base_sha = previous_review['last_commit_id']
+            get_changes = lambda: handler.get_merge_request_compare_changes(base_sha, last_commit_id)
+
         # 仅仅在MR创建或更新时进行Code Review
-        # 获取Merge Request的changes
-        changes = handler.get_merge_request_changes()
-        logger.info('changes: %s', changes)
-        changes = filter_changes(changes)
+        # 并发获取Merge Request的changes、commits，开启了仅review projected branches时同时判断目标分支
+        fetched = fetch_review_inputs(handler, get_changes, handler.get_merge_request_commits,
+                                      merge_review_only_protected_branches)
+        if not fetched['protected']:
+            logger.info("Merge Request target branch not match protected branches, ignored.")
+            return
+
+        changes = fetched['changes']
+        commits = fetched['commits']
+        review_commits = commits
+        if previous_review:
+            review_commits = commits_since(commits, previous_review['last_commit_id'])
+            if changes is not None:
+                logger.info('incremental changes: %s', summarize_changes(changes))
+                changes = filter_changes(changes)
+            reason = incremental_fallback_reason(changes, review_commits)
+            if reason:
+                logger.info(f"{reason}，回退到完整审查: {project_name}!{handler.merge_request_iid}")
+                previous_review = None
+                review_commits = commits
+                with job_stage('fetch_changes'):
+                    changes = handler.get_merge_request_changes()
+            else:
+                logger.info(f"增量审查 {previous_review['last_commit_id'][:8]}..{last_commit_id[:8]}: "
+                            f"{len(review_commits)} 个新提交, {len(changes)} 个文件")
+        if not previous_review:
+            logger.info('changes: %s', summarize_changes(changes))
+            changes = filter_changes(changes)
         if not changes:
             logger.info('未检测到有关代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             return
@@ -125,18 +274,28 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
             additions += item.get('additions', 0)
             deletions += item.get('deletions', 0)
 
-        # 获取Merge Request的commits
-        commits = handler.get_merge_request_commits()
         if not commits:
             logger.error('Failed to get commits')
             return
 
+        review_chunks = render_review_changes(changes)
+        if not review_chunks:
+            logger.info('变更均为生成文件、依赖目录、纯重命名或纯空白修改，跳过审查。')
+            return
+
         # review 代码
-        commits_text = ';'.join(commit['title'] for commit in commits)
-        review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+        ensure_current(webhook_data, gitlab_url_slug, 'before_review')
+        commits_text = ';'.join(commit['title'] for commit in review_commits)
+        with job_stage('llm_review'):
+            review_result = CodeReviewer().review_chunks(review_chunks, commits_text, previous_review)
 
         # 将review结果提交到Gitlab的 notes
-        handler.add_merge_request_notes(f'Auto Review Result: \n{review_result}')
+        ensure_current(webhook_data, gitlab_url_slug, 'before_note')
+        title = 'Auto Review Result'
+        if previous_review:
+            title += f" (增量审查 {previous_review['last_commit_id'][:8]}..{last_commit_id[:8]})"
+        with job_stage('post_note'):
+            handler.add_merge_request_notes(f'{title}: \n{review_result}')
 
         # dispatch merge_request_reviewed event
         event_manager['merge_request_reviewed'].send(
@@ -158,17 +317,28 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
             )
         )
 
+    except RetryLater as e:
+        # 交给队列驱动作为延迟任务重新入队
+        set_job_status(JOB_DEFERRED, str(e))
+        logger.info(f'Merge Request review deferred: {e}')
+        raise
+    except JobSuperseded as e:
+        set_job_status(JOB_CANCELLED, str(e))
+        logger.info(f'Merge Request review cancelled: {e}')
     except Exception as e:
+        set_job_status(JOB_FAILED, str(e))
         error_message = f'AI Code Review 服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
         logger.error('出现未知错误: %s', error_message)
 
+@tracked_job('github_push')
 def handle_github_push_event(webhook_data: dict, github_token: str, github_url: str, github_url_slug: str):
     push_review_enabled = os.environ.get('PUSH_REVIEW_ENABLED', '0') == '1'
     try:
         handler = GithubPushHandler(webhook_data, github_token, github_url)
         logger.info('GitHub Push event received')
-        commits = handler.get_push_commits()
+        with job_stage('fetch_commits'):
+            commits = handler.get_push_commits()
         if not commits:
             logger.error('Failed to get commits')
             return
@@ -179,22 +349,27 @@ def handle_github_push_event(webhook_data: dict, github_token: str, github_url:
         deletions = 0
         if push_review_enabled:
             # 获取PUSH的changes
-            changes = handler.get_push_changes()
-            logger.info('changes: %s', changes)
+            with job_stage('fetch_changes'):
+                changes = handler.get_push_changes()
+            logger.info('changes: %s', summarize_changes(changes))
             changes = filter_github_changes(changes)
             if not changes:
                 logger.info('未检测到PUSH代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             review_result = "关注的文件没有修改"
 
             if len(changes) > 0:
-                commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
-                review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
-                score = CodeReviewer.parse_review_score(review_text=review_result)
+                review_chunks = render_review_changes(changes)
+                if review_chunks:
+                    commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
+                    with job_stage('llm_review'):
+                        review_result = CodeReviewer().review_chunks(review_chunks, commits_text)
+                    score = CodeReviewer.parse_review_score(review_text=review_result)
                 for item in changes:
                     additions += item.get('additions', 0)
                     deletions += item.get('deletions', 0)
             # 将review结果提交到GitHub的 notes
-            handler.add_push_notes(f'Auto Review Result: \n{review_result}')
+            with job_stage('post_note'):
+                handler.add_push_notes(f'Auto Review Result: \n{review_result}')
 
         event_manager['push_reviewed'].send(PushReviewEntity(
             project_name=webhook_data['repository']['name'],
@@ -210,12 +385,19 @@ def handle_github_push_event(webhook_data: dict, github_token: str, github_url:
             deletions=deletions,
         ))
 
+    except RetryLater as e:
+        # 交给队列驱动作为延迟任务重新入队
+        set_job_status(JOB_DEFERRED, str(e))
+        logger.info(f'GitHub Push review deferred: {e}')
+        raise
     except Exception as e:
+        set_job_status(JOB_FAILED, str(e))
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
         logger.error('出现未知错误: %s', error_message)
 
 
+@tracked_job('github_pull_request')
 def handle_github_pull_request_event(webhook_data: dict, github_token: str, github_url: str, github_url_slug: str):
     '''
     处理GitHub Pull Request 事件
@@ -230,12 +412,10 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
         # 解析Webhook数据
         handler = GithubPullRequestHandler(webhook_data, github_token, github_url)
         logger.info('GitHub Pull Request event received')
-        # 如果开启了仅review projected branches的，判断当前目标分支是否为projected branches
-        if merge_review_only_protected_branches and not handler.target_branch_protected():
-            logger.info("Merge Request target branch not match protected branches, ignored.")
-            return
+        # 同一PR已有更新的事件（新的提交、关闭或合并）时，直接跳过
+        ensure_current(webhook_data, github_url_slug, 'start')
 
-        if handler.action not in ['opened', 'synchronize']:
+        if handler.action not in GITHUB_REVIEW_ACTIONS:
             logger.info(f"Pull Request Hook event, action={handler.action}, ignored.")
             return
 
@@ -251,10 +431,14 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
                 return
 
         # 仅仅在PR创建或更新时进行Code Review
-        # 获取Pull Request的changes
-        changes = handler.get_pull_request_changes()
-        logger.info('changes: %s', changes)
-        changes = filter_github_changes(changes)
+        # 并发获取Pull Request的changes、commits，开启了仅review projected branches时同时判断目标分支
+        fetched = fetch_review_inputs(handler, handler.get_pull_request_changes, handler.get_pull_request_commits,
+                                      merge_review_only_protected_branches)
+        if not fetched['protected']:
+            logger.info("Merge Request target branch not match protected branches, ignored.")
+            return
+
+        changes = filter_github_changes(fetched['changes'])
         if not changes:
             logger.info('未检测到有关代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             return
@@ -265,18 +449,26 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
             additions += item.get('additions', 0)
             deletions += item.get('deletions', 0)
 
-        # 获取Pull Request的commits
-        commits = handler.get_pull_request_commits()
+        commits = fetched['commits']
         if not commits:
             logger.error('Failed to get commits')
             return
 
+        review_chunks = render_review_changes(changes)
+        if not review_chunks:
+            logger.info('变更均为生成文件、依赖目录、纯重命名或纯空白修改，跳过审查。')
+            return
+
         # review 代码
+        ensure_current(webhook_data, github_url_slug, 'before_review')
         commits_text = ';'.join(commit['title'] for commit in commits)
-        review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+        with job_stage('llm_review'):
+            review_result = CodeReviewer().review_chunks(review_chunks, commits_text)
 
         # 将review结果提交到GitHub的 notes
-        handler.add_pull_request_notes(f'Auto Review Result: \n{review_result}')
+        ensure_current(webhook_data, github_url_slug, 'before_note')
+        with job_stage('post_note'):
+            handler.add_pull_request_notes(f'Auto Review Result: \n{review_result}')
 
         # dispatch pull_request_reviewed event
         event_manager['merge_request_reviewed'].send(
@@ -297,7 +489,16 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
                 last_commit_id=github_last_commit_id,
             ))
 
+    except RetryLater as e:
+        # 交给队列驱动作为延迟任务重新入队
+        set_job_status(JOB_DEFERRED, str(e))
+        logger.info(f'Pull Request review deferred: {e}')
+        raise
+    except JobSuperseded as e:
+        set_job_status(JOB_CANCELLED, str(e))
+        logger.info(f'Pull Request review cancelled: {e}')
     except Exception as e:
+        set_job_status(JOB_FAILED, str(e))
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
         logger.error('出现未知错误: %s', error_message)
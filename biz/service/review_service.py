@@ -228,6 +228,26 @@ class ReviewService:
             print(f"Error checking last_commit_id: {e}")
             return False
 
+    @staticmethod
+    def get_last_mr_review(project_name: str, source_branch: str, target_branch: str) -> Optional[Dict]:
+        """获取指定Merge Request最近一次记录了last_commit_id的审核日志，供增量审查使用"""
+        try:
+            with sqlite3.connect(ReviewService.DB_FILE) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT last_commit_id, review_result, score, updated_at FROM mr_review_log
+                    WHERE project_name = ? AND source_branch = ? AND target_branch = ? AND last_commit_id != ''
+                    ORDER BY updated_at DESC, id DESC LIMIT 1
+                ''', (project_name, source_branch, target_branch))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                return {'last_commit_id': row[0], 'review_result': row[1] or '', 'score': row[2],
+                        'updated_at': row[3]}
+        except sqlite3.DatabaseError as e:
+            print(f"Error retrieving last mr review: {e}")
+            return None
+
     @staticmethod
     def insert_push_review_log(entity: PushReviewEntity):
         """插入推送审核日志"""
@@ -1,51 +1,70 @@
 import abc
 import os
 import re
+from functools import lru_cache, partial
 from typing import Dict, Any, List
 
 import yaml
 from jinja2 import Template
 
 from biz.llm.factory import Factory
-from biz.utils.log import logger
+from biz.utils.log import logger, summarize_messages, truncated
+from biz.utils.parallel import run_parallel
 from biz.utils.token_util import count_tokens, truncate_text_by_tokens
 
+SCORE_PATTERN = re.compile(r"总分[:：]\s*(\d+)分?")
+
+
+@lru_cache(maxsize=None)
+def load_prompt_templates(prompt_key: str, style: str = "professional") -> Dict[str, Any]:
+    """加载并渲染提示词模板，同一进程内按 (prompt_key, style) 缓存"""
+    prompt_templates_file = "conf/prompt_templates.yml"
+    try:
+        # 在打开 YAML 文件时显式指定编码为 UTF-8，避免使用系统默认的 GBK 编码。
+        with open(prompt_templates_file, "r", encoding="utf-8") as file:
+            prompts = yaml.safe_load(file).get(prompt_key, {})
+
+            # 使用Jinja2渲染模板
+            def render_template(template_str: str) -> str:
+                return Template(template_str).render(style=style)
+
+            system_prompt = render_template(prompts["system_prompt"])
+            user_prompt = render_template(prompts["user_prompt"])
+
+            templates = {
+                "system_message": {"role": "system", "content": system_prompt},
+                "user_message": {"role": "user", "content": user_prompt},
+            }
+            # 可选：增量审查时附加的上次审查上下文
+            if prompts.get("incremental_prompt"):
+                templates["incremental_message"] = {"role": "user",
+                                                    "content": render_template(prompts["incremental_prompt"])}
+            # 可选：map-reduce 审查时合并各部分审查结果
+            if prompts.get("reduce_prompt"):
+                templates["reduce_message"] = {"role": "user", "content": render_template(prompts["reduce_prompt"])}
+            return templates
+    except (FileNotFoundError, KeyError, yaml.YAMLError) as e:
+        logger.error(f"加载提示词配置失败: {e}")
+        raise Exception(f"提示词配置加载失败: {e}")
+
 
 class BaseReviewer(abc.ABC):
     """代码审查基类"""
 
     def __init__(self, prompt_key: str):
-        self.client = Factory().getClient()
+        self.client = Factory.getSharedClient()
         self.prompts = self._load_prompts(prompt_key, os.getenv("REVIEW_STYLE", "professional"))
 
     def _load_prompts(self, prompt_key: str, style="professional") -> Dict[str, Any]:
         """加载提示词配置"""
-        prompt_templates_file = "conf/prompt_templates.yml"
-        try:
-            # 在打开 YAML 文件时显式指定编码为 UTF-8，避免使用系统默认的 GBK 编码。
-            with open(prompt_templates_file, "r", encoding="utf-8") as file:
-                prompts = yaml.safe_load(file).get(prompt_key, {})
-
-                # 使用Jinja2渲染模板
-                def render_template(template_str: str) -> str:
-                    return Template(template_str).render(style=style)
-
-                system_prompt = render_template(prompts["system_prompt"])
-                user_prompt = render_template(prompts["user_prompt"])
-
-                return {
-                    "system_message": {"role": "system", "content": system_prompt},
-                    "user_message": {"role": "user", "content": user_prompt},
-                }
-        except (FileNotFoundError, KeyError, yaml.YAMLError) as e:
-            logger.error(f"加载提示词配置失败: {e}")
-            raise Exception(f"提示词配置加载失败: {e}")
+        prompts = load_prompt_templates(prompt_key, style)
+        return {key: dict(message) for key, message in prompts.items()}
 
     def call_llm(self, messages: List[Dict[str, Any]]) -> str:
         """调用 LLM 进行代码审核"""
-        logger.info(f"向 AI 发送代码 Review 请求, messages: {messages}")
+        logger.info("向 AI 发送代码 Review 请求, messages: %s", summarize_messages(messages))
         review_result = self.client.completions(messages=messages)
-        logger.info(f"收到 AI 返回结果: {review_result}")
+        logger.info("收到 AI 返回结果: %s", truncated(review_result))
         return review_result
 
     @abc.abstractmethod
@@ -60,19 +79,20 @@ class CodeReviewer(BaseReviewer):
     def __init__(self):
         super().__init__("code_review_prompt")
 
-    def review_and_strip_code(self, changes_text: str, commits_text: str = "") -> str:
+    def review_and_strip_code(self, changes_text: str, commits_text: str = "", previous_review: dict = None) -> str:
         """
         Review判断changes_text超出取前REVIEW_MAX_TOKENS个token，超出则截断changes_text，
         调用review_code方法，返回review_result，如果review_result是markdown格式，则去掉头尾的```
         :param changes_text:
         :param commits_text:
+        :param previous_review: 增量审查时上次的审查记录（last_commit_id、review_result），作为上下文一并发送
         :return:
         """
-        # 如果超长，取前REVIEW_MAX_TOKENS个token
+        # 如果超长，取前REVIEW_MAX_TOKENS个token（worker 已按文件分配预算，这里作为兜底）
         review_max_tokens = int(os.getenv("REVIEW_MAX_TOKENS", 10000))
         # 如果changes为空,打印日志
         if not changes_text:
-            logger.info("代码为空, diffs_text = %", str(changes_text))
+            logger.info("代码为空, diffs_text = %r", changes_text)
             return "代码为空"
 
         # 计算tokens数量，如果超过REVIEW_MAX_TOKENS，截断changes_text
@@ -80,20 +100,77 @@ class CodeReviewer(BaseReviewer):
         if tokens_count > review_max_tokens:
             changes_text = truncate_text_by_tokens(changes_text, review_max_tokens)
 
-        review_result = self.review_code(changes_text, commits_text).strip()
+        return self.strip_markdown(self.review_code(changes_text, commits_text, previous_review))
+
+    def review_chunks(self, chunks: List[str], commits_text: str = "", previous_review: dict = None) -> str:
+        """
+        map-reduce 审查：超大变更按文件拆分后的各部分并发审查（map），再由一次 LLM 调用合并为一份报告（reduce）
+        只有一部分时等同于 review_and_strip_code
+        :param chunks: biz.utils.diff_packer.chunk_for_review 切分后的 diff 文本
+        :param commits_text:
+        :param previous_review:
+        :return: 包含一个“总分:XX分”的审查报告
+        """
+        if len(chunks) <= 1:
+            return self.review_and_strip_code(chunks[0] if chunks else "", commits_text, previous_review)
+
+        # 并发数默认与块数相同，总耗时取决于最慢的一块；LLM 服务限流时通过 REVIEW_MAP_CONCURRENCY 调小
+        concurrency = int(os.getenv("REVIEW_MAP_CONCURRENCY", 0)) or None
+        timeout = float(os.getenv("REVIEW_MAP_TIMEOUT", 600))
+        calls = {f"chunk-{index}": partial(self.review_and_strip_code, chunk, commits_text, previous_review)
+                 for index, chunk in enumerate(chunks, 1)}
+        reviews = list(run_parallel(calls, timeout=timeout, max_workers=concurrency).values())
+
+        # 各部分评分按 diff 长度加权平均（没有解析出总分的部分不参与），作为合并时的参考分数与兜底总分
+        scored = [(self.parse_review_score(review), len(chunk)) for review, chunk in zip(reviews, chunks)
+                  if SCORE_PATTERN.search(review)]
+        reference_score = round(sum(score * weight for score, weight in scored)
+                                / sum(weight for _, weight in scored)) if scored else 0
+        chunk_reviews = "\n\n".join(f"#### 第 {index}/{len(chunks)} 部分\n{review}"
+                                     for index, review in enumerate(reviews, 1))
+        logger.info("Map-reduce review: %s chunks, scores %s, reference score %s", len(chunks),
+                    [score for score, _ in scored], reference_score)
+
+        review_result = ""
+        if "reduce_message" in self.prompts:
+            content = self.prompts["reduce_message"]["content"].format(
+                chunk_count=len(chunks), reference_score=reference_score, chunk_reviews=chunk_reviews,
+                commits_text=commits_text)
+            try:
+                review_result = self.strip_markdown(
+                    self.call_llm([self.prompts["system_message"], {"role": "user", "content": content}]))
+            except Exception as e:
+                logger.error(f"合并审查结果失败，直接拼接各部分审查结果: {e}")
+        if review_result and SCORE_PATTERN.search(review_result):
+            return review_result
+        # 合并失败时拼接各部分结果，各部分的总分改为“部分得分”，保证报告中只有一个可解析的总分
+        review_result = review_result or SCORE_PATTERN.sub(r"部分得分:\1分", chunk_reviews)
+        return f"{review_result}\n\n总分:{reference_score}分"
+
+    @staticmethod
+    def strip_markdown(review_result: str) -> str:
+        """去掉 LLM 返回结果头尾的 ```markdown 代码块标记"""
+        review_result = review_result.strip()
         if review_result.startswith("```markdown") and review_result.endswith("```"):
             return review_result[11:-3].strip()
         return review_result
 
-    def review_code(self, diffs_text: str, commits_text: str = "") -> str:
+    def review_code(self, diffs_text: str, commits_text: str = "", previous_review: dict = None) -> str:
         """Review 代码并返回结果"""
+        content = self.prompts["user_message"]["content"].format(diffs_text=diffs_text, commits_text=commits_text)
+        if previous_review and "incremental_message" in self.prompts:
+            # 上次的审查结论按 MR_INCREMENTAL_REVIEW_CONTEXT_TOKENS 截断，避免长期 MR 的上下文不断膨胀
+            context_tokens = int(os.getenv("MR_INCREMENTAL_REVIEW_CONTEXT_TOKENS", 2000))
+            context = self.prompts["incremental_message"]["content"].format(
+                previous_commit_id=previous_review.get("last_commit_id", "")[:8],
+                previous_review=truncate_text_by_tokens(previous_review.get("review_result", ""), context_tokens),
+            )
+            content = f"{context}\n\n{content}"
         messages = [
             self.prompts["system_message"],
             {
                 "role": "user",
-                "content": self.prompts["user_message"]["content"].format(
-                    diffs_text=diffs_text, commits_text=commits_text
-                ),
+                "content": content,
             },
         ]
         return self.call_llm(messages)
@@ -103,6 +180,6 @@ class CodeReviewer(BaseReviewer):
         """解析 AI 返回的 Review 结果，返回评分"""
         if not review_text:
             return 0
-        match = re.search(r"总分[:：]\s*(\d+)分?", review_text)
+        match = SCORE_PATTERN.search(review_text)
         return int(match.group(1)) if match else 0
 
@@ -0,0 +1,168 @@
+"""
+diff 精简
+
+在 filter_changes 之后、发送给 LLM 之前去掉不影响审查结论的内容：
+- 匹配生成文件、依赖锁文件、第三方依赖目录等规则（gitignore 语法）的文件
+- 没有文本变更的文件（纯重命名、仅权限变化、二进制文件）
+- 只修改行首尾空白（缩进、行尾空格）或空行的 hunk；缩进有语义的语言（Python、YAML 等）只忽略行尾空白与空行
+- 距离变更行超过 DIFF_CONTEXT_LINES 行的上下文；中间的长段上下文会把 hunk 拆分为两个
+
+作用于 biz.utils.diff_model 的 FileChange 列表，并统计精简前后的 token 数。
+"""
+import os
+import posixpath
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from pathspec import PathSpec
+
+from biz.utils import diff_model
+from biz.utils.diff_model import FileChange, Hunk, LineRange
+from biz.utils.log import logger
+from biz.utils.token_util import count_tokens
+
+# 默认排除的文件（gitignore 语法），可通过 DIFF_EXCLUDE_PATTERNS 追加，或用 !pattern 重新包含
+DEFAULT_EXCLUDE_PATTERNS = (
+    # 依赖锁文件
+    'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'composer.lock', 'poetry.lock', 'Pipfile.lock',
+    'Gemfile.lock', 'Cargo.lock', 'go.sum',
+    # 第三方依赖目录
+    'vendor/', 'node_modules/', 'third_party/', 'bower_components/',
+    # 构建产物、压缩文件与生成代码
+    'dist/', 'build/', '*.min.js', '*.min.css', '*.map', '*_pb2.py', '*_pb2_grpc.py', '*.pb.go',
+    '*.generated.*', '*.g.dart', 'generated/',
+)
+
+# 缩进决定语义的文件，缩进变化不视为纯空白修改
+INDENT_SENSITIVE_EXTENSIONS = ('.py', '.pyi', '.pyx', '.yml', '.yaml', '.coffee', '.haml', '.pug', '.sass', '.styl',
+                               '.nim', '.fs', '.fsx')
+INDENT_SENSITIVE_NAMES = ('Makefile', 'GNUmakefile')
+
+
+def minify_enabled() -> bool:
+    return os.getenv('DIFF_MINIFY_ENABLED', '1') == '1'
+
+
+def context_lines() -> int:
+    """变更行前后保留的上下文行数，负数表示不裁剪"""
+    return int(os.getenv('DIFF_CONTEXT_LINES', 3))
+
+
+@lru_cache(maxsize=8)
+def exclude_spec(extra_patterns: str) -> PathSpec:
+    """默认规则与 DIFF_EXCLUDE_PATTERNS（逗号分隔）合并编译，相同配置只编译一次"""
+    patterns = [*DEFAULT_EXCLUDE_PATTERNS, *(p.strip() for p in extra_patterns.split(',') if p.strip())]
+    return PathSpec.from_lines('gitwildmatch', patterns)
+
+
+def is_excluded(path: str) -> bool:
+    return exclude_spec(os.getenv('DIFF_EXCLUDE_PATTERNS', '')).match_file(path)
+
+
+def is_indent_sensitive(path: str) -> bool:
+    name = posixpath.basename(path)
+    return name in INDENT_SENSITIVE_NAMES or name.endswith(INDENT_SENSITIVE_EXTENSIONS)
+
+
+def is_whitespace_only(hunk: Hunk, keep_indent: bool = False) -> bool:
+    """
+    删除行与新增行去掉行首尾空白后完全相同（包括只增删空行）；行内空白（如字符串字面量中的空格）的修改不算
+
+    Args:
+        keep_indent: 缩进有语义时只去掉行尾空白，缩进变化不算纯空白修改
+    """
+    removed, added = [], []
+    for line in hunk.lines:
+        if line[:1] in ('-', '+'):
+            normalized = line[1:].rstrip() if keep_indent else line[1:].strip()
+            if normalized:
+                (removed if line[0] == '-' else added).append(normalized)
+    return removed == added
+
+
+def trim_context(hunk: Hunk, keep: int) -> List[Hunk]:
+    """
+    只保留变更行前后 keep 行上下文，重新计算行范围；两段变更之间的上下文超过 2 * keep 行时拆分为两个 hunk
+    """
+    changed = [index for index, line in enumerate(hunk.lines) if line[:1] in ('-', '+')]
+    if not changed:
+        return []
+    kept = set()
+    for index in changed:
+        kept.update(range(max(index - keep, 0), min(index + keep, len(hunk.lines) - 1) + 1))
+    if len(kept) == len(hunk.lines):
+        return [hunk]
+
+    hunks = []
+    old_line, new_line = hunk.old.start, hunk.new.start
+    group: Optional[Tuple[int, int, List[str]]] = None
+    for index, line in enumerate(hunk.lines):
+        if index in kept:
+            if group is None:
+                group = (old_line, new_line, [])
+            group[2].append(line)
+        elif group is not None:
+            hunks.append(_build_hunk(hunk.section, *group))
+            group = None
+        if line[:1] != '+':
+            old_line += 1
+        if line[:1] != '-':
+            new_line += 1
+    if group is not None:
+        hunks.append(_build_hunk(hunk.section, *group))
+    return hunks
+
+
+def _build_hunk(section: str, old_start: int, new_start: int, lines: List[str]) -> Hunk:
+    old_count = sum(1 for line in lines if line[:1] != '+')
+    new_count = sum(1 for line in lines if line[:1] != '-')
+    # 统一 diff 中行数为 0 的范围以前一行作为起始行
+    return Hunk(LineRange(old_start if old_count else old_start - 1, old_count),
+                LineRange(new_start if new_count else new_start - 1, new_count), section, lines)
+
+
+def minify(files: List[FileChange]) -> Tuple[List[FileChange], Dict]:
+    """
+    精简 diff
+
+    Returns:
+        (精简后的文件列表, 统计信息)，统计信息包含被排除的文件、被去掉的纯空白 hunk 数与裁剪的上下文行数
+    """
+    keep = context_lines()
+    stats = {'excluded_files': [], 'whitespace_hunks': 0, 'context_lines_trimmed': 0}
+    result = []
+    for file in files:
+        if is_excluded(file.path):
+            stats['excluded_files'].append(file.path)
+            continue
+        keep_indent = is_indent_sensitive(file.path)
+        hunks = []
+        for hunk in file.hunks:
+            if is_whitespace_only(hunk, keep_indent):
+                stats['whitespace_hunks'] += 1
+                continue
+            trimmed = trim_context(hunk, keep) if keep >= 0 else [hunk]
+            stats['context_lines_trimmed'] += len(hunk.lines) - sum(len(item.lines) for item in trimmed)
+            hunks.extend(trimmed)
+        # 没有需要审查的文本变更（纯重命名、二进制或只有空白修改）
+        if not hunks:
+            stats['excluded_files'].append(file.path)
+            continue
+        result.append(FileChange(file.path, hunks, file.additions, file.deletions, file.old_path, file.status))
+    return result, stats
+
+
+def minify_for_review(files: List[FileChange]) -> List[FileChange]:
+    """开启 DIFF_MINIFY_ENABLED 时精简 diff，并记录本次审查节省的 token 数"""
+    if not minify_enabled() or not files:
+        return files
+    minified, stats = minify(files)
+    tokens_before = count_tokens(diff_model.render(files))
+    tokens_after = count_tokens(diff_model.render(minified))
+    logger.info(
+        "Diff minified: %s -> %s files, tokens %s -> %s (saved %s, %.1f%%), whitespace-only hunks %s, "
+        "context lines trimmed %s, excluded %s",
+        len(files), len(minified), tokens_before, tokens_after, tokens_before - tokens_after,
+        (tokens_before - tokens_after) * 100 / max(tokens_before, 1), stats['whitespace_hunks'],
+        stats['context_lines_trimmed'], stats['excluded_files'][:20])
+    return minified
@@ -0,0 +1,118 @@
+"""
+diff 模型
+
+把 GitLab / GitHub 返回并经 filter_changes 过滤后的变更（dict 列表）解析为 FileChange / Hunk / LineRange，
+再渲染为紧凑的统一 diff 文本发送给 LLM。
+
+此前直接把 dict 列表的 repr（str(changes)）放进提示词：每个换行都被转义为 \\n，引号、键名与转义反斜杠
+都会消耗 token。渲染后的文本只保留文件头、hunk 头与变更行，省略 "\\ No newline at end of file" 等标记。
+各类使用 __slots__，大 MR 中数千个 hunk 不会为每个对象分配 __dict__。
+"""
+import re
+from typing import Iterable, List, Optional
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$', re.MULTILINE)
+NO_NEWLINE_MARKER = '\\ No newline at end of file'
+
+
+class LineRange:
+    """hunk 在旧文件或新文件中的行范围"""
+    __slots__ = ('start', 'count')
+
+    def __init__(self, start: int, count: int):
+        self.start = start
+        self.count = count
+
+    def __str__(self):
+        return str(self.start) if self.count == 1 else f"{self.start},{self.count}"
+
+    def __repr__(self):
+        return f"LineRange({self.start}, {self.count})"
+
+
+class Hunk:
+    """一个 hunk：新旧行范围、@@ 之后的函数上下文，以及上下文 / 新增 / 删除行"""
+    __slots__ = ('old', 'new', 'section', 'lines')
+
+    def __init__(self, old: LineRange, new: LineRange, section: str = '', lines: List[str] = None):
+        self.old = old
+        self.new = new
+        self.section = section
+        self.lines = lines if lines is not None else []
+
+    @property
+    def header(self) -> str:
+        header = f"@@ -{self.old} +{self.new} @@"
+        return f"{header} {self.section}" if self.section else header
+
+    def render(self) -> str:
+        return '\n'.join([self.header, *self.lines])
+
+
+class FileChange:
+    """一个文件的变更"""
+    __slots__ = ('path', 'old_path', 'status', 'hunks', 'additions', 'deletions')
+
+    def __init__(self, path: str, hunks: List[Hunk], additions: int = 0, deletions: int = 0,
+                 old_path: Optional[str] = None, status: str = 'modified'):
+        self.path = path
+        self.old_path = old_path
+        self.status = status
+        self.hunks = hunks
+        self.additions = additions
+        self.deletions = deletions
+
+    @classmethod
+    def from_dict(cls, change: dict) -> 'FileChange':
+        """从 filter_changes 的结果（或 GitLab changes 原始结构）构建"""
+        path = change.get('new_path') or change.get('old_path') or ''
+        old_path = change.get('old_path')
+        if change.get('new_file'):
+            status = 'added'
+        elif change.get('deleted_file'):
+            status = 'removed'
+        elif change.get('renamed_file') or (old_path and old_path != path):
+            status = 'renamed'
+        else:
+            status = change.get('status') or 'modified'
+        return cls(path, parse_hunks(change.get('diff', '')), change.get('additions', 0), change.get('deletions', 0),
+                   old_path=old_path if status == 'renamed' else None, status=status)
+
+    @property
+    def header(self) -> str:
+        header = f"### {self.path}"
+        if self.status == 'renamed' and self.old_path:
+            header += f" (renamed from {self.old_path})"
+        elif self.status in ('added', 'removed'):
+            header += f" ({self.status})"
+        return f"{header} +{self.additions} -{self.deletions}"
+
+    def render(self) -> str:
+        return '\n'.join([self.header, *(hunk.render() for hunk in self.hunks)])
+
+
+def parse_hunks(diff: str) -> List[Hunk]:
+    """解析统一 diff 文本中的 hunk，忽略第一个 @@ 之前的文件头"""
+    hunks = []
+    matches = list(HUNK_HEADER.finditer(diff or ''))
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(diff)
+        body = diff[match.end() + 1:end]
+        lines = [line for line in body.split('\n') if line != NO_NEWLINE_MARKER]
+        # 去掉 diff 末尾换行产生的空行
+        while lines and not lines[-1]:
+            lines.pop()
+        old_start, old_count, new_start, new_count, section = match.groups()
+        hunks.append(Hunk(LineRange(int(old_start), int(old_count) if old_count is not None else 1),
+                          LineRange(int(new_start), int(new_count) if new_count is not None else 1),
+                          section.strip(), lines))
+    return hunks
+
+
+def from_changes(changes: Iterable[dict]) -> List[FileChange]:
+    return [FileChange.from_dict(change) for change in changes]
+
+
+def render(files: Iterable[FileChange]) -> str:
+    """渲染为发送给 LLM 的紧凑 diff 文本，文件之间以空行分隔"""
+    return '\n\n'.join(file.render() for file in files)
@@ -0,0 +1,274 @@
+"""
+diff 的 token 预算分配
+
+diff 超过 REVIEW_MAX_TOKENS 时，不再把渲染后的文本从末尾截断（排在后面的文件整体丢失，甚至截断在行中间），
+而是按文件优先级分配预算：
+- 每个文件的 token 数在一次批量编码中算出（tiktoken 多线程编码）
+- 优先级 = 路径权重 × 变更行数：业务代码优先于测试代码，改动大的文件优先；DIFF_PATH_WEIGHTS 可配置路径权重
+- 放不下整个文件时按 hunk 放入变更最多的部分，其余 hunk 与放不下的文件列在文末，而不是悄悄丢弃
+
+开启 REVIEW_MAP_REDUCE_ENABLED 后，超过 REVIEW_MAP_REDUCE_THRESHOLD_TOKENS 的 diff 不再压缩进一次审查，
+而是按文件边界切分为多个不超过 REVIEW_CHUNK_MAX_TOKENS 的块，由 CodeReviewer.review_chunks 并发审查后合并。
+"""
+import os
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pathspec import PathSpec
+
+from biz.utils import diff_model
+from biz.utils.diff_model import FileChange, Hunk
+from biz.utils.log import logger
+from biz.utils.token_util import count_tokens_batch
+
+# 测试文件（gitignore 语法），默认权重 DIFF_TEST_WEIGHT
+TEST_PATTERNS = ('test/', 'tests/', '__tests__/', 'test_*', '*_test.*', '*Test.java', '*Tests.java', '*.spec.*',
+                 '*.test.*')
+# 渲染时文件之间的空行分隔
+SEPARATOR_TOKENS = 2
+# 为文末的未包含列表预留的每个文件 token 数
+LISTING_TOKENS = 20
+# 只放入部分 hunk 的文件，最多列出的省略 hunk 数
+MAX_LISTED_HUNKS = 5
+
+TEST_SPEC = PathSpec.from_lines('gitwildmatch', TEST_PATTERNS)
+
+
+@lru_cache(maxsize=8)
+def parse_path_weights(value: str) -> Tuple[Tuple[PathSpec, float], ...]:
+    """解析 "pattern=weight,pattern=weight"，按配置顺序匹配，第一条匹配的规则生效"""
+    weights = []
+    for item in value.split(','):
+        pattern, _, weight = item.strip().rpartition('=')
+        if pattern and weight:
+            weights.append((PathSpec.from_lines('gitwildmatch', [pattern.strip()]), float(weight)))
+    return tuple(weights)
+
+
+def path_weight(path: str) -> float:
+    for spec, weight in parse_path_weights(os.getenv('DIFF_PATH_WEIGHTS', '')):
+        if spec.match_file(path):
+            return weight
+    if TEST_SPEC.match_file(path):
+        return float(os.getenv('DIFF_TEST_WEIGHT', 0.5))
+    return 1.0
+
+
+def file_priority(file: FileChange) -> float:
+    return path_weight(file.path) * (file.additions + file.deletions + 1)
+
+
+def _changed_lines(hunk: Hunk) -> int:
+    return sum(1 for line in hunk.lines if line[:1] in ('-', '+'))
+
+
+def _pack_hunks(file: FileChange, space: int, count_batch: Callable[[List[str]], List[int]]):
+    """
+    在 space 个 token 内放入文件中变更行最多的 hunk（按原顺序输出）
+
+    Returns:
+        (部分文件, 使用的 token 数, 省略的 hunk)；一个 hunk 都放不下时部分文件为 None
+    """
+    counts = count_batch([file.header, *(hunk.render() for hunk in file.hunks)])
+    used = counts[0] + SEPARATOR_TOKENS
+    chosen = set()
+    for index in sorted(range(len(file.hunks)), key=lambda i: -_changed_lines(file.hunks[i])):
+        cost = counts[index + 1] + 1
+        if used + cost <= space:
+            chosen.add(index)
+            used += cost
+    if not chosen:
+        return None, 0, file.hunks
+    kept = [hunk for index, hunk in enumerate(file.hunks) if index in chosen]
+    omitted = [hunk for index, hunk in enumerate(file.hunks) if index not in chosen]
+    return (FileChange(file.path, kept, file.additions, file.deletions, file.old_path, file.status), used,
+            omitted)
+
+
+NOTES_HEADING = '### 超出 token 预算未包含的变更'
+
+Counter = Callable[[List[str]], List[int]]
+
+
+def _file_note(file: FileChange, tokens: int) -> str:
+    return f"- {file.path} (+{file.additions} -{file.deletions}, ~{tokens} tokens)"
+
+
+def _hunks_note(file: FileChange, omitted: List[Hunk]) -> str:
+    listed = ', '.join(hunk.header for hunk in omitted[:MAX_LISTED_HUNKS])
+    more = f" 等 {len(omitted)} 个" if len(omitted) > MAX_LISTED_HUNKS else ''
+    return f"- {file.path}: 省略 {len(omitted)}/{len(file.hunks)} 个 hunk（{listed}{more}）"
+
+
+def _reserved_tokens(files: List[FileChange], budget: int) -> int:
+    """为文末的未包含列表预留的 token 数"""
+    return min(LISTING_TOKENS * len(files), budget // 10)
+
+
+def _limit_notes(notes: List[str], space: int, count_batch: Counter) -> List[str]:
+    """
+    按顺序保留 space 个 token 内放得下的说明（含标题与分隔），其余合并为最后一行“另有 N 项未列出”；
+    连标题与汇总行都放不下时返回空列表，保证渲染结果不超出预算
+    """
+    if not notes:
+        return []
+    heading, *counts = count_batch([NOTES_HEADING, *notes])
+    used = heading + SEPARATOR_TOKENS
+    kept = []
+    for index, (note, tokens) in enumerate(zip(notes, counts)):
+        # 每行多一个换行；最后一条放得下时不需要汇总行，否则为汇总行留出空间
+        cost = tokens + 1
+        if not (index == len(notes) - 1 and used + cost <= space) and used + cost + LISTING_TOKENS > space:
+            break
+        kept.append(note)
+        used += cost
+    if len(kept) < len(notes):
+        if used + LISTING_TOKENS > space:
+            return []
+        kept.append(f"- 另有 {len(notes) - len(kept)} 项未列出")
+    return kept
+
+
+def pack(files: List[FileChange], budget: int, count_batch: Optional[Counter] = None,
+         tokens: Optional[List[int]] = None) -> Tuple[List[FileChange], List[str]]:
+    """
+    按 token 预算选择文件与 hunk
+
+    Args:
+        files: 待审查的文件
+        budget: token 预算
+        count_batch: 批量计算 token 数的函数，默认使用 cl100k_base 编码
+        tokens: 已计算好的每个文件渲染后的 token 数，为 None 时计算
+
+    Returns:
+        (放入预算的文件（保持原顺序，部分文件只包含部分 hunk）, 未包含内容的说明列表（不超出预留的 token 数）)
+    """
+    count_batch = count_batch or count_tokens_batch
+    tokens = tokens if tokens is not None else count_batch([file.render() for file in files])
+    if sum(tokens) + SEPARATOR_TOKENS * len(files) <= budget:
+        return files, []
+
+    reserved = _reserved_tokens(files, budget)
+    remaining = budget - reserved
+    included = {}
+    notes = {}
+    for index in sorted(range(len(files)), key=lambda i: (-file_priority(files[i]), tokens[i])):
+        file = files[index]
+        # 权重为 0 的路径只列出，不放入预算
+        if path_weight(file.path) <= 0:
+            notes[index] = _file_note(file, tokens[index])
+            continue
+        cost = tokens[index] + SEPARATOR_TOKENS
+        if cost <= remaining:
+            included[index] = file
+            remaining -= cost
+            continue
+        partial, used, omitted = _pack_hunks(file, remaining, count_batch)
+        if partial is None:
+            notes[index] = _file_note(file, tokens[index])
+            continue
+        included[index] = partial
+        remaining -= used
+        notes[index] = _hunks_note(file, omitted)
+    return ([included[i] for i in sorted(included)],
+            _limit_notes([notes[i] for i in sorted(notes)], remaining + reserved, count_batch))
+
+
+def split(files: List[FileChange], chunk_budget: int, max_chunks: int, count_batch: Optional[Counter] = None,
+          tokens: Optional[List[int]] = None) -> Tuple[List[List[FileChange]], List[str]]:
+    """
+    按文件边界把文件切分为多个不超过 chunk_budget 的块，最多 max_chunks 块
+
+    文件按优先级依次放入第一个放得下的块（首次适应），块内保持原顺序；单个文件超过 chunk_budget 时独占一块，
+    只放入变更最多的 hunk。所有块都放不下的文件与省略的 hunk 作为说明返回，说明放在最后一块文末，不超出该块的预算。
+
+    Returns:
+        (块列表, 未包含内容的说明列表)
+    """
+    count_batch = count_batch or count_tokens_batch
+    max_chunks = max(max_chunks, 1)
+    tokens = tokens if tokens is not None else count_batch([file.render() for file in files])
+    reserved = _reserved_tokens(files, chunk_budget)
+    chunks: List[Dict[int, FileChange]] = []
+    remaining: List[int] = []
+    notes = {}
+    for index in sorted(range(len(files)), key=lambda i: (-file_priority(files[i]), tokens[i])):
+        file = files[index]
+        if path_weight(file.path) <= 0:
+            notes[index] = _file_note(file, tokens[index])
+            continue
+        cost = tokens[index] + SEPARATOR_TOKENS
+        target = next((c for c, space in enumerate(remaining) if cost <= space), None)
+        if target is None and len(chunks) < max_chunks:
+            chunks.append({})
+            remaining.append(chunk_budget - reserved)
+            target = len(chunks) - 1 if cost <= remaining[-1] else None
+        if target is not None:
+            chunks[target][index] = file
+            remaining[target] -= cost
+            continue
+        # 放不下整个文件：在剩余空间最多的块中放入变更最多的 hunk
+        target = max(range(len(chunks)), key=lambda c: remaining[c])
+        partial, used, omitted = _pack_hunks(file, remaining[target], count_batch)
+        if partial is None:
+            notes[index] = _file_note(file, tokens[index])
+            continue
+        chunks[target][index] = partial
+        remaining[target] -= used
+        notes[index] = _hunks_note(file, omitted)
+    filled = [c for c, chunk in enumerate(chunks) if chunk]
+    space = (remaining[filled[-1]] if filled else 0) + reserved
+    return ([[chunks[c][i] for i in sorted(chunks[c])] for c in filled],
+            _limit_notes([notes[i] for i in sorted(notes)], space, count_batch))
+
+
+def render_packed(files: List[FileChange], notes: List[str]) -> str:
+    sections = [diff_model.render(files)] if files else []
+    if notes:
+        sections.append(NOTES_HEADING + '\n' + '\n'.join(notes))
+    return '\n\n'.join(sections)
+
+
+def pack_for_review(files: List[FileChange], tokens: Optional[List[int]] = None) -> str:
+    """按 REVIEW_MAX_TOKENS 分配预算并渲染发送给 LLM 的 diff 文本"""
+    if not files:
+        return ''
+    budget = int(os.getenv('REVIEW_MAX_TOKENS', 10000))
+    packed, notes = pack(files, budget, tokens=tokens)
+    if notes:
+        logger.info("Diff exceeds REVIEW_MAX_TOKENS=%s, packed %s/%s files, not included: %s",
+                    budget, len(packed), len(files), notes[:20])
+    return render_packed(packed, notes)
+
+
+def map_reduce_enabled() -> bool:
+    return os.getenv('REVIEW_MAP_REDUCE_ENABLED', '0') == '1'
+
+
+def chunk_for_review(files: List[FileChange]) -> List[str]:
+    """
+    渲染发送给 LLM 的 diff 文本
+
+    Returns:
+        每次审查的 diff 文本；diff 未超过 map-reduce 阈值（或未开启）时只有一项，与 pack_for_review 相同；
+        没有需要审查的文件时为空列表
+    """
+    if not files:
+        return []
+    if not map_reduce_enabled():
+        return [pack_for_review(files)]
+    review_max_tokens = int(os.getenv('REVIEW_MAX_TOKENS', 10000))
+    threshold = int(os.getenv('REVIEW_MAP_REDUCE_THRESHOLD_TOKENS', review_max_tokens))
+    # 每个文件只分词一次，之后的判断、分配与切分复用同一份计数
+    tokens = count_tokens_batch([file.render() for file in files])
+    total = sum(tokens) + SEPARATOR_TOKENS * len(files)
+    if total <= threshold:
+        return [pack_for_review(files, tokens)]
+
+    chunk_budget = int(os.getenv('REVIEW_CHUNK_MAX_TOKENS', review_max_tokens // 2))
+    max_chunks = int(os.getenv('REVIEW_MAP_MAX_CHUNKS', 6))
+    chunks, notes = split(files, chunk_budget, max_chunks, tokens=tokens)
+    logger.info("Diff tokens %s exceed REVIEW_MAP_REDUCE_THRESHOLD_TOKENS=%s, split %s files into %s chunks, "
+                "not included: %s", total, threshold, len(files), len(chunks), notes[:20])
+    return [render_packed(chunk, notes if index == len(chunks) - 1 else [])
+            for index, chunk in enumerate(chunks)]
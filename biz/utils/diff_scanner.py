@@ -0,0 +1,57 @@
+"""
+diff 扫描
+
+GitLab 与 GitHub 的 filter_changes 共用的文件过滤与行数统计：
+- SUPPORTED_EXTENSIONS 按取值缓存为后缀元组，用 str.endswith(tuple) 一次匹配所有后缀
+- 新增、删除行数用 str.count 在 C 层统计，不构建匹配列表；结果与 ^\\+(?!\\+\\+)、^-(?!--) 两个正则一致
+- 整个文件被删除的 diff 用一个预编译正则判断，无需把 diff 拆分成行
+"""
+import os
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+
+DEFAULT_EXTENSIONS = '.java,.py,.php'
+
+# 删除整个文件的 diff：hunk 头的新文件范围为 +0,0
+DELETION_HEADER = re.compile(r'@@ -\d+,\d+ \+0,0 @@')
+# 首行之后出现不以 - 开头的非空行
+NON_DELETION_LINE = re.compile(r'\n[^-\n]')
+
+
+@lru_cache(maxsize=16)
+def parse_extensions(value: str) -> Tuple[str, ...]:
+    """把逗号分隔的扩展名配置解析为后缀元组，与原先的 str.split(',') 一致：空项保留，空配置匹配所有文件"""
+    return tuple(value.split(','))
+
+
+def supported_extensions() -> Tuple[str, ...]:
+    """当前 SUPPORTED_EXTENSIONS 对应的后缀元组，配置不变时不会重复解析"""
+    return parse_extensions(os.getenv('SUPPORTED_EXTENSIONS', DEFAULT_EXTENSIONS))
+
+
+def is_supported(path: Optional[str], extensions: Tuple[str, ...] = None) -> bool:
+    return bool(path) and path.endswith(extensions if extensions is not None else supported_extensions())
+
+
+def _count_line_prefix(diff: str, prefix: str) -> int:
+    """统计以 prefix 开头、但不以 prefix * 3 开头的行数"""
+    count = diff.count('\n' + prefix) - diff.count('\n' + prefix * 3)
+    if diff.startswith(prefix) and not diff.startswith(prefix * 3):
+        count += 1
+    return count
+
+
+def count_changes(diff: str) -> Tuple[int, int]:
+    """返回 diff 的 (新增行数, 删除行数)，跳过 +++ / --- 文件头"""
+    if not diff:
+        return 0, 0
+    return _count_line_prefix(diff, '+'), _count_line_prefix(diff, '-')
+
+
+def is_deletion_diff(diff: str) -> bool:
+    """diff 是否为删除整个文件：hunk 头为 +0,0，且之后只有删除行或空行"""
+    if not diff or not DELETION_HEADER.match(diff):
+        return False
+    first_line_end = diff.find('\n')
+    return first_line_end < 0 or NON_DELETION_LINE.search(diff, first_line_end) is None
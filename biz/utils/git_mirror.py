@@ -0,0 +1,193 @@
+"""
+本地 git 镜像
+
+开启 GIT_MIRROR_ENABLED 后，每个仓库在本地磁盘（GIT_MIRROR_DIR）保留一份裸镜像（git clone --mirror），
+事件到达时用 git fetch 增量更新，对象在多次事件之间复用；diff 在本地用 git diff 计算，
+不受 REST API 分页与大文件截断（overflow / too_large）的限制。
+
+输出转换为与 GitLab changes 接口相同的结构（old_path、new_path、diff、new_file、renamed_file、deleted_file），
+可直接交给 filter_changes 处理。访问令牌通过环境变量传给 git，不写入镜像的配置文件。
+"""
+import base64
+import codecs
+import fcntl
+import os
+import re
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from biz.utils.log import logger
+
+# 40 位（SHA-1）或 64 位（SHA-256）的完整提交 ID
+FULL_SHA = re.compile(r'^(?:[0-9a-f]{40}|[0-9a-f]{64})$')
+
+
+def git_mirror_enabled() -> bool:
+    return os.getenv('GIT_MIRROR_ENABLED', '0') == '1'
+
+
+class GitMirrorError(RuntimeError):
+    """git 命令执行失败"""
+
+
+def _unquote(path: str) -> str:
+    """还原 git 对特殊字符路径的 C 风格引号转义"""
+    if len(path) >= 2 and path.startswith('"') and path.endswith('"'):
+        return codecs.escape_decode(path[1:-1].encode('utf-8'))[0].decode('utf-8', errors='replace')
+    return path
+
+
+def _strip_prefix(path: str, prefix: str) -> str:
+    path = _unquote(path.rstrip('\t'))
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+
+def _header_paths(header: str):
+    """从 diff --git a/x b/x 头中解析路径，只用于没有 ---/+++ 与 rename 行的变更（如二进制或仅权限变化）"""
+    paths = header[len('diff --git '):]
+    if paths.startswith('"'):
+        old, _, new = paths[1:].partition('" ')
+        return _strip_prefix(f'"{old}"', 'a/'), _strip_prefix(new, 'b/')
+    half = (len(paths) - 1) // 2
+    return _strip_prefix(paths[:half], 'a/'), _strip_prefix(paths[half + 1:], 'b/')
+
+
+def parse_diff(text: str) -> List[Dict]:
+    """把 git diff 的输出转换为 GitLab changes 结构，diff 字段从第一个 @@ 开始"""
+    changes = []
+    for block in re.split(r'^(?=diff --git )', text, flags=re.MULTILINE):
+        if not block.startswith('diff --git '):
+            continue
+        header, _, body = block.partition('\n')
+        lines = body.split('\n')
+        change = {'old_path': None, 'new_path': None, 'diff': '', 'new_file': False, 'renamed_file': False,
+                  'deleted_file': False}
+        index = 0
+        while index < len(lines) and not lines[index].startswith('@@'):
+            line = lines[index]
+            if line.startswith('new file mode'):
+                change['new_file'] = True
+            elif line.startswith('deleted file mode'):
+                change['deleted_file'] = True
+            elif line.startswith('rename from '):
+                change['old_path'] = _unquote(line[len('rename from '):])
+                change['renamed_file'] = True
+            elif line.startswith('rename to '):
+                change['new_path'] = _unquote(line[len('rename to '):])
+            elif line.startswith('--- ') and line[4:] != '/dev/null':
+                change['old_path'] = _strip_prefix(line[4:], 'a/')
+            elif line.startswith('+++ ') and line[4:] != '/dev/null':
+                change['new_path'] = _strip_prefix(line[4:], 'b/')
+            index += 1
+        if change['old_path'] is None or change['new_path'] is None:
+            old_path, new_path = _header_paths(header)
+            change['old_path'] = change['old_path'] or old_path
+            change['new_path'] = change['new_path'] or new_path
+        if change['new_file']:
+            change['old_path'] = change['new_path']
+        if change['deleted_file']:
+            change['new_path'] = change['old_path']
+        change['diff'] = '\n'.join(lines[index:])
+        changes.append(change)
+    return changes
+
+
+class GitMirror:
+    """按远程仓库地址在本地维护裸镜像"""
+
+    def __init__(self, root: str = None, timeout: float = None):
+        self.root = root or os.getenv('GIT_MIRROR_DIR', 'data/git_mirrors')
+        self.timeout = timeout or float(os.getenv('GIT_MIRROR_TIMEOUT', 300))
+
+    def path(self, remote_url: str) -> str:
+        """镜像目录：主机 + 仓库路径，不包含地址中的账号信息"""
+        parts = urlsplit(remote_url)
+        name = f"{parts.hostname or ''}_{parts.path}" if parts.scheme else remote_url
+        return os.path.join(self.root, re.sub(r'[^a-zA-Z0-9._-]', '_', name).strip('_') + '.git')
+
+    @staticmethod
+    def _auth_env(token: Optional[str], username: str) -> Dict[str, str]:
+        env = {**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+        if token:
+            credentials = base64.b64encode(f"{username}:{token}".encode('utf-8')).decode('ascii')
+            # 通过环境变量注入请求头，令牌不会出现在进程参数和镜像配置中
+            env.update({'GIT_CONFIG_COUNT': '1', 'GIT_CONFIG_KEY_0': 'http.extraHeader',
+                        'GIT_CONFIG_VALUE_0': f"Authorization: Basic {credentials}"})
+        return env
+
+    def _git(self, args: List[str], env: Dict[str, str] = None) -> str:
+        result = subprocess.run(['git', *args], capture_output=True, env=env, timeout=self.timeout)
+        if result.returncode != 0:
+            raise GitMirrorError(f"git {args[0]} failed ({result.returncode}): "
+                                 f"{result.stderr.decode('utf-8', errors='replace').strip()}")
+        return result.stdout.decode('utf-8', errors='replace')
+
+    @contextmanager
+    def _locked(self, path: str):
+        """同一镜像的更新与读取在进程、线程之间互斥"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _has_commit(self, path: str, sha: str) -> bool:
+        return subprocess.run(['git', '--git-dir', path, 'cat-file', '-e', f"{sha}^{{commit}}"],
+                              capture_output=True, timeout=self.timeout).returncode == 0
+
+    def sync(self, remote_url: str, token: str = None, username: str = 'oauth2') -> str:
+        """首次使用时创建镜像，之后增量 fetch；返回镜像目录。调用方需持有镜像锁"""
+        path = self.path(remote_url)
+        env = self._auth_env(token, username)
+        if not os.path.isdir(path):
+            logger.info(f"创建本地镜像: {path}")
+            self._git(['clone', '--mirror', '--quiet', remote_url, path], env)
+        else:
+            self._git(['--git-dir', path, 'fetch', '--prune', '--quiet', 'origin'], env)
+        return path
+
+    def diff(self, remote_url: str, base: str, head: str, token: str = None, merge_base: bool = False,
+             username: str = 'oauth2') -> List[Dict]:
+        """
+        计算 base 与 head 之间的变更
+
+        Args:
+            remote_url: 仓库地址（HTTP(S) 地址或本地路径）
+            base: 基准提交或引用（如 refs/heads/main）
+            head: 目标提交或引用
+            token: 访问令牌，以 HTTP Basic 认证发送（GitLab 用户名为 oauth2，GitHub 为 x-access-token）
+            merge_base: 为 True 时与 MR 一致，比较 base 与 head 的共同祖先和 head（base...head）
+
+        Returns:
+            GitLab changes 结构的变更列表
+        """
+        path = self.path(remote_url)
+        with self._locked(path):
+            # 两端都是已在镜像中的完整提交 ID 时无需 fetch
+            if not (os.path.isdir(path) and all(FULL_SHA.match(ref) and self._has_commit(path, ref)
+                                                for ref in (base, head))):
+                self.sync(remote_url, token, username)
+            output = self._git(['--git-dir', path, '-c', 'core.quotePath=false', 'diff', '--no-color', '--no-ext-diff',
+                                '--find-renames', '--src-prefix=a/', '--dst-prefix=b/',
+                                f"{base}...{head}" if merge_base else f"{base}..{head}", '--'])
+        changes = parse_diff(output)
+        logger.info(f"本地镜像 diff {base}{'...' if merge_base else '..'}{head}: {len(changes)} 个文件")
+        return changes
+
+
+_mirror: Optional[GitMirror] = None
+_mirror_lock = threading.Lock()
+
+
+def get_git_mirror() -> GitMirror:
+    global _mirror
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                _mirror = GitMirror()
+    return _mirror
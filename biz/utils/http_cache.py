@@ -0,0 +1,175 @@
+"""
+SCM API GET 请求的条件请求缓存（ETag / If-None-Match）
+
+按 URL 与访问令牌范围保存响应的 ETag、响应头与响应体；再次请求同一 URL 时携带 If-None-Match，
+服务端返回 304 时直接使用缓存的响应体。304 响应不计入 GitHub 的速率限制，也减轻自建 GitLab 的负载。
+缓存保存在 SQLite 文件中，所有工作进程共享，总大小超过上限时按最近使用时间（LRU）淘汰。
+总大小由触发器在写入条目的同一事务中累计到 http_cache_meta 表，写入时无需扫描整个缓存表。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from biz.utils.log import logger
+
+# 参与缓存键计算的认证请求头，缓存中只保存其哈希值
+AUTH_HEADERS = {'authorization', 'private-token', 'job-token'}
+# 与缓存的响应体不对应（响应体已解压）或不应复用的响应头
+SKIPPED_HEADERS = {'content-length', 'content-encoding', 'transfer-encoding', 'connection', 'set-cookie'}
+
+
+def _cacheable_headers(headers) -> Dict[str, str]:
+    return {name: value for name, value in headers.items() if name.lower() not in SKIPPED_HEADERS}
+
+
+def http_cache_enabled() -> bool:
+    return os.getenv('HTTP_CACHE_ENABLED', '1') == '1'
+
+
+class CachedEntry:
+    __slots__ = ('etag', 'headers', 'body')
+
+    def __init__(self, etag: str, headers: Dict[str, str], body: bytes):
+        self.etag = etag
+        self.headers = headers
+        self.body = body
+
+    def to_response(self, not_modified: requests.Response) -> requests.Response:
+        """用缓存内容构造 200 响应，调用方无需区分是否命中缓存"""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(self.headers)
+        # 分页、限流等响应头以服务端最新返回的为准
+        response.headers.update(_cacheable_headers(not_modified.headers))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = self.body
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.elapsed = not_modified.elapsed
+        return response
+
+
+class HttpCache:
+    """基于 SQLite 的 ETag 缓存，总大小超过 max_bytes 时淘汰最近最少使用的条目"""
+
+    def __init__(self, db_file: str = None, max_bytes: int = None, max_entry_bytes: int = None):
+        from biz.queue.sqlite_queue import LocalConnection
+
+        self.db_file = db_file or os.getenv('HTTP_CACHE_DB_FILE', 'data/http_cache.db')
+        self.max_bytes = max_bytes or int(os.getenv('HTTP_CACHE_MAX_MB', 200)) * 1024 * 1024
+        self.max_entry_bytes = max_entry_bytes or int(os.getenv('HTTP_CACHE_MAX_ENTRY_MB', 10)) * 1024 * 1024
+        self._connection = LocalConnection(self.db_file)
+        conn = self._connection.get()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_http_cache_last_used_at ON http_cache (last_used_at);')
+            conn.execute('CREATE TABLE IF NOT EXISTS http_cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            # 已有的缓存文件只在首次升级时统计一次总大小，之后由触发器维护
+            conn.execute("INSERT OR IGNORE INTO http_cache_meta (name, value) "
+                         "SELECT 'total_size', COALESCE(SUM(size), 0) FROM http_cache")
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS http_cache_size_insert AFTER INSERT ON http_cache BEGIN
+                    UPDATE http_cache_meta SET value = value + NEW.size WHERE name = 'total_size';
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS http_cache_size_update AFTER UPDATE OF size ON http_cache BEGIN
+                    UPDATE http_cache_meta SET value = value + NEW.size - OLD.size WHERE name = 'total_size';
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS http_cache_size_delete AFTER DELETE ON http_cache BEGIN
+                    UPDATE http_cache_meta SET value = value - OLD.size WHERE name = 'total_size';
+                END
+            ''')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def key(url: str, headers: Optional[dict]) -> str:
+        """缓存键：URL + 认证请求头（令牌范围），不同令牌看到的内容互不共享"""
+        scope = [f"{name.lower()}={value}" for name, value in (headers or {}).items() if name.lower() in AUTH_HEADERS]
+        return hashlib.sha256('\n'.join([url, *sorted(scope)]).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedEntry]:
+        row = self._connection.get().execute('SELECT etag, headers, body FROM http_cache WHERE key = ?',
+                                             (key,)).fetchone()
+        if row is None:
+            return None
+        return CachedEntry(row['etag'], json.loads(row['headers']), bytes(row['body']))
+
+    def touch(self, key: str):
+        self._connection.get().execute('UPDATE http_cache SET last_used_at = ? WHERE key = ?', (time.time(), key))
+
+    def put(self, key: str, response: requests.Response):
+        body = response.content
+        if len(body) > self.max_entry_bytes:
+            return
+        conn = self._connection.get()
+        conn.execute(
+            'INSERT INTO http_cache (key, url, etag, headers, body, size, last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET url = excluded.url, etag = excluded.etag, headers = excluded.headers, '
+            'body = excluded.body, size = excluded.size, last_used_at = excluded.last_used_at',
+            (key, response.url, response.headers['ETag'], json.dumps(_cacheable_headers(response.headers)), body,
+             len(body), time.time()))
+        self.evict()
+
+    def evict(self) -> int:
+        """总大小超过上限时，按最近使用时间从旧到新删除，直到降到上限的 90%；返回删除的条目数"""
+        conn = self._connection.get()
+        total = self.total_size()
+        if total <= self.max_bytes:
+            return 0
+        target = total - int(self.max_bytes * 0.9)
+        removed, freed = [], 0
+        for row in conn.execute('SELECT key, size FROM http_cache ORDER BY last_used_at'):
+            removed.append(row['key'])
+            freed += row['size']
+            if freed >= target:
+                break
+        conn.executemany('DELETE FROM http_cache WHERE key = ?', [(key,) for key in removed])
+        logger.info(f"HTTP 缓存超过上限，已淘汰 {len(removed)} 条（{freed} 字节）")
+        return len(removed)
+
+    def total_size(self) -> int:
+        """所有条目的总字节数（触发器维护的累计值）"""
+        row = self._connection.get().execute("SELECT value FROM http_cache_meta WHERE name = 'total_size'").fetchone()
+        return row[0] if row else 0
+
+    def stats(self) -> Dict[str, int]:
+        row = self._connection.get().execute('SELECT COUNT(*) FROM http_cache').fetchone()
+        return {'entries': row[0], 'bytes': self.total_size(), 'max_bytes': self.max_bytes}
+
+
+_cache: Optional[HttpCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> HttpCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = HttpCache()
+    return _cache
@@ -0,0 +1,169 @@
+"""
+SCM（GitLab / GitHub）API 共享的 HTTP 会话层
+
+- 按 (进程, scheme://host) 复用 requests.Session，保持长连接，避免每次调用都重新建立 TCP/TLS 连接
+- 连接池大小可配置，默认超时覆盖所有调用
+- 429 与 5xx 响应按指数退避（带随机抖动）重试，并遵循 Retry-After 响应头
+- GET 请求经过 ETag 条件请求缓存（biz.utils.http_cache），服务端返回 304 时使用缓存的响应体
+- 请求前经过按 主机 + 令牌 的速率限制调度（biz.utils.rate_limiter），额度耗尽时抛出 RetryLater 延迟任务
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from biz.queue.retry import RetryLater
+from biz.utils.http_cache import get_http_cache, http_cache_enabled
+from biz.utils.log import logger
+from biz.utils.rate_limiter import get_rate_limiter, rate_limit_enabled, rate_limit_scope
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_sessions: Dict[Tuple[int, str], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def default_timeout() -> Tuple[float, float]:
+    """默认 (连接超时, 读取超时)，单位秒"""
+    return float(os.getenv('HTTP_CONNECT_TIMEOUT', 5)), float(os.getenv('HTTP_READ_TIMEOUT', 30))
+
+
+class CappedRetry(Retry):
+    """Retry-After 超过 max_retry_after 时不在当前请求内原地等待，直接返回响应，由速率限制器把任务延迟执行"""
+
+    max_retry_after = 30.0
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > self.max_retry_after:
+                raise MaxRetryError(_pool, url, f"Retry-After {retry_after}s exceeds {self.max_retry_after}s")
+        return super().increment(method, url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace)
+
+
+def build_retry() -> Retry:
+    """
+    构建重试策略：仅对幂等方法的 429/5xx 响应重试；连接失败时请求尚未发出，所有方法都会重试
+    """
+    CappedRetry.max_retry_after = float(os.getenv('HTTP_MAX_RETRY_AFTER', 30))
+    return CappedRetry(
+        total=int(os.getenv('HTTP_MAX_RETRIES', 3)),
+        backoff_factor=float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5)),
+        backoff_jitter=float(os.getenv('HTTP_BACKOFF_JITTER', 0.5)),
+        backoff_max=float(os.getenv('HTTP_BACKOFF_MAX', 30)),
+        status_forcelist=RETRY_STATUS_CODES,
+        respect_retry_after_header=True,
+        # 重试耗尽后返回最后一次响应，由调用方按状态码处理
+        raise_on_status=False,
+    )
+
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=int(os.getenv('HTTP_POOL_CONNECTIONS', 10)),
+        pool_maxsize=int(os.getenv('HTTP_POOL_MAXSIZE', 20)),
+        max_retries=build_retry(),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """获取目标主机对应的共享会话；会话按进程隔离，fork 出的子进程会重新创建"""
+    parts = urlsplit(url)
+    key = (os.getpid(), f"{parts.scheme}://{parts.netloc}")
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _create_session()
+                _sessions[key] = session
+    return session
+
+
+def request(method: str, url: str, defer: Optional[bool] = None, **kwargs) -> requests.Response:
+    """
+    发送请求，未指定 timeout 时使用默认超时
+
+    开启速率限制时，请求前按 主机 + 令牌 预留额度（必要时短暂等待），请求后根据响应头更新额度；
+    GET 请求遇到额度耗尽时抛出 RetryLater，写操作（如发布评论）则最多等待 HTTP_RATE_LIMIT_MAX_WAIT 后照常发送
+
+    Args:
+        defer: 额度耗尽时是否抛出 RetryLater，None 时 GET 为 True；不在队列任务中执行的调用（如 dashboard 接口）需传 False
+    """
+    kwargs.setdefault('timeout', default_timeout())
+    if not rate_limit_enabled():
+        return get_session(url).request(method, url, **kwargs)
+
+    limiter = get_rate_limiter()
+    scope = rate_limit_scope(url, kwargs.get('headers'))
+    defer = method.upper() == 'GET' if defer is None else defer
+    try:
+        wait = limiter.acquire(scope, defer=defer)
+    except RetryLater:
+        raise
+    except Exception as e:
+        logger.error(f"API 额度预留失败: {scope}, {e}")
+        wait = 0.0
+    if wait > 0:
+        time.sleep(wait)
+
+    response = get_session(url).request(method, url, **kwargs)
+    try:
+        delay = limiter.observe(scope, response)
+    except Exception as e:
+        logger.error(f"更新 API 额度失败: {scope}, {e}")
+        delay = None
+    if delay is not None and defer:
+        raise RetryLater(f"{scope} 的 API 额度已耗尽（HTTP {response.status_code}），{delay:.0f} 秒后重试", delay=delay)
+    return response
+
+
+def get(url: str, cache: bool = True, defer: bool = True, **kwargs) -> requests.Response:
+    """
+    发送 GET 请求；开启缓存时携带上次响应的 ETag（If-None-Match），304 时返回缓存内容构造的 200 响应
+
+    Args:
+        cache: 为 False 时跳过条件请求缓存，如需要实时状态的轮询
+        defer: 额度耗尽时抛出 RetryLater 由队列延迟任务；队列之外的调用传 False，返回服务端的限流响应
+    """
+    kwargs['defer'] = defer
+    if not cache or not http_cache_enabled() or kwargs.get('stream'):
+        return request('GET', url, **kwargs)
+
+    headers = dict(kwargs.pop('headers', None) or {})
+    # 带查询参数的完整 URL 作为缓存键的一部分
+    url = requests.Request('GET', url, params=kwargs.pop('params', None)).prepare().url
+    try:
+        http_cache = get_http_cache()
+        key = http_cache.key(url, headers)
+        entry = http_cache.get(key)
+    except Exception as e:
+        logger.error(f"读取 HTTP 缓存失败: {e}")
+        return request('GET', url, headers=headers, **kwargs)
+
+    if entry is not None:
+        headers['If-None-Match'] = entry.etag
+    response = request('GET', url, headers=headers, **kwargs)
+    try:
+        if response.status_code == 304 and entry is not None:
+            http_cache.touch(key)
+            return entry.to_response(response)
+        if response.status_code == 200 and response.headers.get('ETag'):
+            http_cache.put(key, response)
+    except Exception as e:
+        logger.error(f"写入 HTTP 缓存失败: {e}")
+    return response
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
@@ -0,0 +1,58 @@
+"""
+多进程部署下的单实例后台服务
+gunicorn 的多个 worker（包括 webhook 与 dashboard 两组）通过文件锁选出一个进程运行定时任务与队列消费者；
+持有锁的进程退出（例如达到 max_requests 被回收）后，其他进程会在下一次重试时接管
+"""
+import fcntl
+import os
+import threading
+from typing import Callable, Optional
+
+from biz.utils.log import logger
+
+_lock_fd: Optional[int] = None
+
+
+def try_acquire(lock_file: str) -> bool:
+    """尝试以非阻塞方式获取文件锁，获取成功后锁在进程存活期间一直持有"""
+    global _lock_fd
+    if _lock_fd is not None:
+        return True
+    lock_dir = os.path.dirname(lock_file)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _lock_fd = fd
+    return True
+
+
+def run_as_leader(callback: Callable[[], None], lock_file: str = None, retry_interval: float = None):
+    """
+    在后台线程中竞争文件锁，获取成功后执行 callback（每个部署只会有一个进程执行）
+
+    Args:
+        callback: 启动后台服务的函数
+        lock_file: 锁文件路径，所有 worker 需使用同一个文件
+        retry_interval: 未获取到锁时的重试间隔（秒）
+    """
+    lock_file = lock_file or os.getenv('BACKGROUND_LEADER_LOCK_FILE', 'data/background.lock')
+    retry_interval = retry_interval or float(os.getenv('BACKGROUND_LEADER_RETRY_INTERVAL', 30))
+
+    def run():
+        stop_event = threading.Event()
+        while not try_acquire(lock_file):
+            stop_event.wait(retry_interval)
+        logger.info(f"进程 {os.getpid()} 获取后台服务锁，启动定时任务与队列消费者")
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"启动后台服务失败: {e}")
+
+    threading.Thread(target=run, name='background-leader', daemon=True).start()
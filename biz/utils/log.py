@@ -1,6 +1,9 @@
+import contextvars
 import logging
 import os
+import random
 from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Optional
 
 # 自定义 Logger 类，重写 warn 和 error 方法
 class CustomLogger(logging.Logger):
@@ -14,6 +17,14 @@ class CustomLogger(logging.Logger):
         msg_with_emoji = f"❌ {msg}"
         super().error(msg_with_emoji, *args, **kwargs)
 
+    def debug(self, msg, *args, **kwargs):
+        # 项目在 LOG_DEBUG_PROJECTS 中时，DEBUG 日志（完整的接口响应等）提升为 INFO 输出，logger 级别保持不变
+        if not self.isEnabledFor(logging.DEBUG) and project_debug_enabled():
+            kwargs['stacklevel'] = kwargs.get('stacklevel', 1) + 1
+            super().info(f"[DEBUG] {msg}", *args, **kwargs)
+        else:
+            super().debug(msg, *args, **kwargs)
+
 
 log_file = os.environ.get("LOG_FILE", "log/app.log")
 log_max_bytes = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))  # 默认10MB
@@ -30,10 +41,33 @@ file_handler = RotatingFileHandler(
     encoding='utf-8',
     delay=False
 )
+
+
+class TruncatingFilter(logging.Filter):
+    """兜底限制单条日志的长度，避免超大消息同步写入磁盘；开启详细日志时不截断"""
+
+    def __init__(self, max_chars: int):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.max_chars <= 0 or debug_enabled():
+            return True
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            record.msg = f"{message[:self.max_chars]}...(truncated, {len(message)} chars)"
+            record.args = None
+        return True
+
+
+log_max_message_chars = int(os.environ.get("LOG_MAX_MESSAGE_CHARS", 10000))
+truncating_filter = TruncatingFilter(log_max_message_chars)
+file_handler.addFilter(truncating_filter)
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(filename)s:%(funcName)s:%(lineno)d - %(message)s'))
 file_handler.setLevel(LOG_LEVEL)
 
 console_handler = logging.StreamHandler()
+console_handler.addFilter(truncating_filter)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(filename)s:%(funcName)s:%(lineno)d - %(message)s'))
 console_handler.setLevel(LOG_LEVEL)
 
@@ -43,3 +77,95 @@ logger = CustomLogger(__name__)
 logger.setLevel(LOG_LEVEL)  # 设置 Logger 的日志级别
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
+
+
+# 按项目开启详细日志：LOG_DEBUG_PROJECTS=group/app,url_slug:group/other，该项目的任务会输出完整的 diff、提示词等内容
+log_debug_projects = {name.strip() for name in os.environ.get("LOG_DEBUG_PROJECTS", "").split(",") if name.strip()}
+log_sample_rate = float(os.environ.get("LOG_SAMPLE_RATE", 1.0))
+log_max_field_chars = int(os.environ.get("LOG_MAX_FIELD_CHARS", 500))
+
+_log_project: contextvars.ContextVar[str] = contextvars.ContextVar('log_project', default='')
+
+
+def set_log_project(project: str) -> contextvars.Token:
+    """设置当前任务所属项目（如 url_slug:group/app），用于按项目开启详细日志"""
+    return _log_project.set(project or '')
+
+
+def reset_log_project(token: contextvars.Token):
+    _log_project.reset(token)
+
+
+def project_debug_enabled() -> bool:
+    """当前任务的项目在 LOG_DEBUG_PROJECTS 中时返回 True"""
+    if not log_debug_projects:
+        return False
+    project = _log_project.get()
+    return bool(project) and (project in log_debug_projects or project.split(':', 1)[-1] in log_debug_projects)
+
+
+def debug_enabled() -> bool:
+    """全局 DEBUG 级别，或当前任务的项目在 LOG_DEBUG_PROJECTS 中时返回 True"""
+    return logger.isEnabledFor(logging.DEBUG) or project_debug_enabled()
+
+
+def sampled(rate: Optional[float] = None) -> bool:
+    """按采样率决定是否输出高频日志（LOG_SAMPLE_RATE，默认全部输出）；开启详细日志的项目不采样"""
+    rate = log_sample_rate if rate is None else rate
+    return rate >= 1 or debug_enabled() or random.random() < rate
+
+
+class _LazyText:
+    """日志参数的延迟格式化：只有日志真正输出时才计算摘要或截断"""
+    __slots__ = ('value', 'render')
+
+    def __init__(self, value: Any, render: Callable[[Any], str]):
+        self.value = value
+        self.render = render
+
+    def __str__(self) -> str:
+        return self.render(self.value)
+
+
+def _truncate(value: Any, limit: int) -> str:
+    text = value if isinstance(value, str) else str(value)
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...({len(text)} chars)"
+
+
+def truncated(value: Any, limit: Optional[int] = None) -> _LazyText:
+    """延迟截断，开启详细日志时输出完整内容"""
+    limit = log_max_field_chars if limit is None else limit
+    return _LazyText(value, lambda v: str(v) if debug_enabled() else _truncate(v, limit))
+
+
+def _approx_tokens(num_chars: int) -> int:
+    # 日志摘要只需要量级，按平均 4 个字符一个 token 估算，避免为了打日志对整个 diff 做分词
+    return num_chars // 4
+
+
+def _changes_summary(changes: Any) -> str:
+    if not isinstance(changes, list):
+        return _truncate(changes, log_max_field_chars)
+    paths = [item.get('new_path', '') for item in changes if isinstance(item, dict)]
+    diff_chars = sum(len(item.get('diff') or '') for item in changes if isinstance(item, dict))
+    shown = ', '.join(paths[:5]) + (f' (+{len(paths) - 5} more)' if len(paths) > 5 else '')
+    return f"{len(changes)} files, {diff_chars} chars, ~{_approx_tokens(diff_chars)} tokens: [{shown}]"
+
+
+def summarize_changes(changes: Any) -> _LazyText:
+    """diff 列表的摘要（文件数、字符数、估算 token 数、文件路径），开启详细日志时输出完整内容"""
+    return _LazyText(changes, lambda v: str(v) if debug_enabled() else _changes_summary(v))
+
+
+def _messages_summary(messages: Any) -> str:
+    if not isinstance(messages, list):
+        return _truncate(messages, log_max_field_chars)
+    chars = sum(len(str(message.get('content', ''))) for message in messages if isinstance(message, dict))
+    return f"{len(messages)} messages, {chars} chars, ~{_approx_tokens(chars)} tokens"
+
+
+def summarize_messages(messages: Any) -> _LazyText:
+    """LLM 请求消息的摘要，开启详细日志时输出完整内容"""
+    return _LazyText(messages, lambda v: str(v) if debug_enabled() else _messages_summary(v))
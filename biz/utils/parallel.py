@@ -0,0 +1,47 @@
+"""
+并发执行互不依赖的 I/O 调用（如 SCM API 请求），整体受同一个截止时间约束
+"""
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+
+def default_fetch_timeout() -> float:
+    return float(os.getenv('SCM_FETCH_TIMEOUT', 120))
+
+
+def run_parallel(calls: Dict[str, Callable[[], Any]], timeout: Optional[float] = None,
+                 max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    在线程中并发执行多个调用，总耗时取决于最慢的一个
+
+    每个调用在调用方上下文的副本中执行，任务跟踪的阶段耗时与日志上下文保持不变。
+    每次使用独立的线程池，嵌套调用不会因共享线程池耗尽而互相等待。
+
+    Args:
+        calls: 名称 -> 无参调用
+        timeout: 所有调用共享的截止时间（秒），None 时读取 SCM_FETCH_TIMEOUT
+        max_workers: 最大并发数，None 时全部调用同时执行；小于调用数时其余调用排队，共享同一截止时间
+
+    Returns:
+        名称 -> 返回值；任一调用抛出的异常会原样抛出
+
+    Raises:
+        TimeoutError: 截止时间内仍有调用未完成
+    """
+    if not calls:
+        return {}
+    timeout = default_fetch_timeout() if timeout is None else timeout
+    workers = min(len(calls), max_workers) if max_workers else len(calls)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='parallel-fetch')
+    try:
+        futures = {name: executor.submit(contextvars.copy_context().run, call) for name, call in calls.items()}
+        _, not_done = wait(futures.values(), timeout=timeout)
+        if not_done:
+            pending = [name for name, future in futures.items() if future in not_done]
+            raise TimeoutError(f"并发调用超过截止时间 {timeout}s 仍未完成: {', '.join(pending)}")
+        return {name: future.result() for name, future in futures.items()}
+    finally:
+        # 超时的调用在后台线程中自行结束，不再阻塞当前任务
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,149 @@
+"""
+受保护分支规则缓存
+
+开启 MERGE_REVIEW_ONLY_PROTECTED_BRANCHES_ENABLED 后，每个 MR/PR 事件都需要判断目标分支是否受保护。
+各项目的受保护分支规则按 TTL 缓存在所有工作进程共享的存储中（rq 驱动使用 Redis，其他驱动使用 SQLite），
+规则在进程内编译为一个正则表达式；收到规则可能变化的 webhook / 系统钩子事件时主动失效。
+"""
+import fnmatch
+import json
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+from biz.utils.log import logger
+
+# 会导致项目受保护分支规则或项目标识变化的 GitLab 系统钩子事件（GitLab 没有单独的受保护分支事件，其余变化依赖 TTL）
+GITLAB_INVALIDATE_EVENTS = {'project_update', 'project_rename', 'project_transfer', 'project_destroy'}
+# GitHub 的分支保护规则事件，以及仓库重命名、转移等事件
+GITHUB_INVALIDATE_EVENTS = {'branch_protection_rule', 'repository'}
+
+
+def cache_ttl() -> int:
+    """缓存有效期（秒），0 表示不缓存"""
+    return int(os.getenv('PROTECTED_BRANCH_CACHE_TTL', 600))
+
+
+def cache_key(url_slug: str, project: str) -> str:
+    return f"{url_slug}:{project}"
+
+
+class SqliteProtectedBranchStore:
+    """基于 SQLite 的共享缓存，同一主机上的所有进程共享"""
+
+    def __init__(self, db_file: str = None):
+        from biz.queue.sqlite_queue import LocalConnection
+
+        self.db_file = db_file or os.getenv('SQLITE_QUEUE_DB_FILE', 'data/queue.db')
+        self._connection = LocalConnection(self.db_file)
+        conn = self._connection.get()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS protected_branch_cache (
+                key TEXT PRIMARY KEY,
+                patterns TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('DELETE FROM protected_branch_cache WHERE expires_at < ?', (time.time(),))
+
+    def get(self, key: str) -> Optional[List[str]]:
+        row = self._connection.get().execute(
+            'SELECT patterns FROM protected_branch_cache WHERE key = ? AND expires_at >= ?',
+            (key, time.time())).fetchone()
+        return json.loads(row['patterns']) if row else None
+
+    def set(self, key: str, patterns: List[str], ttl_seconds: int):
+        self._connection.get().execute(
+            'INSERT INTO protected_branch_cache (key, patterns, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET patterns = excluded.patterns, expires_at = excluded.expires_at',
+            (key, json.dumps(patterns, ensure_ascii=False), time.time() + ttl_seconds))
+
+    def delete(self, key: str):
+        self._connection.get().execute('DELETE FROM protected_branch_cache WHERE key = ?', (key,))
+
+
+class RedisProtectedBranchStore:
+    """基于 Redis 的共享缓存，供 rq 驱动下分布在多台机器上的 worker 共享"""
+
+    KEY_PREFIX = 'ai-codereview:protected-branches:'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get(self, key: str) -> Optional[List[str]]:
+        value = self.connection.get(self.KEY_PREFIX + key)
+        return json.loads(value) if value else None
+
+    def set(self, key: str, patterns: List[str], ttl_seconds: int):
+        self.connection.set(self.KEY_PREFIX + key, json.dumps(patterns, ensure_ascii=False), ex=ttl_seconds)
+
+    def delete(self, key: str):
+        self.connection.delete(self.KEY_PREFIX + key)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """获取当前队列驱动对应的共享缓存"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if os.getenv('QUEUE_DRIVER', 'async') == 'rq':
+                    from biz.queue.redis_conn import get_redis_connection
+
+                    _store = RedisProtectedBranchStore(get_redis_connection())
+                else:
+                    _store = SqliteProtectedBranchStore()
+    return _store
+
+
+@lru_cache(maxsize=1024)
+def compile_patterns(patterns: Tuple[str, ...]) -> Optional[re.Pattern]:
+    """把一组 fnmatch 规则编译为一个正则表达式，相同的规则在进程内只编译一次"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(pattern)})' for pattern in patterns))
+
+
+def branch_protected(key: str, branch: str, loader: Callable[[], Optional[List[str]]]) -> bool:
+    """
+    判断分支是否匹配项目的受保护分支规则
+
+    Args:
+        key: cache_key 生成的项目标识
+        branch: 分支名
+        loader: 缓存未命中时从代码托管平台获取规则列表，获取失败返回 None（不缓存）
+    """
+    ttl_seconds = cache_ttl()
+    patterns = None
+    if ttl_seconds > 0:
+        try:
+            patterns = get_store().get(key)
+        except Exception as e:
+            logger.error(f"读取受保护分支缓存失败: {key}, {e}")
+    if patterns is None:
+        patterns = loader()
+        if patterns is None:
+            return False
+        if ttl_seconds > 0:
+            try:
+                get_store().set(key, patterns, ttl_seconds)
+            except Exception as e:
+                logger.error(f"写入受保护分支缓存失败: {key}, {e}")
+    regex = compile_patterns(tuple(patterns))
+    return bool(regex and regex.match(branch))
+
+
+def invalidate(key: str):
+    """受保护分支规则可能已变化时删除缓存"""
+    try:
+        get_store().delete(key)
+        logger.info(f"受保护分支缓存已失效: {key}")
+    except Exception as e:
+        logger.error(f"删除受保护分支缓存失败: {key}, {e}")
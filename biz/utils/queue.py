@@ -1,10 +1,20 @@
 import os
-from multiprocessing import Process
+from typing import List, Tuple
 
-from redis import Redis
-from rq import Queue
+from rq import Queue, Retry
 
+from biz.queue.admission import get_admission_stats, merge_admission_stats
+from biz.queue.coalesce import publish_revision
+from biz.queue.payload import compression_enabled, pack, run_packed
+from biz.queue.pool import get_worker_pool_stats
+from biz.queue.process_stats import get_process_stats
+from biz.queue.redis_conn import get_redis_connection
+from biz.queue.retry import retry_max_attempts, rq_retry_intervals
+from biz.queue.scheduler import LANES, LANE_REVIEW, get_dispatcher, get_dispatcher_stats, job_lane, project_key
+from biz.queue.spool import get_spool, run_spooled, spool_enabled
+from biz.queue.sqlite_queue import function_path
 from biz.utils.log import logger
+from biz.utils.rate_limiter import get_rate_limit_stats
 
 queue_driver = os.getenv('QUEUE_DRIVER', 'async')
 
@@ -12,14 +22,138 @@ if queue_driver == 'rq':
     queues = {}
 
 
-def handle_queue(function: callable, data: any, token: str, url: str, url_slug: str):
+def rq_queue_name(url_slug: str, lane: str) -> str:
+    """
+    rq 驱动下每个通道对应一个队列：MR/PR 审查沿用 url_slug 本身，其余通道追加后缀，
+    worker 按 `rq worker {slug} {slug}_push {slug}_backfill` 的顺序监听即可获得优先级
+    """
+    return url_slug if lane == LANE_REVIEW else f'{url_slug}_{lane}'
+
+
+def get_rq_queue(queue_name: str) -> Queue:
+    """所有 rq 队列共用进程内的 Redis 连接池"""
+    if queue_name not in queues:
+        queues[queue_name] = Queue(queue_name, connection=get_redis_connection())
+    return queues[queue_name]
+
+
+def _prepare_job(function: callable, data: any, token: str, url: str, url_slug: str, lane: str = None,
+                 raw_body: bytes = None, source: str = '', event: str = '') -> dict:
+    """计算任务的通道、项目与合并键，并确定实际入队的函数与参数"""
+    # 登记 MR/PR 的最新版本，同一 MR/PR 排队中版本不同的旧任务将被取代
+    coalesce_key, coalesce_revision = publish_revision(data, url_slug) or (None, None)
+    # 优先级通道：MR/PR 审查 > Push 审查 > 回填
+    lane = lane or job_lane(data)
+    job = dict(function=function, args=(data, token, url, url_slug), queue=url_slug, lane=lane,
+               project=project_key(data, url_slug), coalesce_key=coalesce_key,
+               coalesce_revision=coalesce_revision, description=f'{function.__name__}({url_slug})')
+
+    if raw_body is not None and spool_enabled():
+        # 原始请求体写入暂存区，队列中只传递 spool_id，由工作进程读取并解析
+        handler = function_path(function)
+        spool_id = get_spool().append(raw_body, source, event, url, url_slug, handler)
+        job.update(function=run_spooled, args=(handler, spool_id, token, url, url_slug))
+    elif queue_driver == 'rq' and compression_enabled():
+        # rq 任务参数使用压缩后的 JSON，而不是 pickle 完整的 webhook 数据
+        job.update(function=run_packed, args=(function_path(function), pack(data), token, url, url_slug))
+    return job
+
+
+def _submit_jobs(jobs: List[dict]):
+    if queue_driver == 'rq':
+        # 所有任务通过同一个 pipeline 一次性写入 Redis；显式指定 description，避免 rq 默认把参数的 repr 存入 Redis
+        # 处理函数只有抛出 RetryLater 时才会把异常抛出到 rq，由 rq 的 Retry 延迟重新执行（worker 需开启 --with-scheduler）
+        connection = get_redis_connection()
+        with connection.pipeline() as pipe:
+            for job in jobs:
+                retry = Retry(max=retry_max_attempts(), interval=rq_retry_intervals())
+                get_rq_queue(rq_queue_name(job['queue'], job['lane'])).enqueue_many(
+                    [Queue.prepare_data(job['function'], args=job['args'], description=job['description'],
+                                        retry=retry)],
+                    pipeline=pipe)
+            pipe.execute()
+    elif queue_driver == 'sqlite':
+        from biz.queue.sqlite_queue import get_job_queue, get_consumer
+
+        # 写入 SQLite 任务表，进程重启后任务不会丢失
+        get_job_queue().enqueue_many(jobs)
+        consumer = get_consumer()
+        if consumer:
+            consumer.wakeup()
+    else:
+        # 按通道与项目排队，由调度器提交到常驻工作进程池
+        dispatcher = get_dispatcher()
+        for job in jobs:
+            dispatcher.put(job['function'], job['args'], lane=job['lane'], project=job['project'],
+                           coalesce_key=job['coalesce_key'], coalesce_revision=job['coalesce_revision'])
+
+
+def handle_queue(function: callable, data: any, token: str, url: str, url_slug: str, lane: str = None,
+                 raw_body: bytes = None, source: str = '', event: str = ''):
+    _submit_jobs([_prepare_job(function, data, token, url, url_slug, lane=lane, raw_body=raw_body, source=source,
+                               event=event)])
+
+
+def handle_queue_many(items: List[dict], lane: str = None):
+    """
+    批量入队，供重放、回填等工具使用；rq 驱动下通过一次 pipeline 写入，sqlite 驱动下在同一个事务中写入
+
+    Args:
+        items: 每项包含 handle_queue 的参数（function、data、token、url、url_slug，可选 raw_body、source、event）
+        lane: 统一指定的通道，为空时按事件类型推断
+    """
+    _submit_jobs([_prepare_job(**{'lane': lane, **item}) for item in items])
+
+
+def get_queue_load(url_slug: str = '') -> Tuple[int, int]:
+    """
+    返回当前队列负载 (排队中任务数, 执行中任务数)，供 webhook 入口做准入控制；
+    rq 驱动下按 url_slug 对应的各通道队列统计
+    """
     if queue_driver == 'rq':
-        if url_slug not in queues:
-            logger.info(f'REDIS_HOST: {os.getenv("REDIS_HOST", "127.0.0.1")}，REDIS_PORT: {os.getenv("REDIS_PORT", 6379)}')
-            queues[url_slug] = Queue(url_slug, connection=Redis(os.getenv('REDIS_HOST', '127.0.0.1'),
-                                                                              os.getenv('REDIS_PORT', 6379)))
+        depth, in_flight = 0, 0
+        for lane in LANES:
+            queue = get_rq_queue(rq_queue_name(url_slug, lane))
+            depth += queue.count
+            in_flight += queue.started_job_registry.count
+        return depth, in_flight
+    elif queue_driver == 'sqlite':
+        from biz.queue.sqlite_queue import get_job_queue
 
-        queues[url_slug].enqueue(function, data, token, url, url_slug)
+        return get_job_queue().load()
     else:
-        process = Process(target=function, args=(data, token, url, url_slug))
-        process.start()
+        return get_dispatcher().load()
+
+
+def start_queue_consumer():
+    """启动当前驱动所需的后台消费者（目前仅 sqlite 驱动需要）"""
+    if queue_driver == 'sqlite' and os.getenv('SQLITE_QUEUE_CONSUMER_ENABLED', '1') == '1':
+        from biz.queue.sqlite_queue import start_consumer
+
+        start_consumer()
+
+
+def get_queue_stats() -> dict:
+    """
+    返回队列运行状态
+
+    准入计数与工作进程池利用率保存在各自进程的内存中，processes 列出本机所有存活进程写入共享存储的快照（计数按进程累计），
+    admission 为各进程准入计数的合计；共享存储不可用时退化为只返回应答请求的当前进程的数据
+    """
+    stats = {'driver': queue_driver}
+    if queue_driver == 'sqlite':
+        from biz.queue.sqlite_queue import get_job_queue
+
+        stats['jobs'] = get_job_queue().stats()
+    elif queue_driver != 'rq':
+        stats['jobs'] = get_dispatcher_stats()
+    try:
+        processes = get_process_stats()
+    except Exception as e:
+        logger.error(f"读取各进程统计失败: {e}")
+        processes = [{'pool': get_worker_pool_stats(), 'admission': get_admission_stats()}]
+    stats['processes'] = processes
+    stats['admission'] = merge_admission_stats([process.get('admission') for process in processes])
+    # 各代码托管平台 主机 + 令牌 的剩余 API 额度
+    stats['scm_rate_limits'] = get_rate_limit_stats()
+    return stats
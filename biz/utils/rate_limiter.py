@@ -0,0 +1,204 @@
+"""
+SCM API 速率限制调度
+
+从 GitHub（X-RateLimit-*）与 GitLab（RateLimit-*）的响应头学习每个 主机 + 令牌 的额度（上限、剩余、重置时间），
+保存在所有工作进程共享的 SQLite 表中，请求前按令牌桶预留额度：
+- 剩余额度按距离重置的时间均匀发放（令牌桶速率 = 剩余额度 / 剩余时间，容量 HTTP_RATE_LIMIT_BURST），多个进程的突发请求被平滑
+- 需要等待的时间较短时在当前请求内等待，超过 HTTP_RATE_LIMIT_MAX_WAIT 或额度耗尽时抛出 RetryLater，由队列延迟执行任务
+- 响应为 429，或 403 且剩余额度为 0 时，同样按重置时间 / Retry-After 延迟任务，而不是按未知错误失败
+
+响应头反映的是服务端的全局剩余额度，rq 驱动下各机器的本地状态会随响应自动校正。
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from biz.queue.retry import RetryLater
+from biz.utils.log import logger
+
+LIMIT_HEADERS = ('X-RateLimit-Limit', 'RateLimit-Limit')
+REMAINING_HEADERS = ('X-RateLimit-Remaining', 'RateLimit-Remaining')
+RESET_HEADERS = ('X-RateLimit-Reset', 'RateLimit-Reset')
+AUTH_HEADERS = {'authorization', 'private-token', 'job-token'}
+
+
+def rate_limit_enabled() -> bool:
+    return os.getenv('HTTP_RATE_LIMIT_ENABLED', '1') == '1'
+
+
+def rate_limit_scope(url: str, headers: Optional[dict]) -> str:
+    """额度范围：主机 + 令牌哈希（不保存令牌本身）"""
+    token = '\n'.join(sorted(f"{name.lower()}={value}" for name, value in (headers or {}).items()
+                             if name.lower() in AUTH_HEADERS))
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()[:16] if token else 'anonymous'
+    return f"{urlsplit(url).netloc}:{digest}"
+
+
+def _header_number(headers, names) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class RateLimiter:
+    """基于 SQLite 的共享令牌桶"""
+
+    def __init__(self, db_file: str = None, burst: float = None, max_wait: float = None, reserve: int = None):
+        from biz.queue.sqlite_queue import LocalConnection
+
+        self.db_file = db_file or os.getenv('HTTP_RATE_LIMIT_DB_FILE', os.getenv('SQLITE_QUEUE_DB_FILE', 'data/queue.db'))
+        self.burst = burst or float(os.getenv('HTTP_RATE_LIMIT_BURST', 10))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('HTTP_RATE_LIMIT_MAX_WAIT', 5))
+        self.reserve = reserve if reserve is not None else int(os.getenv('HTTP_RATE_LIMIT_RESERVE', 0))
+        self._connection = LocalConnection(self.db_file)
+        self._connection.get().execute('''
+            CREATE TABLE IF NOT EXISTS scm_rate_limits (
+                scope TEXT PRIMARY KEY,
+                limit_value INTEGER NOT NULL,
+                remaining INTEGER NOT NULL,
+                reset_at REAL,
+                tokens REAL NOT NULL,
+                refilled_at REAL NOT NULL,
+                throttled INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def acquire(self, scope: str, defer: bool = True) -> float:
+        """
+        请求前预留一次额度
+
+        Args:
+            scope: rate_limit_scope 生成的额度范围
+            defer: 为 True 时额度耗尽或等待过久抛出 RetryLater；为 False（如发布评论等写操作）时最多等待 max_wait 后照常发送
+
+        Returns:
+            发送请求前需要等待的秒数
+        """
+        conn = self._connection.get()
+        now = time.time()
+        # 先普通读取：尚未学习到额度、或处于新的计费窗口（还没有重置时间）的范围不做限制，不获取写锁
+        row = conn.execute('SELECT reset_at FROM scm_rate_limits WHERE scope = ?', (scope,)).fetchone()
+        if row is None or row['reset_at'] is None:
+            return 0.0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT * FROM scm_rate_limits WHERE scope = ?', (scope,)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return 0.0
+            limit_value, remaining, reset_at, tokens = (row['limit_value'], row['remaining'], row['reset_at'],
+                                                         row['tokens'])
+            if reset_at is None or now >= reset_at:
+                # 新的计费窗口：在收到新的响应头之前不做限制
+                conn.execute('UPDATE scm_rate_limits SET remaining = ?, reset_at = NULL, tokens = ?, refilled_at = ? '
+                             'WHERE scope = ?', (limit_value, self.burst, now, scope))
+                conn.execute('COMMIT')
+                return 0.0
+
+            budget = remaining - self.reserve
+            if budget <= 0:
+                conn.execute('UPDATE scm_rate_limits SET throttled = throttled + 1 WHERE scope = ?', (scope,))
+                conn.execute('COMMIT')
+                if defer:
+                    raise RetryLater(f"{scope} 的 API 额度已耗尽，{reset_at - now:.0f} 秒后重置",
+                                     delay=reset_at - now + 1)
+                return min(reset_at - now, self.max_wait)
+
+            rate = budget / max(reset_at - now, 1.0)
+            tokens = min(self.burst, tokens + (now - row['refilled_at']) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if wait > self.max_wait and defer:
+                conn.execute('UPDATE scm_rate_limits SET throttled = throttled + 1 WHERE scope = ?', (scope,))
+                conn.execute('COMMIT')
+                raise RetryLater(f"{scope} 的 API 额度紧张，需要等待 {wait:.1f} 秒", delay=wait)
+            conn.execute('UPDATE scm_rate_limits SET remaining = remaining - 1, tokens = ?, refilled_at = ? '
+                         'WHERE scope = ?', (tokens - 1, now, scope))
+            conn.execute('COMMIT')
+            return min(wait, self.max_wait)
+        except RetryLater:
+            raise
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def observe(self, scope: str, response) -> Optional[float]:
+        """
+        根据响应头更新额度
+
+        Returns:
+            响应表明额度已耗尽（429，或 403 且剩余为 0）时返回建议的延迟秒数，否则返回 None
+        """
+        headers = response.headers
+        limit_value = _header_number(headers, LIMIT_HEADERS)
+        remaining = _header_number(headers, REMAINING_HEADERS)
+        reset = _header_number(headers, RESET_HEADERS)
+        retry_after = _header_number(headers, ('Retry-After',))
+        exhausted = response.status_code == 429 or (response.status_code == 403 and remaining == 0)
+        if limit_value is None and not exhausted:
+            return None
+
+        now = time.time()
+        # GitHub/GitLab 返回重置时刻的时间戳，部分实现返回距离重置的秒数
+        reset_at = (reset if reset > 1e9 else now + reset) if reset is not None else None
+        if exhausted:
+            remaining = 0
+            # 没有任何重置信息时保守地等待 60 秒
+            reset_at = max(reset_at or now, now + (retry_after or 0)) if (reset_at or retry_after) else now + 60
+        elif remaining is None:
+            remaining = limit_value
+        self._connection.get().execute(
+            '''
+            INSERT INTO scm_rate_limits (scope, limit_value, remaining, reset_at, tokens, refilled_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(scope) DO UPDATE SET
+                limit_value = CASE WHEN ? THEN excluded.limit_value ELSE limit_value END,
+                remaining = excluded.remaining, reset_at = excluded.reset_at, updated_at = excluded.updated_at
+            ''',
+            (scope, int(limit_value if limit_value is not None else remaining), int(remaining), reset_at, self.burst,
+             now, now, limit_value is not None))
+        if exhausted:
+            return max(reset_at - now, 1.0)
+        return None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各 主机 + 令牌 的剩余额度，供 /api/queue/stats 展示"""
+        now = time.time()
+        return [{
+            'scope': row['scope'],
+            'limit': row['limit_value'],
+            'remaining': row['remaining'],
+            'reset_in_seconds': round(max(row['reset_at'] - now, 0), 1) if row['reset_at'] else None,
+            'throttled': row['throttled'],
+        } for row in self._connection.get().execute('SELECT * FROM scm_rate_limits ORDER BY scope')]
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+def get_rate_limit_stats() -> Optional[List[Dict[str, Any]]]:
+    if not rate_limit_enabled():
+        return None
+    try:
+        return get_rate_limiter().stats()
+    except Exception as e:
+        logger.error(f"读取 API 额度统计失败: {e}")
+        return None
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from unittest import TestCase, main, mock
+
+from biz.utils.code_reviewer import CodeReviewer
+
+
+class FakeReviewer(CodeReviewer):
+    """不连接 LLM：各部分按 diff 文本返回固定评分，合并请求返回 reduce_result"""
+
+    def __init__(self, scores, reduce_result=None):
+        self.client = None
+        self.prompts = self._load_prompts("code_review_prompt")
+        self.scores = scores
+        self.reduce_result = reduce_result
+        self.reduce_messages = None
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def review_code(self, diffs_text, commits_text="", previous_review=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.2)
+        with self.lock:
+            self.active -= 1
+        return f"```markdown\n{diffs_text} 有问题\n总分:{self.scores[diffs_text]}分\n```"
+
+    def call_llm(self, messages):
+        self.reduce_messages = messages
+        if isinstance(self.reduce_result, Exception):
+            raise self.reduce_result
+        return self.reduce_result
+
+
+@mock.patch("biz.utils.code_reviewer.count_tokens", lambda text: len(text.split()))
+class TestReviewChunks(TestCase):
+    def test_map_concurrently_then_reduce(self):
+        """各部分并发审查，总耗时取决于最慢的一部分；合并结果中的总分可被解析"""
+        reviewer = FakeReviewer({"aaaa": 60, "bb": 90, "cc": 90}, reduce_result="合并报告\n总分:70分")
+        started_at = time.time()
+        result = reviewer.review_chunks(["aaaa", "bb", "cc"], "fix")
+        self.assertLess(time.time() - started_at, 0.5)
+        self.assertEqual(reviewer.max_active, 3)
+        self.assertEqual(CodeReviewer.parse_review_score(result), 70)
+        content = reviewer.reduce_messages[-1]["content"]
+        self.assertIn("拆分为 3 部分", content)
+        self.assertIn("加权的平均分 75 分", content)
+        self.assertIn("#### 第 2/3 部分\nbb 有问题", content)
+
+    def test_concurrency_limit(self):
+        reviewer = FakeReviewer({"a": 80, "b": 80, "c": 80}, reduce_result="总分:80分")
+        with mock.patch.dict(os.environ, {"REVIEW_MAP_CONCURRENCY": "2"}):
+            reviewer.review_chunks(["a", "b", "c"])
+        self.assertEqual(reviewer.max_active, 2)
+
+    def test_reduce_fallback(self):
+        """合并失败或缺少总分时拼接各部分结果，只保留一个加权平均总分"""
+        for reduce_result in (RuntimeError("timeout"), "合并报告"):
+            reviewer = FakeReviewer({"aaa": 60, "b": 100}, reduce_result=reduce_result)
+            result = reviewer.review_chunks(["aaa", "b"])
+            self.assertEqual(result.count("总分"), 1)
+            self.assertTrue(result.endswith("总分:70分"))
+            self.assertEqual(CodeReviewer.parse_review_score(result), 70)
+
+    def test_single_chunk(self):
+        reviewer = FakeReviewer({"a": 85})
+        self.assertEqual(reviewer.review_chunks(["a"]), "a 有问题\n总分:85分")
+        self.assertIsNone(reviewer.reduce_messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+from unittest import TestCase, main, mock
+
+from biz.utils.diff_minifier import is_excluded, is_whitespace_only, minify, trim_context
+from biz.utils.diff_model import FileChange, parse_hunks
+
+
+def context(start: int, count: int) -> str:
+    return ''.join(f' line {i}\n' for i in range(start, start + count))
+
+
+class TestDiffMinifier(TestCase):
+    def test_trim_context_splits_hunk(self):
+        """两段变更之间的长上下文被去掉，拆分为两个 hunk，行范围重新计算"""
+        diff = ('@@ -1,26 +1,26 @@ def main():\n' + context(1, 10) + '-old 11\n+new 11\n'
+                + context(12, 10) + '-old 22\n+new 22\n' + context(23, 4))
+        hunks = trim_context(parse_hunks(diff)[0], 2)
+        self.assertEqual([hunk.header for hunk in hunks],
+                         ['@@ -9,5 +9,5 @@ def main():', '@@ -20,5 +20,5 @@ def main():'])
+        self.assertEqual(hunks[0].lines, [' line 9', ' line 10', '-old 11', '+new 11', ' line 12', ' line 13'])
+        self.assertEqual(hunks[1].lines[-1], ' line 24')
+
+    def test_trim_context_pure_addition(self):
+        diff = '@@ -1,8 +1,9 @@\n' + context(1, 6) + '+added\n' + context(7, 2)
+        hunks = trim_context(parse_hunks(diff)[0], 1)
+        self.assertEqual(hunks[0].header, '@@ -6,2 +6,3 @@')
+        only_added = trim_context(parse_hunks('@@ -1,4 +1,5 @@\n' + context(1, 4) + '+x\n')[0], 0)
+        self.assertEqual(only_added[0].header, '@@ -4,0 +5 @@')
+
+    def test_whitespace_only(self):
+        self.assertTrue(is_whitespace_only(parse_hunks('@@ -1,2 +1,2 @@\n-if (a) {\n-  b();\n+if (a) {  \n+    b();\n')[0]))
+        self.assertTrue(is_whitespace_only(parse_hunks('@@ -1 +1,3 @@\n x\n+\n+   \n')[0]))
+        self.assertFalse(is_whitespace_only(parse_hunks('@@ -1 +1 @@\n-a = 1\n+a = 2\n')[0]))
+        # 行内空白（字符串字面量）的修改不是纯空白修改
+        self.assertFalse(is_whitespace_only(parse_hunks('@@ -1 +1 @@\n-s = "a b"\n+s = "a  b"\n')[0]))
+
+    def test_indentation_kept_for_python(self):
+        """Python 中把语句移出 if 块只改变缩进，但改变了行为，不能被精简掉"""
+        diff = '@@ -1,3 +1,3 @@\n if a:\n     b()\n-    c()\n+c()\n'
+        self.assertTrue(is_whitespace_only(parse_hunks(diff)[0]))
+        self.assertFalse(is_whitespace_only(parse_hunks(diff)[0], keep_indent=True))
+        minified, stats = minify([FileChange('app/flow.py', parse_hunks(diff), 1, 1),
+                                  FileChange('app/flow.js', parse_hunks(diff), 1, 1)])
+        self.assertEqual([file.path for file in minified], ['app/flow.py'])
+        self.assertEqual(stats['whitespace_hunks'], 1)
+        self.assertTrue(is_whitespace_only(parse_hunks('@@ -1 +1 @@\n-    c()  \n+    c()\n')[0], keep_indent=True))
+
+    def test_excluded_patterns(self):
+        self.assertTrue(is_excluded('web/package-lock.json'))
+        self.assertTrue(is_excluded('vendor/github.com/x/y.go'))
+        self.assertTrue(is_excluded('static/app.min.js'))
+        self.assertTrue(is_excluded('proto/user_pb2.py'))
+        self.assertFalse(is_excluded('app/service.py'))
+        with mock.patch.dict(os.environ, {'DIFF_EXCLUDE_PATTERNS': 'migrations/, !vendor/keep/'}):
+            self.assertTrue(is_excluded('app/migrations/0001_initial.py'))
+            self.assertFalse(is_excluded('vendor/keep/lib.go'))
+
+    def test_minify(self):
+        files = [
+            FileChange('app/a.py', parse_hunks('@@ -1 +1 @@\n-a = 1\n+a = 2\n'), 1, 1),
+            FileChange('vendor/lib.py', parse_hunks('@@ -1 +1 @@\n-a\n+b\n'), 1, 1),
+            FileChange('app/renamed.py', [], old_path='app/old.py', status='renamed'),
+            FileChange('app/format.js', parse_hunks('@@ -1 +1 @@\n-  x = 1;\n+    x = 1;\n'), 1, 1),
+        ]
+        minified, stats = minify(files)
+        self.assertEqual([file.path for file in minified], ['app/a.py'])
+        self.assertEqual(stats['excluded_files'], ['vendor/lib.py', 'app/renamed.py', 'app/format.js'])
+        self.assertEqual(stats['whitespace_hunks'], 1)
+
+
+if __name__ == '__main__':
+    main()
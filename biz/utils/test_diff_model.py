@@ -0,0 +1,65 @@
+from unittest import TestCase, main
+
+from biz.github.webhook_handler import file_to_change, filter_changes as filter_github_changes
+from biz.gitlab.webhook_handler import filter_changes as filter_gitlab_changes
+from biz.utils.diff_model import FileChange, from_changes, parse_hunks, render
+
+DIFF = ('@@ -10,3 +10,4 @@ def handle(request):\n'
+        '     name = request["name"]\n'
+        '-    return name\n'
+        '+    name = name.strip()\n'
+        '+    return name\n'
+        '\\ No newline at end of file\n'
+        '@@ -40 +41 @@\n'
+        '-x = 1\n'
+        '+x = 2\n')
+
+
+class TestDiffModel(TestCase):
+    def test_parse_hunks(self):
+        hunks = parse_hunks('--- a/app.py\n+++ b/app.py\n' + DIFF)
+        self.assertEqual(len(hunks), 2)
+        self.assertEqual((hunks[0].old.start, hunks[0].old.count, hunks[0].new.start, hunks[0].new.count),
+                         (10, 3, 10, 4))
+        self.assertEqual(hunks[0].section, 'def handle(request):')
+        self.assertEqual(hunks[0].lines[-1], '+    return name')
+        self.assertEqual((hunks[1].old.count, hunks[1].new.start), (1, 41))
+        self.assertEqual(hunks[1].header, '@@ -40 +41 @@')
+        self.assertFalse(hasattr(hunks[0], '__dict__'))
+
+    def test_render_compact(self):
+        text = render(from_changes([{'new_path': 'app.py', 'diff': DIFF, 'additions': 3, 'deletions': 2}]))
+        self.assertTrue(text.startswith('### app.py +3 -2\n@@ -10,3 +10,4 @@ def handle(request):\n'))
+        self.assertIn('     name = request["name"]\n', text)
+        self.assertNotIn('No newline', text)
+        self.assertNotIn('\\n', text)
+        self.assertTrue(text.endswith('@@ -40 +41 @@\n-x = 1\n+x = 2'))
+        self.assertLess(len(text), len(str([{'new_path': 'app.py', 'diff': DIFF, 'additions': 3, 'deletions': 2}])))
+
+    def test_file_status(self):
+        renamed = FileChange.from_dict({'old_path': 'a.py', 'new_path': 'b.py', 'renamed_file': True, 'diff': ''})
+        self.assertEqual(renamed.header, '### b.py (renamed from a.py) +0 -0')
+        added = FileChange.from_dict({'new_path': 'c.py', 'new_file': True, 'diff': '@@ -0,0 +1 @@\n+c\n'})
+        self.assertEqual(added.render(), '### c.py (added) +0 -0\n@@ -0,0 +1 @@\n+c')
+        self.assertEqual(FileChange.from_dict({'new_path': 'd.py', 'diff': ''}).status, 'modified')
+
+    def test_status_survives_filter_changes(self):
+        """两种 filter_changes 的结果保留文件状态，重命名与新增文件的标题可以渲染出来"""
+        gitlab = filter_gitlab_changes([
+            {'old_path': 'app/old.py', 'new_path': 'app/new.py', 'renamed_file': True, 'diff': DIFF},
+            {'old_path': 'app/add.py', 'new_path': 'app/add.py', 'new_file': True, 'diff': '@@ -0,0 +1 @@\n+a\n'},
+            {'old_path': 'app/same.py', 'new_path': 'app/same.py', 'diff': DIFF},
+        ])
+        github = filter_github_changes([file_to_change(file) for file in [
+            {'previous_filename': 'app/old.py', 'filename': 'app/new.py', 'status': 'renamed', 'patch': DIFF},
+            {'filename': 'app/add.py', 'status': 'added', 'patch': '@@ -0,0 +1 @@\n+a\n', 'additions': 1},
+            {'filename': 'app/same.py', 'status': 'modified', 'patch': DIFF},
+        ]])
+        for changes in (gitlab, github):
+            headers = [file.header.rsplit(' +', 1)[0] for file in from_changes(changes)]
+            self.assertEqual(headers, ['### app/new.py (renamed from app/old.py)', '### app/add.py (added)',
+                                       '### app/same.py'])
+
+
+if __name__ == '__main__':
+    main()
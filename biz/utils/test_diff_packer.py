@@ -0,0 +1,98 @@
+import os
+from unittest import TestCase, main, mock
+
+from biz.utils.diff_model import FileChange, parse_hunks
+from biz.utils.diff_packer import chunk_for_review, pack, path_weight, render_packed, split
+
+
+def count_words(texts):
+    """以空白分隔的单词数代替 token 数"""
+    return [len(text.split()) for text in texts]
+
+
+def file_change(path: str, hunks: int, lines_per_hunk: int) -> FileChange:
+    diff = ''.join(f"@@ -{i * 100 + 1},{lines_per_hunk} +{i * 100 + 1},{lines_per_hunk} @@\n"
+                   + ''.join(f"+w{i}_{j}\n" for j in range(lines_per_hunk)) for i in range(hunks))
+    return FileChange(path, parse_hunks(diff), hunks * lines_per_hunk, 0)
+
+
+class TestDiffPacker(TestCase):
+    def test_fits_unchanged(self):
+        files = [file_change('a.py', 1, 3), file_change('b.py', 1, 3)]
+        self.assertEqual(pack(files, 1000, count_words), (files, []))
+
+    def test_priority_and_listing(self):
+        """预算不足时业务代码优先于测试代码，放不下的文件列在文末"""
+        files = [file_change('tests/test_service.py', 1, 40), file_change('app/service.py', 1, 40),
+                 file_change('app/util.py', 1, 5)]
+        packed, notes = pack(files, 80, count_words)
+        self.assertEqual([file.path for file in packed], ['app/service.py', 'app/util.py'])
+        self.assertEqual(len(notes), 1)
+        self.assertTrue(notes[0].startswith('- tests/test_service.py (+40 -0'))
+        text = render_packed(packed, notes)
+        self.assertIn('### 超出 token 预算未包含的变更\n- tests/test_service.py', text)
+
+    def test_partial_hunks(self):
+        """放不下整个文件时放入变更最多的 hunk，并列出省略的 hunk"""
+        big = file_change('app/big.py', 4, 40)
+        big.hunks[2].lines.extend(f"+extra{j}" for j in range(10))
+        packed, notes = pack([big], 110, count_words)
+        self.assertEqual(len(packed[0].hunks), 1)
+        self.assertIn('+extra0', packed[0].hunks[0].lines)
+        self.assertEqual(notes, ['- app/big.py: 省略 3/4 个 hunk（@@ -1,40 +1,40 @@, @@ -101,40 +101,40 @@, '
+                                 '@@ -301,40 +301,40 @@）'])
+
+    def test_path_weights(self):
+        self.assertEqual(path_weight('app/service.py'), 1.0)
+        self.assertEqual(path_weight('src/test/java/FooTest.java'), 0.5)
+        with mock.patch.dict(os.environ, {'DIFF_PATH_WEIGHTS': 'core/**=3, docs/=0'}):
+            self.assertEqual(path_weight('core/engine/run.py'), 3.0)
+            files = [file_change('docs/guide.py', 1, 1), file_change('core/a.py', 2, 50)]
+            packed, notes = pack(files, 100, count_words)
+            self.assertEqual([file.path for file in packed], ['core/a.py'])
+            self.assertTrue(notes[0].startswith('- docs/guide.py'))
+
+    def test_split_along_file_boundaries(self):
+        """文件按优先级首次适应放入各块，块内保持原顺序"""
+        files = [file_change('app/a.py', 1, 30), file_change('app/b.py', 1, 25), file_change('app/c.py', 1, 10),
+                 file_change('app/d.py', 1, 20)]
+        chunks, notes = split(files, 66, 4, count_words)
+        self.assertEqual([[file.path for file in chunk] for chunk in chunks],
+                         [['app/a.py', 'app/c.py'], ['app/b.py'], ['app/d.py']])
+        self.assertEqual(notes, [])
+
+    def test_split_limits(self):
+        """超过块预算的文件只放入部分 hunk，超出块数的文件列出"""
+        files = [file_change('app/big.py', 3, 100), file_change('app/a.py', 1, 150), file_change('app/b.py', 1, 40)]
+        chunks, notes = split(files, 260, 2, count_words)
+        self.assertEqual([[file.path for file in chunk] for chunk in chunks], [['app/big.py'], ['app/a.py', 'app/b.py']])
+        self.assertEqual(len(chunks[0][0].hunks), 2)
+        self.assertEqual(notes, ['- app/big.py: 省略 1/3 个 hunk（@@ -201,100 +201,100 @@）'])
+        chunks, notes = split(files, 260, 1, count_words)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(notes[1:], ['- app/a.py (+150 -0, ~158 tokens)', '- app/b.py (+40 -0, ~48 tokens)'])
+        self.assertLessEqual(count_words([render_packed(chunks[0], notes)])[0], 260)
+
+    def test_notes_within_budget(self):
+        """大量未包含的文件不会让渲染结果超出预算"""
+        files = [file_change(f'app/m{i}.py', 1, 30) for i in range(40)]
+        packed, notes = pack(files, 300, count_words)
+        self.assertTrue(notes[-1].startswith('- 另有 '))
+        self.assertLessEqual(count_words([render_packed(packed, notes)])[0], 300)
+
+    @mock.patch('biz.utils.diff_packer.count_tokens_batch', count_words)
+    def test_chunk_for_review(self):
+        files = [file_change(f'app/m{i}.py', 1, 30) for i in range(3)]
+        env = {'REVIEW_MAX_TOKENS': '200', 'REVIEW_CHUNK_MAX_TOKENS': '80'}
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(len(chunk_for_review(files)), 1)
+            with mock.patch.dict(os.environ, {'REVIEW_MAP_REDUCE_ENABLED': '1'}):
+                self.assertEqual(len(chunk_for_review(files[:2])), 1)
+                chunks = chunk_for_review(files + [file_change('app/m3.py', 1, 80)])
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(chunks[0].startswith('### app/m0.py'))
+        self.assertTrue(chunks[-1].endswith('### 超出 token 预算未包含的变更\n- app/m3.py (+80 -0, ~88 tokens)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os
+import re
+from unittest import TestCase, main, mock
+
+from biz.utils.diff_scanner import count_changes, is_deletion_diff, is_supported, parse_extensions
+
+
+def reference_counts(diff: str):
+    """原 filter_changes 的统计方式"""
+    return (len(re.findall(r'^\+(?!\+\+)', diff, re.MULTILINE)),
+            len(re.findall(r'^-(?!--)', diff, re.MULTILINE)))
+
+
+class TestDiffScanner(TestCase):
+    def test_count_changes_matches_regex(self):
+        diffs = [
+            '',
+            '+a',
+            '-a\n+b',
+            '--- a/x.py\n+++ b/x.py\n@@ -1 +1 @@\n-a\n+b\n',
+            '@@ -1,3 +1,3 @@\n ctx\n+++counter\n---\n++x\n--y\n+\n-\n',
+            '\n\n+a\n-b\n\n',
+        ]
+        for diff in diffs:
+            self.assertEqual(count_changes(diff), reference_counts(diff), diff)
+
+    def test_is_deletion_diff(self):
+        self.assertTrue(is_deletion_diff('@@ -1,2 +0,0 @@\n-a\n-b\n'))
+        self.assertTrue(is_deletion_diff('@@ -1,2 +0,0 @@'))
+        self.assertTrue(is_deletion_diff('@@ -1,2 +0,0 @@\n-a\n\n-b'))
+        self.assertFalse(is_deletion_diff('@@ -1,2 +0,0 @@\n-a\n b\n'))
+        self.assertFalse(is_deletion_diff('@@ -1,2 +1,1 @@\n-a\n-b\n'))
+        self.assertFalse(is_deletion_diff(''))
+
+    def test_supported_extensions(self):
+        self.assertEqual(parse_extensions('.py,.java'), ('.py', '.java'))
+        with mock.patch.dict(os.environ, {'SUPPORTED_EXTENSIONS': '.go,.ts'}):
+            self.assertTrue(is_supported('cmd/main.go'))
+            self.assertFalse(is_supported('main.py'))
+            self.assertFalse(is_supported(None))
+
+    def test_empty_extensions_match_all(self):
+        """SUPPORTED_EXTENSIONS 为空时与原先一样匹配所有文件"""
+        with mock.patch.dict(os.environ, {'SUPPORTED_EXTENSIONS': ''}):
+            self.assertTrue(is_supported('README.md'))
+            self.assertTrue(is_supported('Makefile'))
+            self.assertFalse(is_supported(''))
+
+
+if __name__ == '__main__':
+    main()
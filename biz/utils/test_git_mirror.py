@@ -0,0 +1,106 @@
+import os
+import subprocess
+import tempfile
+from unittest import TestCase, main, mock
+
+from biz.gitlab.webhook_handler import PushHandler, filter_changes
+from biz.utils.git_mirror import GitMirror, parse_diff
+
+
+def git(cwd: str, *args: str) -> str:
+    env = {**os.environ, 'GIT_AUTHOR_NAME': 'dev', 'GIT_AUTHOR_EMAIL': 'dev@example.com',
+           'GIT_COMMITTER_NAME': 'dev', 'GIT_COMMITTER_EMAIL': 'dev@example.com'}
+    return subprocess.run(['git', *args], cwd=cwd, env=env, check=True, capture_output=True,
+                          text=True).stdout.strip()
+
+
+def write(repo: str, path: str, content: str):
+    os.makedirs(os.path.dirname(os.path.join(repo, path)) or repo, exist_ok=True)
+    with open(os.path.join(repo, path), 'w') as file:
+        file.write(content)
+
+
+class TestGitMirror(TestCase):
+    def setUp(self):
+        """临时仓库：main 分支之上的 feature 分支修改、新增、重命名、删除文件"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo = os.path.join(self.tmp_dir.name, 'repo')
+        os.makedirs(self.repo)
+        git(self.repo, 'init', '-q', '-b', 'main')
+        write(self.repo, 'app/main.py', 'a = 1\nb = 2\n')
+        write(self.repo, 'app/old name.py', 'x = 1\ny = 2\nz = 3\n')
+        write(self.repo, 'README.md', 'readme\n')
+        git(self.repo, 'add', '-A')
+        git(self.repo, 'commit', '-q', '-m', 'init')
+        self.base = git(self.repo, 'rev-parse', 'HEAD')
+
+        git(self.repo, 'checkout', '-q', '-b', 'feature')
+        write(self.repo, 'app/main.py', 'a = 1\nb = 3\n')
+        write(self.repo, 'app/new.py', 'print("new")\n')
+        git(self.repo, 'mv', 'app/old name.py', 'app/new name.py')
+        git(self.repo, 'rm', '-q', 'README.md')
+        git(self.repo, 'add', '-A')
+        git(self.repo, 'commit', '-q', '-m', 'feature')
+        self.head = git(self.repo, 'rev-parse', 'HEAD')
+        self.mirror = GitMirror(root=os.path.join(self.tmp_dir.name, 'mirrors'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_diff_normalized(self):
+        changes = {change['new_path']: change for change in self.mirror.diff(self.repo, self.base, self.head)}
+        self.assertEqual(set(changes), {'app/main.py', 'app/new.py', 'app/new name.py', 'README.md'})
+        self.assertTrue(changes['app/main.py']['diff'].startswith('@@'))
+        self.assertIn('+b = 3', changes['app/main.py']['diff'])
+        self.assertTrue(changes['app/new.py']['new_file'])
+        self.assertTrue(changes['app/new name.py']['renamed_file'])
+        self.assertEqual(changes['app/new name.py']['old_path'], 'app/old name.py')
+        self.assertTrue(changes['README.md']['deleted_file'])
+
+        filtered = filter_changes(list(changes.values()))
+        self.assertEqual({item['new_path'] for item in filtered}, {'app/main.py', 'app/new.py', 'app/new name.py'})
+        main_change = next(item for item in filtered if item['new_path'] == 'app/main.py')
+        self.assertEqual((main_change['additions'], main_change['deletions']), (1, 1))
+
+    def test_merge_base_and_reuse(self):
+        """与 MR 一致地按共同祖先比较；镜像已包含两端提交时不再 fetch"""
+        git(self.repo, 'checkout', '-q', 'main')
+        write(self.repo, 'app/main.py', 'a = 2\nb = 2\n')
+        git(self.repo, 'commit', '-q', '-am', 'main moves on')
+
+        changes = self.mirror.diff(self.repo, 'refs/heads/main', self.head, merge_base=True)
+        self.assertIn('+b = 3', next(c for c in changes if c['new_path'] == 'app/main.py')['diff'])
+        self.assertTrue(os.path.isdir(self.mirror.path(self.repo)))
+
+        with mock.patch.object(GitMirror, 'sync') as sync:
+            self.mirror.diff(self.repo, self.base, self.head)
+        sync.assert_not_called()
+
+    def test_force_push_matches_compare_api(self):
+        """强制推送后与 compare API 一样按共同祖先比较，被丢弃的提交不会显示为回退"""
+        git(self.repo, 'reset', '-q', '--hard', self.base)
+        write(self.repo, 'app/rebased.py', 'print("rebased")\n')
+        git(self.repo, 'add', '-A')
+        git(self.repo, 'commit', '-q', '-m', 'rewritten feature')
+        after = git(self.repo, 'rev-parse', 'HEAD')
+
+        webhook_data = {'event_name': 'push', 'project': {'id': 1, 'git_http_url': self.repo},
+                        'before': self.head, 'after': after, 'commits': [{'id': after}]}
+        with mock.patch('biz.utils.git_mirror.git_mirror_enabled', return_value=True), \
+                mock.patch('biz.utils.git_mirror.get_git_mirror', return_value=self.mirror):
+            changes = PushHandler(webhook_data, 'token', 'http://gitlab').get_push_changes()
+        self.assertEqual([change['new_path'] for change in changes], ['app/rebased.py'])
+
+    def test_parse_binary_and_quoted_path(self):
+        text = ('diff --git a/logo.png b/logo.png\nnew file mode 100644\nindex 0000000..e69de29\n'
+                'Binary files /dev/null and b/logo.png differ\n'
+                'diff --git "a/\\344\\270\\255.py" "b/\\344\\270\\255.py"\nindex 1..2 100644\n'
+                '--- "a/\\344\\270\\255.py"\n+++ "b/\\344\\270\\255.py"\n@@ -1 +1 @@\n-a\n+b\n')
+        changes = parse_diff(text)
+        self.assertEqual([change['new_path'] for change in changes], ['logo.png', '中.py'])
+        self.assertTrue(changes[0]['new_file'])
+        self.assertEqual(changes[1]['diff'], '@@ -1 +1 @@\n-a\n+b\n')
+
+
+if __name__ == '__main__':
+    main()
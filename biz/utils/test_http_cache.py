@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, main, mock
+
+import requests
+
+from biz.utils import http_cache, http_client
+from biz.utils.http_cache import HttpCache
+
+
+class EtagHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        body = b'[{"name": "main"}]'
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Link', '<http://example.com/?page=2>; rel="next"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_response(url: str, body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers['ETag'] = 'x'
+    response._content = body
+    return response
+
+
+class TestHttpCache(TestCase):
+    def setUp(self):
+        """使用临时数据库文件"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = HttpCache(db_file=os.path.join(self.tmp_dir.name, 'http_cache.db'), max_bytes=100)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_scoped_by_token(self):
+        """不同令牌的缓存互不共享"""
+        self.assertNotEqual(HttpCache.key('u', {'Private-Token': 'a'}), HttpCache.key('u', {'Private-Token': 'b'}))
+        self.assertEqual(HttpCache.key('u', {'Private-Token': 'a', 'Accept': 'x'}),
+                         HttpCache.key('u', {'PRIVATE-TOKEN': 'a'}))
+
+    def test_lru_eviction(self):
+        """超过总大小上限时淘汰最近最少使用的条目"""
+        for name in ('a', 'b'):
+            self.cache.put(name, make_response(name, b'x' * 40))
+        self.cache.touch('a')
+        self.cache.put('c', make_response('c', b'x' * 40))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+    def test_total_size_tracked(self):
+        """总大小随写入、覆盖与淘汰累计，与实际条目一致"""
+        self.cache.put('a', make_response('a', b'x' * 30))
+        self.cache.put('b', make_response('b', b'x' * 20))
+        self.cache.put('a', make_response('a', b'x' * 10))
+        self.assertEqual(self.cache.total_size(), 30)
+        self.cache.put('c', make_response('c', b'x' * 80))
+        actual = self.cache._connection.get().execute('SELECT COALESCE(SUM(size), 0) FROM http_cache').fetchone()[0]
+        self.assertEqual(self.cache.total_size(), actual)
+        self.assertLessEqual(actual, 100)
+        # 重新打开已有的缓存文件时保留累计值
+        self.assertEqual(HttpCache(db_file=self.cache.db_file, max_bytes=100).total_size(), actual)
+
+    def test_conditional_request(self):
+        """第二次请求携带 If-None-Match，304 时返回缓存的响应体与分页头"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), EtagHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_port}/api/v4/projects/1/protected_branches'
+        with mock.patch.object(http_cache, '_cache', self.cache), \
+                mock.patch.dict(os.environ, {'HTTP_RATE_LIMIT_ENABLED': '0'}):
+            first = http_client.get(url, headers={'Private-Token': 't'})
+            second = http_client.get(url, headers={'Private-Token': 't'})
+        self.assertEqual(EtagHandler.requests_seen, [None, '"v1"'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertIn('next', second.links)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from unittest import TestCase, main, mock
+
+from biz.queue.retry import RetryLater
+from biz.utils import http_client
+from biz.utils.rate_limiter import RateLimiter
+
+
+class TestHttpClient(TestCase):
+    def test_session_shared_per_host(self):
+        """同一主机复用同一个会话，不同主机使用独立会话"""
+        a = http_client.get_session('https://gitlab.example.com/api/v4/projects/1')
+        b = http_client.get_session('https://gitlab.example.com/api/v4/projects/2/notes')
+        c = http_client.get_session('https://api.github.com/repos/a/b')
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+
+    def test_retry_policy(self):
+        """429/5xx 重试并遵循 Retry-After"""
+        retry = http_client.get_session('https://gitlab.example.com').get_adapter('https://gitlab.example.com').max_retries
+        self.assertIn(429, retry.status_forcelist)
+        self.assertIn(503, retry.status_forcelist)
+        self.assertTrue(retry.respect_retry_after_header)
+        self.assertGreater(retry.backoff_jitter, 0)
+
+    def test_defer_only_for_queue_calls(self):
+        """额度耗尽时默认抛出 RetryLater；defer=False（dashboard 接口）返回服务端的限流响应"""
+        exhausted = mock.Mock(status_code=429, headers={'Retry-After': '600'})
+        session = mock.Mock()
+        session.request.return_value = exhausted
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.dict(os.environ, {'HTTP_RATE_LIMIT_ENABLED': '1', 'HTTP_CACHE_ENABLED': '0'}), \
+                mock.patch.object(http_client, 'get_rate_limiter',
+                                  return_value=RateLimiter(db_file=os.path.join(tmp_dir, 'queue.db'))), \
+                mock.patch.object(http_client, 'get_session', return_value=session):
+            self.assertIs(http_client.get('https://gitlab.example.com/api/v4/projects', defer=False), exhausted)
+            with self.assertRaises(RetryLater):
+                http_client.get('https://gitlab.example.com/api/v4/groups')
+
+
+if __name__ == '__main__':
+    main()
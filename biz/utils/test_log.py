@@ -0,0 +1,67 @@
+import logging
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.utils import log
+from biz.utils.log import (TruncatingFilter, debug_enabled, reset_log_project, set_log_project, summarize_changes,
+                           summarize_messages, truncated)
+
+CHANGES = [{'new_path': f'src/file_{i}.py', 'diff': '+' * 400} for i in range(8)]
+
+
+class TestLogHelpers(TestCase):
+    def setUp(self):
+        patcher = patch.object(log.logger, 'isEnabledFor', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_summarize_changes(self):
+        """diff 列表只输出摘要"""
+        self.assertEqual(str(summarize_changes(CHANGES)),
+                         '8 files, 3200 chars, ~800 tokens: [src/file_0.py, src/file_1.py, src/file_2.py, '
+                         'src/file_3.py, src/file_4.py (+3 more)]')
+        self.assertEqual(str(summarize_messages([{'role': 'user', 'content': 'x' * 40}])),
+                         '1 messages, 40 chars, ~10 tokens')
+
+    def test_truncated(self):
+        self.assertEqual(str(truncated('a' * 20, limit=5)), 'aaaaa...(20 chars)')
+        self.assertEqual(str(truncated('short', limit=5)), 'short')
+
+    def test_project_debug(self):
+        """LOG_DEBUG_PROJECTS 中的项目输出完整内容"""
+        with patch.object(log, 'log_debug_projects', {'group/app'}):
+            self.assertFalse(debug_enabled())
+            token = set_log_project('gitlab_com:group/app')
+            try:
+                self.assertTrue(debug_enabled())
+                self.assertEqual(str(summarize_changes(CHANGES[:1])), str(CHANGES[:1]))
+            finally:
+                reset_log_project(token)
+            self.assertFalse(debug_enabled())
+
+    def test_truncating_filter(self):
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, 'payload: %s', ('x' * 100,), None)
+        TruncatingFilter(20).filter(record)
+        self.assertEqual(record.getMessage(), 'payload: xxxxxxxxxxx...(truncated, 109 chars)')
+
+    def test_project_debug_output(self):
+        """logger 为 INFO 级别时，开启详细日志的项目的 DEBUG 日志以 INFO 输出且不截断"""
+        body = 'x' * 100
+        with patch.object(log.logger, 'isEnabledFor', side_effect=lambda level: level >= logging.INFO), \
+                patch.object(log.logger, 'handle') as handle, patch.object(log, 'log_debug_projects', {'group/app'}):
+            log.logger.debug("response: %s", truncated(body, limit=5))
+            handle.assert_not_called()
+            token = set_log_project('group/app')
+            try:
+                log.logger.debug("response: %s", truncated(body, limit=5))
+                record = handle.call_args.args[0]
+                self.assertEqual(record.levelno, logging.INFO)
+                self.assertEqual(record.funcName, 'test_project_debug_output')
+                TruncatingFilter(20).filter(record)
+                self.assertEqual(record.getMessage(), f'[DEBUG] response: {body}')
+            finally:
+                reset_log_project(token)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import contextvars
+import time
+from unittest import TestCase, main
+
+from biz.utils.parallel import run_parallel
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+class TestRunParallel(TestCase):
+    def test_runs_concurrently(self):
+        """总耗时取决于最慢的调用"""
+        started_at = time.time()
+        result = run_parallel({name: (lambda n=name: time.sleep(0.2) or n) for name in ('a', 'b', 'c')}, timeout=5)
+        self.assertEqual(result, {'a': 'a', 'b': 'b', 'c': 'c'})
+        self.assertLess(time.time() - started_at, 0.5)
+
+    def test_deadline(self):
+        """超过截止时间抛出 TimeoutError"""
+        with self.assertRaises(TimeoutError):
+            run_parallel({'slow': lambda: time.sleep(1), 'fast': lambda: 1}, timeout=0.1)
+
+    def test_error_propagates(self):
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            run_parallel({'fail': fail, 'ok': lambda: 1}, timeout=5)
+
+    def test_context_copied(self):
+        """调用在调用方上下文中执行"""
+        token = request_id.set('job-1')
+        try:
+            self.assertEqual(run_parallel({'id': request_id.get}, timeout=5), {'id': 'job-1'})
+        finally:
+            request_id.reset(token)
+
+
+if __name__ == '__main__':
+    main()
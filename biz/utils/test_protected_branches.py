@@ -0,0 +1,48 @@
+import os
+import tempfile
+from unittest import TestCase, main, mock
+
+from biz.utils import protected_branches
+from biz.utils.protected_branches import SqliteProtectedBranchStore, branch_protected, compile_patterns
+
+
+class TestProtectedBranches(TestCase):
+    def setUp(self):
+        """使用临时数据库文件"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        store = SqliteProtectedBranchStore(db_file=os.path.join(self.tmp_dir.name, 'queue.db'))
+        self.patcher = mock.patch.object(protected_branches, '_store', store)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmp_dir.cleanup()
+
+    def test_patterns(self):
+        regex = compile_patterns(('main', 'release/*'))
+        self.assertTrue(regex.match('release/1.0'))
+        self.assertTrue(regex.match('main'))
+        self.assertFalse(regex.match('feature/main'))
+        self.assertIsNone(compile_patterns(()))
+
+    def test_cache_hit_and_invalidate(self):
+        """缓存命中时不再调用 loader，失效后重新获取"""
+        loader = mock.Mock(return_value=['main'])
+        self.assertTrue(branch_protected('slug:1', 'main', loader))
+        self.assertFalse(branch_protected('slug:1', 'dev', loader))
+        self.assertEqual(loader.call_count, 1)
+
+        protected_branches.invalidate('slug:1')
+        branch_protected('slug:1', 'main', loader)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_loader_failure_not_cached(self):
+        """获取失败时按未受保护处理且不缓存"""
+        loader = mock.Mock(return_value=None)
+        self.assertFalse(branch_protected('slug:2', 'main', loader))
+        self.assertFalse(branch_protected('slug:2', 'main', loader))
+        self.assertEqual(loader.call_count, 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import tempfile
+import time
+from unittest import TestCase, main, mock
+
+from biz.queue.retry import RetryLater
+from biz.utils.rate_limiter import RateLimiter, rate_limit_scope
+
+
+def make_response(status_code: int = 200, **headers):
+    return mock.Mock(status_code=status_code, headers=headers)
+
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        """使用临时数据库文件"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.limiter = RateLimiter(db_file=os.path.join(self.tmp_dir.name, 'queue.db'), burst=2, max_wait=1)
+        self.scope = rate_limit_scope('https://api.github.com/repos/a/b', {'Authorization': 'token x'})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_scope_per_token(self):
+        other = rate_limit_scope('https://api.github.com/repos/a/b', {'Authorization': 'token y'})
+        self.assertNotEqual(self.scope, other)
+        self.assertTrue(self.scope.startswith('api.github.com:'))
+
+    def test_unknown_limit_not_throttled(self):
+        self.assertEqual(self.limiter.acquire(self.scope), 0.0)
+
+    def test_unknown_limit_no_write_lock(self):
+        """尚未学习到额度的范围只做普通读取，其他进程持有写锁时不会等待"""
+        other = sqlite3.connect(self.limiter.db_file, isolation_level=None)
+        other.execute('BEGIN IMMEDIATE')
+        try:
+            started_at = time.time()
+            self.assertEqual(self.limiter.acquire(self.scope), 0.0)
+            self.assertLess(time.time() - started_at, 1)
+        finally:
+            other.execute('ROLLBACK')
+            other.close()
+
+    def test_learn_and_pace(self):
+        """从响应头学习额度，令牌桶容量用完后按剩余额度 / 剩余时间发放"""
+        reset_at = str(int(time.time()) + 100)
+        self.limiter.observe(self.scope, make_response(**{'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': '50',
+                                                          'X-RateLimit-Reset': reset_at}))
+        self.assertEqual(self.limiter.acquire(self.scope), 0.0)
+        self.assertEqual(self.limiter.acquire(self.scope), 0.0)
+        # 桶已空，速率约 0.5/秒，需要等待约 2 秒，超过 max_wait 时延迟任务
+        with self.assertRaises(RetryLater):
+            self.limiter.acquire(self.scope)
+        self.assertGreater(self.limiter.acquire(self.scope, defer=False), 0)
+        self.assertEqual(self.limiter.stats()[0]['remaining'], 47)
+
+    def test_exhausted_response(self):
+        """403 且剩余额度为 0 时返回延迟时间，之后的请求直接延迟"""
+        reset_at = str(int(time.time()) + 600)
+        delay = self.limiter.observe(self.scope, make_response(403, **{'X-RateLimit-Limit': '5000',
+                                                                       'X-RateLimit-Remaining': '0',
+                                                                       'X-RateLimit-Reset': reset_at}))
+        self.assertGreater(delay, 500)
+        with self.assertRaises(RetryLater) as context:
+            self.limiter.acquire(self.scope)
+        self.assertGreater(context.exception.delay, 500)
+        self.assertEqual(self.limiter.stats()[0]['throttled'], 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,23 @@
+from functools import lru_cache
+from typing import List
+
 import tiktoken
 
 
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base") -> tiktoken.Encoding:
+    """
+    获取并缓存编码器，同一进程内只加载一次。
+
+    Args:
+        encoding_name (str): 编码器名称。
+
+    Returns:
+        tiktoken.Encoding: 编码器实例。
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
 def count_tokens(text: str) -> int:
     """
     计算文本的 token 数量。
@@ -11,10 +28,25 @@ def count_tokens(text: str) -> int:
     Returns:
         int: token 数量。
     """
-    encoding = tiktoken.get_encoding("cl100k_base")  # 适用于 OpenAI GPT 系列
+    encoding = get_encoding("cl100k_base")  # 适用于 OpenAI GPT 系列
     return len(encoding.encode(text))
 
 
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """
+    批量计算多段文本的 token 数量，由 tiktoken 在多个线程中并行编码。
+
+    Args:
+        texts (List[str]): 输入文本列表。
+
+    Returns:
+        List[int]: 与输入顺序一致的 token 数量。
+    """
+    encoding = get_encoding("cl100k_base")
+    # diff 中可能出现 <|endoftext|> 等特殊标记文本，按普通文本编码
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
 def truncate_text_by_tokens(text: str, max_tokens: int, encoding_name: str = "cl100k_base") -> str:
     """
     根据最大 token 数量截断文本。
@@ -28,7 +60,7 @@ def truncate_text_by_tokens(text: str, max_tokens: int, encoding_name: str = "cl
         str: 截断后的文本。
     """
     # 获取编码器
-    encoding = tiktoken.get_encoding(encoding_name)
+    encoding = get_encoding(encoding_name)
 
     # 将文本编码为 tokens
     tokens = encoding.encode(text)
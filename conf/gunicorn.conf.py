@@ -0,0 +1,50 @@
+"""
+gunicorn 配置：gunicorn -c conf/gunicorn.conf.py api:api_app
+
+通过 GUNICORN_GROUP 区分两组 worker，分别监听不同端口，nginx 按路径转发：
+- webhook：只处理 /review/webhook（以及 /api/health），其余路径返回 404，快速入队并返回，不会被 dashboard 的 pandas 统计查询拖慢
+- dashboard：处理 /api/* 与前端静态文件（同样可以接收 /review/webhook，兼容旧的 webhook 地址）
+- all：单组 worker 同时处理两类请求
+定时任务与队列消费者只会在所有 worker 中的一个进程内启动（见 biz/utils/leader.py）
+队列必须是跨进程共享的 sqlite 或 rq 驱动，QUEUE_DRIVER=async 时拒绝启动（见 serve.py）
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv("conf/.env")
+
+os.environ.setdefault('QUEUE_DRIVER', 'sqlite')
+if os.environ['QUEUE_DRIVER'] == 'async':
+    raise SystemExit("QUEUE_DRIVER=async 不支持 gunicorn 多 worker 部署，请设置 QUEUE_DRIVER=sqlite 或 rq")
+
+worker_group = os.getenv('GUNICORN_GROUP', 'all')
+
+if worker_group == 'webhook':
+    bind = f"0.0.0.0:{os.getenv('WEBHOOK_SERVER_PORT', 5002)}"
+    workers = int(os.getenv('GUNICORN_WEBHOOK_WORKERS', 2))
+else:
+    bind = f"0.0.0.0:{os.getenv('SERVER_PORT', 5001)}"
+    workers = int(os.getenv('GUNICORN_DASHBOARD_WORKERS', 2))
+
+proc_name = f'ai-codereview-{worker_group}'
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# 定期回收 worker，防止内存缓慢增长
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+# 在 master 中预加载应用，worker fork 后共享已导入的模块（pandas 等），启动更快、占用内存更少
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """每个 worker 竞争后台服务锁，只有一个进程运行定时任务与队列消费者"""
+    from api import start_background_services
+    from biz.utils.leader import run_as_leader
+
+    run_as_leader(start_background_services)
@@ -0,0 +1,65 @@
+"""
+发送给 LLM 的 diff 文本 token 对比
+
+对比旧方式 str(changes)（dict 列表的 repr）与 biz.utils.diff_model 渲染的紧凑 diff 文本，
+按文件统计平均 token 数（cl100k_base，与 REVIEW_MAX_TOKENS 的计算方式一致）与字符数。
+
+在项目根目录运行：python dev-tools/benchmarks/bench_diff_render.py [changes.json]
+不指定文件时使用生成的样例；changes.json 可以是 GitLab changes 接口的 changes 数组。
+"""
+import json
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from biz.gitlab.webhook_handler import filter_changes  # noqa: E402
+from biz.utils import diff_model  # noqa: E402
+from biz.utils.token_util import count_tokens  # noqa: E402
+
+
+def sample_changes(files: int, rng: random.Random) -> list:
+    changes = []
+    for i in range(files):
+        hunks = []
+        line = 1
+        for _ in range(rng.randint(1, 4)):
+            line += rng.randint(5, 80)
+            body = [f"     def handler_{i}_{line}(self, request):",
+                    f"         payload = request.get_json() or {{}}",
+                    f"-        name = payload['name']",
+                    f"+        name = payload.get('name', '').strip()",
+                    f"+        if not name:",
+                    f"+            return {{'error': \"name is required\"}}, 400",
+                    f"         return self.service.process(name)"]
+            hunks.append(f"@@ -{line},5 +{line},7 @@ class Handler{i}:\n" + '\n'.join(body) + '\n')
+        changes.append({'new_path': f'app/handlers/handler_{i}.py', 'old_path': f'app/handlers/handler_{i}.py',
+                        'diff': ''.join(hunks), 'new_file': False, 'renamed_file': False, 'deleted_file': False})
+    return changes
+
+
+def main():
+    logging.disable(logging.INFO)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as file:
+            raw = json.load(file)
+        raw = raw.get('changes', raw) if isinstance(raw, dict) else raw
+    else:
+        os.environ.setdefault('SUPPORTED_EXTENSIONS', '.py')
+        raw = sample_changes(200, random.Random(7))
+
+    changes = filter_changes(raw)
+    legacy_text = str(changes)
+    compact_text = diff_model.render(diff_model.from_changes(changes))
+    files = max(len(changes), 1)
+    for label, text in (('str(changes)', legacy_text), ('diff_model', compact_text)):
+        tokens = count_tokens(text)
+        print(f"{label:13} {tokens:8} tokens  {tokens / files:8.1f} tokens/file  {len(text):9} chars")
+    saved = 1 - count_tokens(compact_text) / max(count_tokens(legacy_text), 1)
+    print(f"{len(changes)} files, tokens saved: {saved:.1%}")
+
+
+if __name__ == '__main__':
+    main()
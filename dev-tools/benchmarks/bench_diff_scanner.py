@@ -0,0 +1,122 @@
+"""
+filter_changes 基准测试
+
+对比旧实现（每次解析 SUPPORTED_EXTENSIONS、any(endswith) 循环、两次 re.findall 构建匹配列表）
+与 biz.utils.diff_scanner 的耗时，覆盖以下场景：
+- 1,000 个文件的 MR（每个文件约 100 行 diff，其中 5% 为删除的文件）
+- 单个 100,000 行 diff 的文件
+- 单个 100,000 行的删除文件 diff（GitHub 按 diff 内容判断删除）
+
+在项目根目录运行：python dev-tools/benchmarks/bench_diff_scanner.py
+"""
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from biz.gitlab.webhook_handler import filter_changes  # noqa: E402
+from biz.github.webhook_handler import filter_changes as filter_github_changes  # noqa: E402
+
+EXTENSIONS = '.java,.py,.php,.go,.js,.ts,.vue,.kt'
+
+
+def legacy_filter_changes(changes: list):
+    supported_extensions = os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
+    filter_deleted_files_changes = [change for change in changes if not change.get("deleted_file")]
+    return [
+        {
+            'diff': item.get('diff', ''),
+            'new_path': item['new_path'],
+            'old_path': item.get('old_path'),
+            'new_file': item.get('new_file', False),
+            'renamed_file': item.get('renamed_file', False),
+            'additions': len(re.findall(r'^\+(?!\+\+)', item.get('diff', ''), re.MULTILINE)),
+            'deletions': len(re.findall(r'^-(?!--)', item.get('diff', ''), re.MULTILINE))
+        }
+        for item in filter_deleted_files_changes
+        if any(item.get('new_path', '').endswith(ext) for ext in supported_extensions)
+    ]
+
+
+def legacy_filter_github_changes(changes: list):
+    supported_extensions = os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
+    filtered_changes = []
+    for change in changes:
+        if change.get('status') == 'removed':
+            continue
+        diff = change.get('diff', '')
+        if diff and re.match(r'@@ -\d+,\d+ \+0,0 @@', diff):
+            if all(line.startswith('-') or not line for line in diff.split('\n')[1:]):
+                continue
+        if any(change.get('new_path', '').endswith(ext) for ext in supported_extensions):
+            filtered_changes.append({'diff': diff, 'new_path': change['new_path'],
+                                     'old_path': change.get('old_path'),
+                                     'status': change.get('status', ''),
+                                     'additions': change.get('additions', 0),
+                                     'deletions': change.get('deletions', 0)})
+    return filtered_changes
+
+
+def make_diff(lines: int, rng: random.Random) -> str:
+    body = []
+    for i in range(lines):
+        roll = rng.random()
+        body.append(('+' if roll < 0.3 else '-' if roll < 0.5 else ' ') + f'value_{i} = compute({i})')
+    return f'@@ -1,{lines} +1,{lines} @@\n' + '\n'.join(body) + '\n'
+
+
+def make_deleted_diff(lines: int) -> str:
+    return f'@@ -1,{lines} +0,0 @@\n' + '\n'.join(f'-line {i}' for i in range(lines)) + '\n'
+
+
+def make_changes(files: int, lines: int, rng: random.Random) -> list:
+    suffixes = ['.py', '.java', '.md', '.json', '.go', '.lock', '.ts']
+    changes = []
+    for i in range(files):
+        deleted = i % 20 == 0
+        changes.append({
+            'new_path': f'src/module_{i}/file_{i}{suffixes[i % len(suffixes)]}',
+            'diff': make_deleted_diff(lines) if deleted else make_diff(lines, rng),
+            'deleted_file': deleted,
+            'status': 'modified',
+        })
+    return changes
+
+
+def best_of(function, changes, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(changes)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def run(name: str, changes: list, repeat: int):
+    # 两种实现的过滤结果必须一致
+    assert legacy_filter_changes(changes) == filter_changes(changes)
+    assert legacy_filter_github_changes(changes) == filter_github_changes(changes)
+    print(f'{name}:')
+    for label, legacy, current in (('gitlab', legacy_filter_changes, filter_changes),
+                                   ('github', legacy_filter_github_changes, filter_github_changes)):
+        before = best_of(legacy, changes, repeat)
+        after = best_of(current, changes, repeat)
+        print(f'  {label:6} legacy {before:9.2f} ms   diff_scanner {after:9.2f} ms   x{before / max(after, 1e-6):.1f}')
+
+
+def main():
+    os.environ['SUPPORTED_EXTENSIONS'] = EXTENSIONS
+    # 只比较过滤本身的耗时
+    logging.disable(logging.INFO)
+    rng = random.Random(42)
+    run('1,000 files x 100 lines', make_changes(1000, 100, rng), repeat=5)
+    run('1 file x 100,000 lines', [{'new_path': 'src/huge.py', 'diff': make_diff(100_000, rng)}], repeat=5)
+    run('deleted file x 100,000 lines', [{'new_path': 'src/gone.py', 'diff': make_deleted_diff(100_000)}], repeat=5)
+
+
+if __name__ == '__main__':
+    main()
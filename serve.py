@@ -0,0 +1,63 @@
+"""
+生产环境启动入口：python serve.py
+
+分别启动 webhook 与 dashboard 两组 gunicorn worker（配置见 conf/gunicorn.conf.py），
+并把 SIGTERM/SIGINT（优雅退出）与 SIGHUP（优雅重载 worker）转发给两组 gunicorn；任一组退出时整体退出，由容器或 supervisor 重启
+设置 GUNICORN_GROUPS=all 可只启动一组 worker 同时处理两类请求
+
+多 worker 部署不支持 QUEUE_DRIVER=async：每个 worker 各自持有内存队列与工作进程池，worker 回收或重载时排队中的任务丢失，
+准入控制与合并也只在单个进程内生效。未设置 QUEUE_DRIVER 时使用持久化的 sqlite 队列，显式设置为 async 时拒绝启动。
+"""
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv("conf/.env")
+
+from biz.utils.config_checker import check_config
+from biz.utils.log import logger
+
+
+def check_queue_driver():
+    os.environ.setdefault('QUEUE_DRIVER', 'sqlite')
+    if os.environ['QUEUE_DRIVER'] == 'async':
+        logger.error("QUEUE_DRIVER=async 只适用于单进程的开发服务器（python api.py），"
+                     "多 worker 部署请设置 QUEUE_DRIVER=sqlite 或 rq")
+        sys.exit(1)
+
+
+def main():
+    check_config()
+    check_queue_driver()
+    groups = [group.strip() for group in os.getenv('GUNICORN_GROUPS', 'webhook,dashboard').split(',') if group.strip()]
+    processes = []
+    for group in groups:
+        env = dict(os.environ, GUNICORN_GROUP=group)
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'conf/gunicorn.conf.py', 'api:api_app'], env=env))
+        logger.info(f"已启动 gunicorn({group})")
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signum)
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    try:
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    finally:
+        forward(signal.SIGTERM, None)
+        for process in processes:
+            process.wait()
+    sys.exit(max(process.returncode or 0 for process in processes))
+
+
+if __name__ == '__main__':
+    main()